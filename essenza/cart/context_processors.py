@@ -0,0 +1,12 @@
+from django.utils.functional import SimpleLazyObject
+
+from .services import cart_item_count
+
+
+def cart(request):
+    """
+    ``cart_item_count`` para el icono del carrito de ``base.html``. Se evalúa
+    solo si la plantilla lo usa y sale de la caché o de la sesión, sin
+    consultas (ver ``cart.services.cart_item_count``).
+    """
+    return {"cart_item_count": SimpleLazyObject(lambda: cart_item_count(request))}
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:07
+
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    Cart = apps.get_model("cart", "Cart")
+    CartProduct = apps.get_model("cart", "CartProduct")
+    Product = apps.get_model("product", "Product")
+
+    # Varios carritos del mismo usuario: las líneas pasan al más antiguo
+    carts = (
+        Cart.objects.values("user_id")
+        .annotate(keep=Min("pk"), carts=Count("pk"))
+        .filter(carts__gt=1)
+        .order_by()
+    )
+    for row in carts:
+        CartProduct.objects.filter(cart__user_id=row["user_id"]).update(
+            cart_id=row["keep"]
+        )
+        Cart.objects.filter(user_id=row["user_id"]).exclude(pk=row["keep"]).delete()
+
+    # Varias líneas del mismo producto: se suman, sin pasar del stock
+    lines = list(
+        CartProduct.objects.values("cart_id", "product_id")
+        .annotate(keep=Min("pk"), quantity=Sum("quantity"), lines=Count("pk"))
+        .filter(lines__gt=1)
+        .order_by()
+    )
+    stock = dict(
+        Product.objects.filter(
+            pk__in=[row["product_id"] for row in lines]
+        ).values_list("pk", "stock")
+    )
+    for row in lines:
+        same = CartProduct.objects.filter(
+            cart_id=row["cart_id"], product_id=row["product_id"]
+        )
+        quantity = max(min(row["quantity"], stock[row["product_id"]]), 1)
+        same.filter(pk=row["keep"]).update(quantity=quantity)
+        same.exclude(pk=row["keep"]).delete()
+
+
+class Migration(migrations.Migration):
+    # Solo datos: las restricciones van en 0003. En PostgreSQL, crear los
+    # índices únicos en la misma transacción que estos UPDATE/DELETE falla
+    # con "pending trigger events" (claves ajenas diferidas)
+
+    dependencies = [
+        ("cart", "0001_initial"),
+        ("product", "0005_product_updated_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
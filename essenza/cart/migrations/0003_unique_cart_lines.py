@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cart", "0002_merge_duplicate_cart_lines"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="cart",
+            constraint=models.UniqueConstraint(
+                fields=("user",), name="unique_cart_per_user"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="cartproduct",
+            constraint=models.UniqueConstraint(
+                fields=("cart", "product"), name="unique_cart_product"
+            ),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F, Sum
 
 
 class Cart(models.Model):
@@ -6,12 +7,19 @@ class Cart(models.Model):
         "user.Usuario", on_delete=models.CASCADE, related_name="cart"
     )
 
+    class Meta:
+        constraints = [
+            # Un carrito por usuario: las peticiones simultáneas no crean otro
+            models.UniqueConstraint(fields=["user"], name="unique_cart_per_user"),
+        ]
+
     @property
     def total_price(self):
-        total = 0
-        for product in self.cart_products.all():
-            total += product.subtotal
-        return total
+        # Para listar las líneas con sus totales, ver cart.services
+        total = self.cart_products.aggregate(
+            total=Sum(F("quantity") * F("product__price"))
+        )["total"]
+        return total or 0
 
     def __str__(self):
         return f"Cart {self.id} by {self.user.email}"
@@ -26,6 +34,15 @@ class CartProduct(models.Model):
     )
     quantity = models.IntegerField()
 
+    class Meta:
+        constraints = [
+            # Una línea por producto; las cantidades se suman con UPDATE
+            # atómicos (ver cart.services.add_to_cart)
+            models.UniqueConstraint(
+                fields=["cart", "product"], name="unique_cart_product"
+            ),
+        ]
+
     @property
     def subtotal(self):
         return self.quantity * self.product.price
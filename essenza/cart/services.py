@@ -0,0 +1,229 @@
+"""
+Resumen del carrito (líneas, subtotales, total y número de unidades) para la
+página del carrito, el checkout y la página de éxito.
+
+El carrito de un usuario se lee en una sola consulta: las líneas con su
+producto (``select_related``) y el total y las unidades calculados en la base
+de datos con ``Sum`` como ventana sobre las mismas filas. El de un invitado
+vive en la sesión (``cart_session``) y solo necesita una consulta para los
+productos.
+
+El contador de unidades del icono del carrito (``cart_item_count``) se lee de
+la caché compartida para los usuarios y de la sesión para los invitados, así
+que no consulta la base de datos en cada página. Las vistas que cambian el
+carrito lo actualizan con ``refresh_cart_count``.
+"""
+
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Value, Window
+from django.db.models.functions import Least
+from product.models import Product
+
+from .models import Cart, CartProduct
+
+SESSION_KEY = "cart_session"
+# Las vistas del carrito mantienen el contador al día; si cambia por otro camino
+# (admin, shell, borrados en cascada) el icono se corrige como mucho en 5 minutos
+COUNT_TIMEOUT = 5 * 60
+
+LINE_TOTAL = ExpressionWrapper(
+    F("quantity") * F("product__price"),
+    output_field=DecimalField(max_digits=12, decimal_places=2),
+)
+
+
+@dataclass
+class CartLine:
+    # En el carrito de base de datos es el id del CartProduct; en el de
+    # sesión, el del producto (lo que esperan las vistas de actualizar/borrar)
+    pk: int
+    product: Product
+    quantity: int
+    subtotal: Decimal
+
+
+@dataclass
+class CartSummary:
+    lines: list = field(default_factory=list)
+    total_price: Decimal = Decimal("0")
+    item_count: int = 0
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+
+def user_cart_summary(user):
+    rows = (
+        CartProduct.objects.filter(cart__user=user)
+        .select_related("product")
+        .annotate(
+            line_total=LINE_TOTAL,
+            cart_total=Window(Sum(LINE_TOTAL)),
+            cart_items=Window(Sum("quantity")),
+        )
+        .order_by("pk")
+    )
+    summary = CartSummary()
+    for row in rows:
+        summary.lines.append(
+            CartLine(row.pk, row.product, row.quantity, row.line_total)
+        )
+        summary.total_price, summary.item_count = row.cart_total, row.cart_items
+    return summary
+
+
+def session_cart_summary(session):
+    cart_session = session.get(SESSION_KEY) or {}
+    products = Product.objects.in_bulk([int(pk) for pk in cart_session])
+    summary = CartSummary()
+    for pk, data in cart_session.items():
+        product = products.get(int(pk))
+        if product is None:
+            # Producto borrado después de añadirlo
+            continue
+        quantity = data["quantity"]
+        subtotal = quantity * product.price
+        summary.lines.append(CartLine(product.pk, product, quantity, subtotal))
+        summary.total_price += subtotal
+        summary.item_count += quantity
+    return summary
+
+
+def get_cart_summary(request):
+    """Resumen del carrito de quien hace la petición (base de datos o sesión)."""
+    if request.user.is_authenticated:
+        return user_cart_summary(request.user)
+    return session_cart_summary(request.session)
+
+
+def _locked_cart(user):
+    """
+    Carrito de ``user`` bloqueado (``SELECT ... FOR UPDATE``) hasta el final
+    de la transacción. ``add_to_cart`` y ``merge_session_cart`` leen y suman
+    cantidades, así que se ejecutan de una en una para cada usuario.
+    """
+    cart, _ = Cart.objects.select_for_update().get_or_create(user=user)
+    return cart
+
+
+def add_to_cart(user, product, quantity):
+    """
+    Suma ``quantity`` unidades de ``product`` al carrito de ``user`` sin pasar
+    de las disponibles (stock menos reservas) y devuelve el id de la línea, o
+    ``None`` sin tocar el carrito si no queda ninguna. Con el carrito
+    bloqueado, la suma es un UPDATE con ``F()`` y la línea se crea solo si no
+    existía, así que las peticiones simultáneas no pierden unidades ni
+    duplican líneas.
+    """
+    available = product.available
+    if available <= 0:
+        return None
+    with transaction.atomic():
+        cart = _locked_cart(user)
+        line = CartProduct.objects.filter(cart=cart, product=product)
+        if line.update(quantity=Least(F("quantity") + quantity, Value(available))):
+            return line.values_list("pk", flat=True).get()
+        return CartProduct.objects.create(
+            cart=cart, product=product, quantity=min(quantity, available)
+        ).pk
+
+
+def merge_session_cart(user, session):
+    """
+    Pasa el carrito de invitado de ``session`` al carrito de ``user`` (al
+    iniciar sesión, ver ``cart.signals``). Las cantidades se suman a las que
+    ya tuviera, sin pasar de las unidades disponibles. Número fijo de
+    consultas sea cual sea el tamaño del carrito: los productos en una, el
+    carrito (bloqueado, para que un ``add_to_cart`` simultáneo no se pierda)
+    en otra, las líneas existentes en otra y todas las líneas nuevas o sumadas
+    en un único INSERT ... ON CONFLICT.
+    """
+    cart_session = session.get(SESSION_KEY)
+    if not cart_session:
+        return
+    products = Product.objects.in_bulk([int(pk) for pk in cart_session])
+    wanted = {}
+    for pk, data in cart_session.items():
+        product = products.get(int(pk))
+        # Productos borrados o agotados desde que se añadieron
+        if product is not None and product.available > 0:
+            wanted[product.pk] = data["quantity"]
+    if wanted:
+        with transaction.atomic():
+            cart = _locked_cart(user)
+            existing = dict(
+                CartProduct.objects.filter(
+                    cart=cart, product_id__in=wanted
+                ).values_list("product_id", "quantity")
+            )
+            CartProduct.objects.bulk_create(
+                [
+                    CartProduct(
+                        cart=cart,
+                        product_id=pk,
+                        quantity=min(
+                            existing.get(pk, 0) + quantity, products[pk].available
+                        ),
+                    )
+                    for pk, quantity in wanted.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["cart", "product"],
+                update_fields=["quantity"],
+            )
+        forget_cart_count(user.pk)
+    session[SESSION_KEY] = {}
+    session.modified = True
+
+
+def clear_cart(request):
+    """Vacía el carrito de quien hace la petición."""
+    if request.user.is_authenticated:
+        request.user.cart.all().delete()
+        set_cart_count(request.user.pk, 0)
+    elif request.session.get(SESSION_KEY):
+        request.session[SESSION_KEY] = {}
+        request.session.modified = True
+
+
+def _count_key(user_id):
+    return f"cart_count:{user_id}"
+
+
+def refresh_cart_count(user_id):
+    """Recalcula (una consulta) y guarda el contador de unidades del usuario."""
+    count = (
+        CartProduct.objects.filter(cart__user_id=user_id).aggregate(
+            count=Sum("quantity")
+        )["count"]
+        or 0
+    )
+    set_cart_count(user_id, count)
+    return count
+
+
+def set_cart_count(user_id, count):
+    cache.set(_count_key(user_id), count, COUNT_TIMEOUT)
+
+
+def forget_cart_count(user_id):
+    """Descarta el contador; la próxima lectura lo recalcula."""
+    cache.delete(_count_key(user_id))
+
+
+def cart_item_count(request):
+    """Unidades en el carrito de quien hace la petición."""
+    if request.user.is_authenticated:
+        count = cache.get(_count_key(request.user.pk))
+        if count is None:
+            count = refresh_cart_count(request.user.pk)
+        return count
+    cart_session = request.session.get(SESSION_KEY) or {}
+    return sum(item["quantity"] for item in cart_session.values())
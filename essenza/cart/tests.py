@@ -1,9 +1,25 @@
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache as django_cache
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from product.models import Category, Product
 
 from cart.models import Cart, CartProduct
+from cart.services import (
+    COUNT_TIMEOUT,
+    add_to_cart,
+    merge_session_cart,
+    session_cart_summary,
+    user_cart_summary,
+)
 
 # Usamos get_user_model() porque usas un usuario personalizado (user.Usuario)
 User = get_user_model()
@@ -202,3 +218,480 @@ class CartTests(TestCase):
         self.assertRedirects(response, self.url_detail)
         session = self.client.session
         self.assertNotIn(str(self.product.pk), session["cart_session"])
+
+
+class CartSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="resumen", email="resumen@example.com", password="pass"
+        )
+        cls.products = [
+            Product.objects.create(
+                name=f"Producto {i}",
+                description="Descripción",
+                category=Category.MAQUILLAJE,
+                brand="Marca",
+                price=Decimal("9.99"),
+                stock=50,
+                is_active=True,
+            )
+            for i in range(6)
+        ]
+
+    def _fill_db_cart(self, size):
+        cart = Cart.objects.create(user=self.user)
+        CartProduct.objects.bulk_create(
+            CartProduct(cart=cart, product=product, quantity=3)
+            for product in self.products[:size]
+        )
+        return cart
+
+    def _count_queries(self, fn):
+        with CaptureQueriesContext(connection) as ctx:
+            fn()
+        return len(ctx.captured_queries)
+
+    def test_user_summary_single_query(self):
+        self._fill_db_cart(6)
+        with self.assertNumQueries(1):
+            summary = user_cart_summary(self.user)
+            names = [line.product.name for line in summary]
+        self.assertEqual(len(names), 6)
+        self.assertEqual(summary.total_price, Decimal("179.82"))
+        self.assertEqual(summary.item_count, 18)
+        self.assertEqual(summary.lines[0].subtotal, Decimal("29.97"))
+
+    def test_session_summary_single_query(self):
+        session = {
+            "cart_session": {
+                str(product.pk): {"quantity": 2, "price": "9.99"}
+                for product in self.products
+            }
+        }
+        session["cart_session"]["999999"] = {"quantity": 1, "price": "1.00"}
+        with self.assertNumQueries(1):
+            summary = session_cart_summary(session)
+        self.assertEqual(len(summary), 6)
+        self.assertEqual(summary.total_price, Decimal("119.88"))
+        self.assertEqual(summary.item_count, 12)
+
+    def test_empty_carts(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(session_cart_summary({}))
+        summary = user_cart_summary(self.user)
+        self.assertEqual((len(summary), summary.total_price), (0, 0))
+
+    def test_cart_detail_queries_do_not_grow_with_lines(self):
+        self.client.force_login(self.user)
+        cart = self._fill_db_cart(1)
+        small = self._count_queries(lambda: self.client.get(reverse("cart_detail")))
+        CartProduct.objects.bulk_create(
+            CartProduct(cart=cart, product=product, quantity=1)
+            for product in self.products[1:]
+        )
+        response = self.client.get(reverse("cart_detail"))
+        large = self._count_queries(lambda: self.client.get(reverse("cart_detail")))
+        self.assertEqual(small, large)
+        self.assertEqual(response.context["item_count"], 8)
+        self.assertContains(response, "Producto 5")
+
+    @mock.patch("order.views.stripe.checkout.Session.create")
+    def test_checkout_queries_do_not_grow_with_lines(self, create_session):
+        create_session.return_value = mock.Mock(url="https://stripe.test/pay")
+        counts = []
+        for size in (1, 6):
+            # Sesión nueva: sin reserva anterior que liberar
+            self.client.force_login(self.user)
+            self._fill_db_cart(size)
+            counts.append(
+                self._count_queries(lambda: self.client.get(reverse("create_checkout")))
+            )
+            Cart.objects.filter(user=self.user).delete()
+            self.client.logout()
+        self.assertEqual(counts[0], counts[1])
+
+        line_items = create_session.call_args.kwargs["line_items"]
+        self.assertEqual(len(line_items), 6)
+        self.assertEqual(line_items[0]["price_data"]["unit_amount"], 999)
+        self.assertEqual(line_items[0]["quantity"], 3)
+
+
+class CartBadgeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="badge", email="badge@example.com", password="pass"
+        )
+        cls.product = Product.objects.create(
+            name="Producto Badge",
+            description="Descripción",
+            category=Category.CABELLO,
+            brand="Marca",
+            price=Decimal("5.00"),
+            stock=20,
+            is_active=True,
+        )
+
+    def setUp(self):
+        django_cache.clear()
+
+    def _badge(self, response):
+        return response.context["cart_item_count"]
+
+    def test_counter_follows_cart_changes(self):
+        self.client.force_login(self.user)
+        url = reverse("catalog")
+        self.assertEqual(self._badge(self.client.get(url)), 0)
+
+        self.client.post(
+            reverse("add_to_cart", args=[self.product.pk]), {"quantity": 3}
+        )
+        self.assertEqual(self._badge(self.client.get(url)), 3)
+
+        line = CartProduct.objects.get()
+        self.client.post(reverse("update_cart_item", args=[line.pk]), {"quantity": 5})
+        response = self.client.get(url)
+        self.assertEqual(self._badge(response), 5)
+        self.assertContains(response, 'id="cartBadge">5</span>')
+
+        self.client.post(reverse("remove_from_cart", args=[line.pk]))
+        self.assertEqual(self._badge(self.client.get(url)), 0)
+
+    def test_warm_counter_needs_no_queries(self):
+        self.client.force_login(self.user)
+        self.client.post(
+            reverse("add_to_cart", args=[self.product.pk]), {"quantity": 2}
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("catalog"))
+        self.assertContains(response, 'id="cartBadge">2</span>')
+        self.assertFalse(
+            [q for q in ctx.captured_queries if "cart_cartproduct" in q["sql"]]
+        )
+
+    def test_counter_changed_elsewhere_expires(self):
+        self.client.force_login(self.user)
+        self.client.post(
+            reverse("add_to_cart", args=[self.product.pk]), {"quantity": 2}
+        )
+        # Un cambio que no pasa por las vistas (p. ej. el admin)
+        CartProduct.objects.update(quantity=7)
+        self.assertEqual(self._badge(self.client.get(reverse("catalog"))), 2)
+
+        later = time.time() + COUNT_TIMEOUT + 1
+        with mock.patch("time.time", return_value=later):
+            response = self.client.get(reverse("catalog"))
+        self.assertEqual(self._badge(response), 7)
+
+    def test_anonymous_counter_reads_session(self):
+        session = self.client.session
+        session["cart_session"] = {
+            str(self.product.pk): {"quantity": 4, "price": "5.00"}
+        }
+        session.save()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("catalog"))
+        self.assertEqual(self._badge(response), 4)
+        self.assertFalse(
+            [q for q in ctx.captured_queries if "cart_cartproduct" in q["sql"]]
+        )
+
+
+class CartAjaxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="ajax", email="ajax@example.com", password="pass"
+        )
+        cls.product = Product.objects.create(
+            name="Producto Ajax",
+            description="Descripción",
+            category=Category.PERFUME,
+            brand="Marca",
+            price=Decimal("1250.50"),
+            stock=10,
+            is_active=True,
+        )
+        cls.other = Product.objects.create(
+            name="Otro Producto",
+            description="Descripción",
+            category=Category.PERFUME,
+            brand="Marca",
+            price=Decimal("2.00"),
+            stock=10,
+            is_active=True,
+        )
+
+    def setUp(self):
+        django_cache.clear()
+
+    def _post(self, name, pk, **data):
+        return self.client.post(
+            reverse(name, args=[pk]), data, HTTP_ACCEPT="application/json"
+        )
+
+    def test_update_returns_line_and_totals(self):
+        self.client.force_login(self.user)
+        cart = Cart.objects.create(user=self.user)
+        line = CartProduct.objects.create(cart=cart, product=self.product, quantity=1)
+        CartProduct.objects.create(cart=cart, product=self.other, quantity=1)
+
+        response = self._post("update_cart_item", line.pk, quantity=2)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            data["line"], {"pk": line.pk, "quantity": 2, "subtotal": "2501.00"}
+        )
+        self.assertIn(f'data-line-pk="{line.pk}"', data["line_html"])
+        self.assertIn('value="2"', data["line_html"])
+        self.assertEqual(data["total_price"], "2503.00")
+        # Mismo formato que la página completa
+        self.assertContains(
+            self.client.get(reverse("cart_detail")),
+            f'<span id="cartTotal">{data["total_display"]}</span>',
+        )
+        self.assertEqual(data["item_count"], 3)
+        # El contador del icono queda al día
+        page = self.client.get(reverse("catalog"))
+        self.assertEqual(page.context["cart_item_count"], 3)
+
+    def test_remove_returns_no_line(self):
+        self.client.force_login(self.user)
+        cart = Cart.objects.create(user=self.user)
+        line = CartProduct.objects.create(cart=cart, product=self.product, quantity=1)
+
+        data = self._post("remove_from_cart", line.pk).json()
+
+        self.assertIsNone(data["line"])
+        self.assertIsNone(data["line_html"])
+        self.assertEqual(data["item_count"], 0)
+        self.assertFalse(CartProduct.objects.exists())
+
+    def test_anonymous_add_and_zero_quantity(self):
+        data = self._post("add_to_cart", self.other.pk, quantity=3).json()
+        self.assertEqual(data["line"]["pk"], self.other.pk)
+        self.assertEqual(data["item_count"], 3)
+
+        data = self._post("update_cart_item", self.other.pk, quantity=0).json()
+        self.assertIsNone(data["line"])
+        self.assertEqual(data["item_count"], 0)
+
+    def test_out_of_stock_add_is_a_conflict(self):
+        Product.objects.filter(pk=self.other.pk).update(stock=0)
+        response = self._post("add_to_cart", self.other.pk)
+        self.assertEqual(response.status_code, 409)
+
+        Product.objects.filter(pk=self.other.pk).update(stock=2, held=2)
+        response = self._post("add_to_cart", self.other.pk)
+        self.assertEqual(response.status_code, 409)
+
+    def test_html_forms_still_redirect(self):
+        response = self.client.post(
+            reverse("add_to_cart", args=[self.other.pk]),
+            {"quantity": 1},
+            HTTP_ACCEPT="text/html,application/xhtml+xml,*/*;q=0.8",
+        )
+        self.assertRedirects(response, reverse("cart_detail"))
+
+
+class CartConstraintTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="unico", email="unico@example.com", password="pass"
+        )
+        cls.product = Product.objects.create(
+            name="Producto Único",
+            description="Descripción",
+            category=Category.MAQUILLAJE,
+            brand="Marca",
+            price=Decimal("3.00"),
+            stock=5,
+            is_active=True,
+        )
+
+    def test_one_cart_per_user_and_one_line_per_product(self):
+        cart = Cart.objects.create(user=self.user)
+        CartProduct.objects.create(cart=cart, product=self.product, quantity=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartProduct.objects.create(cart=cart, product=self.product, quantity=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Cart.objects.create(user=self.user)
+
+    def test_add_to_cart_sums_and_caps_at_stock(self):
+        first = add_to_cart(self.user, self.product, 2)
+        self.assertEqual(add_to_cart(self.user, self.product, 2), first)
+        self.assertEqual(CartProduct.objects.get().quantity, 4)
+        add_to_cart(self.user, self.product, 10)
+        self.assertEqual(CartProduct.objects.get().quantity, 5)
+
+    def test_add_to_cart_ignores_held_units(self):
+        """Las unidades reservadas por otros checkouts no cuentan como stock."""
+        Product.objects.filter(pk=self.product.pk).update(held=3)
+        self.product.refresh_from_db()
+        add_to_cart(self.user, self.product, 10)
+        self.assertEqual(CartProduct.objects.get().quantity, 2)
+
+        Product.objects.filter(pk=self.product.pk).update(held=5)
+        self.product.refresh_from_db()
+        self.assertIsNone(add_to_cart(self.user, self.product, 1))
+        # La línea existente no baja a 0 ni se crea una nueva vacía
+        self.assertEqual(CartProduct.objects.get().quantity, 2)
+
+    def test_add_to_cart_skips_sold_out_products(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=0)
+        self.product.refresh_from_db()
+        self.assertIsNone(add_to_cart(self.user, self.product, 1))
+        self.assertFalse(CartProduct.objects.exists())
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    """Muchas peticiones de añadir al carrito a la vez para el mismo usuario."""
+
+    REQUESTS = 16
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="prisas", email="prisas@example.com", password="pass"
+        )
+        self.product = Product.objects.create(
+            name="Producto Concurrido",
+            description="Descripción",
+            category=Category.MAQUILLAJE,
+            brand="Marca",
+            price=Decimal("4.00"),
+            stock=100,
+            is_active=True,
+        )
+
+    def _add(self):
+        add_to_cart(self.user, self.product, 1)
+
+    def _merge(self):
+        session = SessionStore()
+        session["cart_session"] = {str(self.product.pk): {"quantity": 1}}
+        merge_session_cart(self.user, session)
+
+    def _run(self, action, barrier, errors):
+        try:
+            barrier.wait()
+            # SQLite en memoria no espera a los bloqueos: se reintenta la
+            # transacción entera, que se ha deshecho
+            for attempt in range(100):
+                try:
+                    action()
+                    break
+                except OperationalError:
+                    time.sleep(0.01 * (attempt % 5 + 1))
+            else:
+                errors.append("bloqueado")
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def _hammer(self, actions=None):
+        actions = actions or [self._add] * self.REQUESTS
+        barrier = threading.Barrier(len(actions))
+        errors = []
+        threads = [
+            threading.Thread(target=self._run, args=(action, barrier, errors))
+            for action in actions
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_no_lost_units_or_duplicate_rows(self):
+        self._hammer()
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(CartProduct.objects.get().quantity, self.REQUESTS)
+
+    def test_concurrent_adds_stop_at_stock(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=5)
+        self.product.refresh_from_db()
+        self._hammer()
+        self.assertEqual(CartProduct.objects.get().quantity, 5)
+
+    def test_merges_and_adds_at_once_keep_every_unit(self):
+        self._hammer([self._add, self._merge] * (self.REQUESTS // 2))
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(CartProduct.objects.get().quantity, self.REQUESTS)
+
+
+class CartMergeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="fusion", email="fusion@example.com", password="pass1234"
+        )
+        cls.products = [
+            Product.objects.create(
+                name=f"Producto Fusión {i}",
+                description="Descripción",
+                category=Category.PERFUME,
+                brand="Marca",
+                price=Decimal("7.00"),
+                stock=5,
+                is_active=True,
+            )
+            for i in range(20)
+        ]
+
+    def setUp(self):
+        django_cache.clear()
+
+    def _session(self, quantities):
+        return {
+            "cart_session": {
+                str(pk): {"quantity": qty, "price": "7.00"}
+                for pk, qty in quantities.items()
+            }
+        }
+
+    def test_login_merges_guest_cart(self):
+        first, second, sold_out = self.products[:3]
+        Product.objects.filter(pk=sold_out.pk).update(stock=0)
+        cart = Cart.objects.create(user=self.user)
+        CartProduct.objects.create(cart=cart, product=first, quantity=4)
+
+        session = self.client.session
+        session.update(
+            self._session({first.pk: 3, second.pk: 2, sold_out.pk: 1, 999999: 1})
+        )
+        session.save()
+        response = self.client.post(
+            reverse("login"), {"email": "fusion@example.com", "password": "pass1234"}
+        )
+        self.assertRedirects(
+            response, reverse("dashboard"), fetch_redirect_response=False
+        )
+
+        lines = dict(
+            CartProduct.objects.filter(cart__user=self.user).values_list(
+                "product_id", "quantity"
+            )
+        )
+        # 4 + 3 se queda en el stock (5); el agotado y el borrado no pasan
+        self.assertEqual(lines, {first.pk: 5, second.pk: 2})
+        self.assertEqual(self.client.session["cart_session"], {})
+        page = self.client.get(reverse("catalog"))
+        self.assertEqual(page.context["cart_item_count"], 7)
+
+    def test_merge_queries_do_not_grow_with_cart_size(self):
+        Cart.objects.create(user=self.user)
+        counts = []
+        for size in (2, 20):
+            session = SessionStore()
+            session.update(self._session({p.pk: 1 for p in self.products[:size]}))
+            with CaptureQueriesContext(connection) as ctx:
+                merge_session_cart(self.user, session)
+            counts.append(len(ctx.captured_queries))
+            self.assertEqual(
+                CartProduct.objects.filter(cart__user=self.user).count(), size
+            )
+        self.assertEqual(counts[0], counts[1])
@@ -1,8 +1,62 @@
+from django.contrib.humanize.templatetags.humanize import intcomma
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.defaultfilters import floatformat
+from django.template.loader import render_to_string
 from django.views import View
 from product.models import Product
 
 from .models import Cart, CartProduct
+from .services import (
+    add_to_cart,
+    get_cart_summary,
+    refresh_cart_count,
+    set_cart_count,
+)
+
+
+def wants_json(request):
+    """
+    Las peticiones de ``cart_detail.html`` piden ``application/json``; los
+    formularios normales (``text/html``) siguen recibiendo la redirección.
+    """
+    preferred = request.get_preferred_type(["text/html", "application/json"])
+    return preferred == "application/json"
+
+
+def cart_response(request, line_pk):
+    """
+    Respuesta de las vistas que modifican el carrito: redirección al carrito
+    o, si se pide JSON, solo la línea cambiada (datos y HTML, ``None`` si se
+    ha eliminado), los totales y el contador del icono, con una única
+    consulta al carrito.
+    """
+    if not wants_json(request):
+        if request.user.is_authenticated:
+            refresh_cart_count(request.user.pk)
+        return redirect("cart_detail")
+
+    summary = get_cart_summary(request)
+    if request.user.is_authenticated:
+        set_cart_count(request.user.pk, summary.item_count)
+    data = {
+        "line": None,
+        "line_html": None,
+        "total_price": f"{summary.total_price:.2f}",
+        "total_display": intcomma(floatformat(summary.total_price, 2)),
+        "item_count": summary.item_count,
+    }
+    line = next((line for line in summary if line.pk == line_pk), None)
+    if line is not None:
+        data["line"] = {
+            "pk": line.pk,
+            "quantity": line.quantity,
+            "subtotal": f"{line.subtotal:.2f}",
+        }
+        data["line_html"] = render_to_string(
+            "cart/cart_line.html", {"item": line}, request
+        )
+    return JsonResponse(data)
 
 
 class CartDetailView(View):
@@ -10,55 +64,21 @@ class CartDetailView(View):
     Muestra el carrito.
     - Si es usuario logueado: Lee de la base de datos
     - Si es anónimo: Lee de la sesión
+    En ambos casos con una consulta fija (ver cart.services).
     """
 
     template_name = "cart/cart_detail.html"
 
     def get(self, request):
-        context = {"cart_products": [], "total_price": 0}
-
-        # Si esta logueado
+        summary = get_cart_summary(request)
         if request.user.is_authenticated:
-            # Busca un carrito exitente y si no lo hay, lo crea nuevo
-            try:
-                cart = get_object_or_404(Cart, user=request.user)
-                # Cogemos los datos del carrito desde la base de datos
-                context["cart_products"] = cart.cart_products.all()
-                context["total_price"] = cart.total_price
-                context["cart"] = cart
-            except Exception:
-                pass
-
-        # Si no está logueado, usamos la sesión
-        else:
-            cart_session = request.session.get("cart_session", {})
-            cart_products = []
-            total_price = 0
-
-            if cart_session:
-                # Obtenemos los productos
-                product_ids = [int(pk) for pk in cart_session.keys()]
-                products = Product.objects.filter(pk__in=product_ids)
-
-                # Construimos los items del carrito
-                for product in products:
-                    quantity = cart_session[str(product.pk)]["quantity"]
-                    subtotal = quantity * product.price
-
-                    # Añadimos al listado de items del carrito la info necesaria
-                    cart_products.append(
-                        {
-                            "product": product,
-                            "quantity": quantity,
-                            "subtotal": subtotal,
-                            "pk": product.pk,
-                        }
-                    )
-                    total_price += subtotal
-
-            context["cart_products"] = cart_products
-            context["total_price"] = total_price
-
+            # Ya tenemos las unidades: de paso se sincroniza el contador
+            set_cart_count(request.user.pk, summary.item_count)
+        context = {
+            "cart_products": summary.lines,
+            "total_price": summary.total_price,
+            "item_count": summary.item_count,
+        }
         return render(request, self.template_name, context)
 
 
@@ -70,7 +90,10 @@ class AddToCartView(View):
     def post(self, request, product_id):
         product = get_object_or_404(Product, pk=product_id)
 
-        if product.stock <= 0:
+        # Las unidades reservadas por checkouts en curso no se pueden añadir
+        if product.available <= 0:
+            if wants_json(request):
+                return JsonResponse({"error": "Producto agotado"}, status=409)
             return redirect("catalog")
 
         try:
@@ -82,46 +105,29 @@ class AddToCartView(View):
 
         # Si el usuario está logueado
         if request.user.is_authenticated:
-            cart, create = Cart.objects.get_or_create(user=request.user)
-
-            if cart:
-                cart_product, created = CartProduct.objects.get_or_create(
-                    cart=cart, product=product, defaults={"quantity": quantity}
-                )
-            else:
-                cart_product, created = CartProduct.objects.get_or_create(
-                    cart=create, product=product, defaults={"quantity": quantity}
-                )
-
-            if not created:
-                if cart_product.quantity + quantity > product.stock:
-                    cart_product.quantity = product.stock
-                    return redirect("cart_detail")
-                else:
-                    cart_product.quantity += quantity
-                cart_product.save()
+            line_pk = add_to_cart(request.user, product, quantity)
 
         # Si el usuario no está logueado, guardamos en sesión
         else:
             cart_session = request.session.get("cart_session", {})
             product_id_str = str(product_id)
+            line_pk = product.pk
 
             if product_id_str in cart_session:
-                if cart_session[product_id_str]["quantity"] + quantity > product.stock:
-                    cart_session[product_id_str]["quantity"] = product.stock
-                    return redirect("cart_detail")
-                else:
-                    cart_session[product_id_str]["quantity"] += quantity
+                cart_session[product_id_str]["quantity"] = min(
+                    cart_session[product_id_str]["quantity"] + quantity,
+                    product.available,
+                )
             else:
                 cart_session[product_id_str] = {
-                    "quantity": quantity,
+                    "quantity": min(quantity, product.available),
                     "price": str(product.price),
                 }
 
             request.session["cart_session"] = cart_session
             request.session.modified = True
 
-        return redirect("cart_detail")
+        return cart_response(request, line_pk)
 
 
 class RemoveFromCartView(View):
@@ -153,7 +159,7 @@ class RemoveFromCartView(View):
                 request.session["cart_session"] = cart_session
                 request.session.modified = True
 
-        return redirect("cart_detail")
+        return cart_response(request, product_id)
 
 
 class UpdateCartItemView(View):
@@ -191,4 +197,4 @@ class UpdateCartItemView(View):
                 request.session["cart_session"] = cart_session
                 request.session.modified = True
 
-        return redirect("cart_detail")
+        return cart_response(request, product_id)
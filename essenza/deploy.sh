@@ -20,6 +20,10 @@ echo ""
 echo "--- Aplicando Migraciones (Migrate)..."
 python3 manage.py migrate --no-input
 
+echo ""
+echo "--- Creando la tabla de caché (createcachetable)..."
+python3 manage.py createcachetable
+
 echo ""
 echo "--- Copiando imagenes de sampleo a 'media/'..."
 mkdir -p media
@@ -37,6 +41,22 @@ echo ""
 echo "--- Cargando datos de ORDER..."
 python3 manage.py loaddata order/sample/sample.json
 
+echo ""
+echo "--- Recalculando ventas diarias (rollup)..."
+python3 manage.py rebuild_sales_rollup
+
+echo ""
+echo "--- Recalculando reportes diarios (producto y cliente)..."
+python3 manage.py rebuild_daily_sales
+
+echo ""
+echo "--- Enlazando pedidos de invitado a sus cuentas..."
+python3 manage.py link_guest_orders
+
+echo ""
+echo "--- Calculando segmentos y cohortes de clientes..."
+python3 manage.py refresh_customer_analytics
+
 echo ""
 echo "========================================================"
 echo "!PROCESO COMPLETADO CON EXITO!"
@@ -0,0 +1,106 @@
+"""
+Caché de resultados caros (top ventas, agregados de reportes) sobre la caché
+configurada en ``CACHES`` (base de datos, Redis, fichero o locmem, ver
+``settings.CACHE_URL``).
+
+Claves por espacio de nombres y versión: cada espacio (``catalog``, ``sales``)
+tiene un número de versión en la propia caché y las claves lo incluyen, así
+que invalidar es cambiar la versión (``bump``), sin buscar ni borrar claves. Las
+señales de ``Product``, ``Order`` y ``OrderProduct`` suben la versión de su
+espacio; las entradas viejas caducan solas.
+
+Protección contra estampidas: cada entrada guarda cuándo deja de estar fresca.
+Pasado ese momento, solo quien consigue el cerrojo (``cache.add``) recalcula y
+el resto sigue sirviendo el valor anterior durante un margen igual al tiempo
+de vida. Con la clave fría, el resto espera a que el primero termine en lugar
+de lanzar la misma consulta a la vez. El cerrojo necesita un ``add`` atómico
+(base de datos, Redis, locmem); con la caché en ficheros no excluye a nadie.
+"""
+
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+DEFAULT_TIMEOUT = 300
+# Tiempo máximo que se espera a que otro proceso calcule una clave fría
+LOCK_TIMEOUT = 10
+LOCK_POLL = 0.05
+
+
+def _version_key(namespace):
+    return f"ns:{namespace}"
+
+
+def versions(namespaces):
+    """Versión actual de cada espacio de nombres (las crea si no existen)."""
+    keys = {_version_key(ns): ns for ns in namespaces}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        # Se empieza por la hora en ns y no por 1: si la caché pierde la
+        # versión (expulsión, reinicio de Redis) no se reutilizan claves viejas
+        cache.add(key, time.time_ns(), timeout=None)
+        found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump(*namespaces):
+    """Invalida todo lo cacheado en ``namespaces``."""
+    # Una versión nueva (la hora en ns) en vez de incr: incr es leer y escribir
+    # en casi todos los backends y dos bump a la vez podían dejar la versión
+    # que otro ya había usado para guardar datos viejos
+    cache.set_many(
+        {_version_key(ns): time.time_ns() for ns in namespaces}, timeout=None
+    )
+
+
+def bump_on_commit(*namespaces):
+    """
+    ``bump`` ahora y otra vez al confirmar la transacción: lo que otro proceso
+    calcule entre medias con los datos aún sin confirmar tampoco se reutiliza.
+    """
+    bump(*namespaces)
+    transaction.on_commit(lambda: bump(*namespaces))
+
+
+def make_key(namespaces, key):
+    if isinstance(namespaces, str):
+        namespaces = [namespaces]
+    tag = ".".join(f"{ns}{v}" for ns, v in zip(namespaces, versions(namespaces)))
+    return f"{tag}:{key}"
+
+
+def cached(namespaces, key, compute, timeout=DEFAULT_TIMEOUT):
+    """
+    Devuelve el valor de ``key`` en ``namespaces`` o lo calcula con
+    ``compute()``. Durante ``timeout`` segundos el valor es fresco; durante
+    otros ``timeout`` se sirve mientras un único proceso lo recalcula.
+    """
+    full_key = make_key(namespaces, key)
+    lock_key = f"lock:{full_key}"
+    entry = cache.get(full_key)
+    if entry is not None:
+        fresh_until, value = entry
+        if time.time() < fresh_until or not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            return value
+        return _store(full_key, lock_key, compute, timeout)
+
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        return _store(full_key, lock_key, compute, timeout)
+    # Otro proceso la está calculando: se espera su resultado
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL)
+        entry = cache.get(full_key)
+        if entry is not None:
+            return entry[1]
+    return compute()
+
+
+def _store(full_key, lock_key, compute, timeout):
+    try:
+        value = compute()
+        cache.set(full_key, (time.time() + timeout, value), timeout * 2)
+    finally:
+        cache.delete(lock_key)
+    return value
@@ -0,0 +1,104 @@
+"""
+Caché de página completa para el tráfico anónimo de la tienda.
+
+``AnonymousPageCacheMiddleware`` guarda la respuesta entera de las vistas de
+``CACHED_URL_NAMES`` (inicio, catálogo, ficha de producto e info) y la sirve
+sin ejecutar la vista ni consultar la base de datos. Solo para peticiones GET
+o HEAD de usuarios anónimos sin carrito en la sesión ni mensajes pendientes:
+con sesión iniciada o con carrito la página depende del usuario y se genera
+siempre.
+
+La clave es la ruta, los parámetros que leen esas vistas (``q``, ``cursor`` y
+los filtros del catálogo) y el idioma, dentro de los espacios ``catalog`` y
+``sales`` de ``essenza.cache``: cualquier cambio de producto o venta invalida
+las páginas.
+
+CSRF: el token de los formularios es distinto por visitante, así que al
+guardar la página se sustituye por una marca y al servirla se pone el token
+del visitante (``get_token``), con lo que ``CsrfViewMiddleware`` le envía su
+cookie como en una página normal.
+"""
+
+import re
+
+from django.conf import settings
+from django.core.cache import cache as django_cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.http import urlencode
+
+from . import cache
+
+CACHED_URL_NAMES = {
+    "dashboard",
+    "catalog",
+    "catalog_page",
+    "catalog_detail",
+    "info-home",
+}
+# Parámetros GET que cambian el contenido de esas vistas; el resto se ignora
+KEY_PARAMS = ("q", "cursor", "category", "brand")
+NAMESPACES = ("catalog", "sales")
+
+CSRF_PLACEHOLDER = b"__csrf_token__"
+CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+class AnonymousPageCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.timeout = getattr(settings, "PAGE_CACHE_TIMEOUT", 300)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        key = getattr(request, "_page_cache_key", None)
+        if key and self._storable(request, response):
+            content = CSRF_INPUT.sub(
+                rb"\1" + CSRF_PLACEHOLDER + rb"\2", response.content
+            )
+            django_cache.set(
+                key,
+                (response.status_code, response["Content-Type"], content),
+                self.timeout,
+            )
+            response["X-Page-Cache"] = "miss"
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self._cacheable(request):
+            return None
+        params = [(name, request.GET.get(name, "")) for name in KEY_PARAMS]
+        key = cache.make_key(
+            NAMESPACES,
+            f"page:{request.LANGUAGE_CODE}:{request.path}?{urlencode(params)}",
+        )
+        cached = django_cache.get(key)
+        if cached is None:
+            request._page_cache_key = key
+            return None
+        status, content_type, content = cached
+        if CSRF_PLACEHOLDER in content:
+            content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode())
+        response = HttpResponse(content, status=status, content_type=content_type)
+        response["X-Page-Cache"] = "hit"
+        return response
+
+    def _cacheable(self, request):
+        match = request.resolver_match
+        return (
+            request.method in ("GET", "HEAD")
+            and match is not None
+            and match.url_name in CACHED_URL_NAMES
+            and not request.user.is_authenticated
+            and not request.session.get("cart_session")
+            # Mensajes pendientes (cookie o sesión): la página no es la común
+            and "messages" not in request.COOKIES
+            and "_messages" not in request.session
+        )
+
+    def _storable(self, request, response):
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and not request.session.modified
+        )
@@ -0,0 +1,123 @@
+"""
+Paginación por cursor (keyset) reutilizable por las vistas de listados.
+
+En lugar de ``OFFSET``, cada página se pide con los valores de ordenación del
+último elemento de la anterior: ``WHERE (clave, pk) > (v, id) ... LIMIT n``.
+Con un índice sobre las columnas de ordenación el coste de una página es el
+mismo sea la primera o la número mil.
+
+El cursor es opaco para el cliente (JSON en base64 url-safe).
+"""
+
+import base64
+import binascii
+import datetime
+import json
+from dataclasses import dataclass
+from decimal import Decimal
+from functools import reduce
+from operator import and_, or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Devuelve la lista de valores del cursor o ``None`` si no es válido."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, binascii.Error):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _row_value(row, name):
+    # Admite tanto instancias de modelo como filas de .values()
+    if isinstance(row, dict):
+        return row[name]
+    return getattr(row, name)
+
+
+@dataclass
+class KeysetPage:
+    object_list: list
+    next_cursor: str | None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    ``ordering`` es una lista de campos al estilo ``order_by`` y debe terminar
+    en un campo único (normalmente ``"pk"``) para que el orden sea total.
+    Los campos pueden ser anotaciones (p. ej. ``"-search_rank"``).
+    """
+
+    def __init__(self, queryset, ordering, per_page=24):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+        self.fields = [(f.lstrip("-"), f.startswith("-")) for f in self.ordering]
+
+    def _after(self, values):
+        # (a > x) OR (a = x AND b > y) OR ... respetando el sentido de cada campo
+        conditions = []
+        for i, (field, descending) in enumerate(self.fields):
+            lookup = "lt" if descending else "gt"
+            equal = [Q(**{name: values[j]}) for j, (name, _) in enumerate(self.fields[:i])]
+            conditions.append(reduce(and_, [*equal, Q(**{f"{field}__{lookup}": values[i]})]))
+        return reduce(or_, conditions)
+
+    def _to_python(self, values):
+        """
+        Convierte los valores del cursor con el campo de cada columna; un
+        cursor manipulado (p. ej. texto donde va el id) devuelve ``None``.
+        """
+        if values is None or len(values) != len(self.fields):
+            return None
+        query = self.queryset.query.chain()
+        try:
+            return [
+                query.resolve_ref(name).output_field.to_python(value)
+                for (name, _), value in zip(self.fields, values)
+            ]
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(*self.ordering)
+        values = self._to_python(decode_cursor(cursor))
+        if values is not None and None not in values:
+            queryset = queryset.filter(self._after(values))
+
+        rows = list(queryset[: self.per_page + 1])
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[: self.per_page]
+            last = rows[-1]
+            next_cursor = encode_cursor([_row_value(last, name) for name, _ in self.fields])
+        return KeysetPage(rows, next_cursor)
@@ -70,6 +70,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # Después de sesión, CSRF y autenticación: necesita saber quién pide
+    "essenza.middleware.AnonymousPageCacheMiddleware",
 ]
 
 ROOT_URLCONF = "essenza.urls"
@@ -85,7 +87,11 @@ TEMPLATES = [
                 "django.template.context_processors.i18n",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "cart.context_processors.cart",
             ],
+            "libraries": {
+                "pagination": "essenza.templatetags.pagination",
+            },
         },
     },
 ]
@@ -105,6 +111,53 @@ DATABASES = {
     )
 }
 
+if "sqlite3" in DATABASES["default"]["ENGINE"]:
+    # En SQLite las transacciones que empiezan leyendo y luego escriben fallan
+    # con "database is locked" en vez de esperar. IMMEDIATE toma el bloqueo
+    # de escritura al empezar y respeta el timeout (webhooks y checkouts simultáneos)
+    DATABASES["default"].setdefault("OPTIONS", {}).update(
+        {"transaction_mode": "IMMEDIATE", "timeout": 20}
+    )
+
+
+# Caché (essenza.cache): CACHE_URL elige el backend
+#   db://tabla           tabla de la base de datos (por defecto essenza_cache, se
+#                        crea con "manage.py createcachetable"). Compartida por
+#                        todos los workers y máquinas, con add atómico
+#   redis://host:6379/0  Redis o compatible (Valkey, KeyDB); requiere el paquete redis
+#   file:///ruta/dir     ficheros, compartida entre los workers de una máquina.
+#                        Su add no es atómico: sin protección contra estampidas
+#   locmem://            memoria del proceso: solo con un worker, con varios
+#                        (Procfile) cada uno invalidaría únicamente la suya
+#   dummy://             sin caché
+# Los tests usan locmem (essenza.test_runner)
+CACHE_URL = os.getenv("CACHE_URL", "db://essenza_cache")
+CACHE_BACKENDS = {
+    "db": "django.core.cache.backends.db.DatabaseCache",
+    "redis": "django.core.cache.backends.redis.RedisCache",
+    "rediss": "django.core.cache.backends.redis.RedisCache",
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
+    "dummy": "django.core.cache.backends.dummy.DummyCache",
+}
+_cache_scheme, _, _cache_location = CACHE_URL.partition("://")
+CACHES = {
+    "default": {
+        "BACKEND": CACHE_BACKENDS[_cache_scheme],
+        "LOCATION": CACHE_URL if _cache_scheme.startswith("redis") else _cache_location,
+        "KEY_PREFIX": "essenza",
+        "TIMEOUT": 300,
+    }
+}
+if _cache_scheme in ("db", "file", "locmem"):
+    # El límite por defecto (300) no da para los fragmentos de todo el catálogo
+    CACHES["default"]["OPTIONS"] = {"MAX_ENTRIES": 5000}
+
+TEST_RUNNER = "essenza.test_runner.TestRunner"
+
+# Segundos que se sirven las páginas cacheadas a anónimos (essenza.middleware)
+PAGE_CACHE_TIMEOUT = int(os.getenv("PAGE_CACHE_TIMEOUT", 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -148,6 +201,10 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# Ficheros con datos de clientes (informes de info.ReportJob). Fuera de
+# MEDIA_ROOT, que en DEBUG se sirve sin autenticación: solo se descargan desde
+# vistas que comprueban permisos
+PRIVATE_MEDIA_ROOT = BASE_DIR / "private_media"
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -166,10 +223,21 @@ AUTH_USER_MODEL = "user.Usuario"
 # -----------------------------------------------------------------
 STRIPE_PUBLIC_KEY = os.getenv("STRIPE_PUBLIC_KEY")
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
+# Secreto de firma del endpoint /order/webhook/stripe/ (whsec_...)
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
 DOMAIN_URL = os.getenv(
     "DOMAIN_URL", "http://127.0.0.1:8000"
 )  # Default a localhost si falla
 
+# Clave de la permutación que genera los localizadores de pedido a partir del id
+# (order.tracking). Cambiarla solo afecta a los pedidos nuevos
+TRACKING_CODE_KEY = os.getenv("TRACKING_CODE_KEY", SECRET_KEY)
+
+# Minutos que dura la sesión de pago de Stripe; por debajo de 31 se usa 31
+# (Stripe no acepta menos de 30). El stock del carrito se retiene unos minutos
+# más que la sesión (order.views)
+STOCK_RESERVATION_TTL_MINUTES = int(os.getenv("STOCK_RESERVATION_TTL_MINUTES", 30))
+
 EMAIL_BACKEND = "anymail.backends.sendgrid.EmailBackend"
 
 ANYMAIL = {"SENDGRID_API_KEY": os.getenv("SENDGRID_API_KEY")}
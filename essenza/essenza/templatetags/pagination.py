@@ -0,0 +1,32 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def page_url(context, cursor=None):
+    """
+    Devuelve la query string actual cambiando solo el cursor, para que los
+    filtros (q, status, fechas...) se conserven al pasar de página.
+    """
+    params = context["request"].GET.copy()
+    params.pop("cursor", None)
+    if cursor:
+        params["cursor"] = cursor
+    encoded = params.urlencode()
+    return f"?{encoded}" if encoded else "?"
+
+
+@register.simple_tag(takes_context=True)
+def filter_url(context, name, value=""):
+    """
+    Devuelve la query string actual con el filtro ``name`` cambiado a
+    ``value`` (vacío lo quita) y sin cursor: al filtrar se vuelve al inicio.
+    """
+    params = context["request"].GET.copy()
+    params.pop("cursor", None)
+    params.pop(name, None)
+    if value:
+        params[name] = value
+    encoded = params.urlencode()
+    return f"?{encoded}" if encoded else "?"
@@ -3,7 +3,12 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 from info.views import info_view
-from product.views import CatalogDetailView, CatalogView, DashboardView
+from product.views import (
+    CatalogDetailView,
+    CatalogPageView,
+    CatalogView,
+    DashboardView,
+)
 
 urlpatterns = [
     path("info/", info_view, name="info-home"),
@@ -12,6 +17,7 @@ urlpatterns = [
     path("product/", include("product.urls")),
     path("", DashboardView.as_view(), name="dashboard"),
     path("catalog/", CatalogView.as_view(), name="catalog"),
+    path("catalog/page/", CatalogPageView.as_view(), name="catalog_page"),
     path("catalog/<int:pk>/", CatalogDetailView.as_view(), name="catalog_detail"),
     path("cart/", include("cart.urls")),
     path("order/", include("order.urls")),
@@ -0,0 +1,205 @@
+"""
+Exportaciones completas de ventas en CSV o NDJSON.
+
+Cada conjunto de datos es un ``values_list`` que se recorre con
+``.iterator(chunk_size=CHUNK_SIZE)``: en PostgreSQL usa un cursor del lado del
+servidor y en cualquier motor evita la caché del queryset, así que solo hay
+``CHUNK_SIZE`` filas en memoria a la vez. Las filas se escriben en bloques de
+texto que ``StreamingHttpResponse`` envía según se generan; la memoria del
+worker no depende del número de filas exportadas.
+"""
+
+import csv
+import datetime
+import json
+from decimal import Decimal
+
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from order.models import Order, OrderProduct
+
+CHUNK_SIZE = 2000
+# Filas por bloque de texto enviado al cliente
+ROWS_PER_BLOCK = 500
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def placed_range(prefix, date_from, date_to):
+    """
+    Filtro de fechas (ambas incluidas) sobre ``placed_at`` como rango de
+    instantes, para que use el índice en lugar de ``DATE(placed_at)``.
+    """
+    filters = {}
+    if date_from:
+        filters[f"{prefix}placed_at__gte"] = _day_start(date_from)
+    if date_to:
+        filters[f"{prefix}placed_at__lt"] = _day_start(
+            date_to + datetime.timedelta(days=1)
+        )
+    return filters
+
+
+def orders(date_from=None, date_to=None):
+    header = [
+        "id",
+        "tracking_code",
+        "placed_at",
+        "status",
+        "email",
+        "user_id",
+        "item_count",
+        "total_amount",
+        "address",
+    ]
+    rows = (
+        Order.objects.filter(**placed_range("", date_from, date_to))
+        .order_by("placed_at", "id")
+        .values_list(*header)
+    )
+    return header, rows
+
+
+def lines(date_from=None, date_to=None):
+    header = [
+        "order_id",
+        "tracking_code",
+        "placed_at",
+        "product_id",
+        "product_name",
+        "quantity",
+        "unit_price",
+        "subtotal",
+    ]
+    rows = (
+        OrderProduct.objects.filter(**placed_range("order__", date_from, date_to))
+        .annotate(subtotal=F("quantity") * F("unit_price"))
+        .order_by("order__placed_at", "order_id", "id")
+        .values_list(
+            "order_id",
+            "order__tracking_code",
+            "order__placed_at",
+            "product_id",
+            "product__name",
+            "quantity",
+            "unit_price",
+            "subtotal",
+        )
+    )
+    return header, rows
+
+
+def products(date_from=None, date_to=None):
+    header = ["product_id", "product_name", "units", "revenue"]
+    rows = (
+        OrderProduct.objects.filter(**placed_range("order__", date_from, date_to))
+        .values("product_id", "product__name")
+        .annotate(
+            units=Sum("quantity"),
+            revenue=Sum(F("quantity") * F("unit_price")),
+        )
+        .order_by("product_id")
+        .values_list("product_id", "product__name", "units", "revenue")
+    )
+    return header, rows
+
+
+def users(date_from=None, date_to=None):
+    header = ["user_id", "email", "first_name", "last_name", "orders", "total_spent"]
+    rows = (
+        Order.objects.filter(user__isnull=False, **placed_range("", date_from, date_to))
+        .values("user_id", "user__email", "user__first_name", "user__last_name")
+        .annotate(orders=Count("id"), total_spent=Sum("total_amount"))
+        .order_by("user_id")
+        .values_list(
+            "user_id",
+            "user__email",
+            "user__first_name",
+            "user__last_name",
+            "orders",
+            "total_spent",
+        )
+    )
+    return header, rows
+
+
+TITLES = {
+    "orders": "Pedidos",
+    "lines": "Líneas de pedido",
+    "products": "Ventas por producto",
+    "users": "Ventas por usuario",
+}
+
+DATASETS = {
+    "orders": orders,
+    "lines": lines,
+    "products": products,
+    "users": users,
+}
+
+
+def _cell(value):
+    # Fechas en ISO 8601 e importes como texto para no perder decimales
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+# Excel y compañía interpretan como fórmula la celda que empieza por uno de
+# estos caracteres. Direcciones, emails y nombres de producto los escriben
+# los clientes: se anteponen con ' para que se lean como texto
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return _cell(value)
+
+
+def _blocks(texts):
+    block = []
+    for line in texts:
+        block.append(line)
+        if len(block) >= ROWS_PER_BLOCK:
+            yield "".join(block)
+            block = []
+    if block:
+        yield "".join(block)
+
+
+class _Echo:
+    """Pseudo-fichero para ``csv.writer``: devuelve la línea en vez de guardarla."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    yield from _blocks(writer.writerow([_csv_cell(v) for v in row]) for row in rows)
+
+
+def stream_ndjson(header, rows):
+    # ``default`` solo se llama para fechas e importes
+    encode = json.JSONEncoder(ensure_ascii=False, default=_cell).encode
+    yield from _blocks(encode(dict(zip(header, row))) + "\n" for row in rows)
+
+
+WRITERS = {"csv": stream_csv, "ndjson": stream_ndjson}
+
+
+def export(dataset, fmt, date_from=None, date_to=None):
+    """Generador con el texto de la exportación ``dataset`` en formato ``fmt``."""
+    header, rows = DATASETS[dataset](date_from, date_to)
+    return WRITERS[fmt](header, rows.iterator(chunk_size=CHUNK_SIZE))
@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from info import customers
+
+DAY = 86_400
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el cálculo RFM y de cohortes sobre pedidos sintéticos en memoria "
+        "y, con --database, la carga de los pedidos reales de la base de datos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=1_000_000)
+        parser.add_argument("--customers", type=int, default=100_000)
+        parser.add_argument("--days", type=int, default=730)
+        parser.add_argument(
+            "--database",
+            action="store_true",
+            help="Mide también load_orders() sobre la base de datos configurada.",
+        )
+
+    def handle(self, *args, **options):
+        now = int(timezone.now().timestamp())
+        rng = np.random.default_rng(42)
+        orders = np.empty(options["orders"], dtype=customers.ORDER_DTYPE)
+        orders["user"] = rng.integers(1, options["customers"] + 1, len(orders))
+        orders["placed"] = now - rng.integers(0, options["days"] * DAY, len(orders))
+        orders["amount"] = rng.uniform(5, 150, len(orders)).round(2)
+        self._run(f"{len(orders):,} pedidos sintéticos", orders, now)
+
+        if options["database"]:
+            start = time.perf_counter()
+            orders = customers.load_orders()
+            self.stdout.write(
+                f"load_orders: {len(orders):,} pedidos en "
+                f"{time.perf_counter() - start:.2f} s"
+            )
+            self._run("pedidos de la base de datos", orders, now)
+
+    def _run(self, label, orders, now):
+        start = time.perf_counter()
+        result = customers.rfm(orders, now)
+        middle = time.perf_counter()
+        cohort_data = customers.cohorts(orders)
+        end = time.perf_counter()
+        self.stdout.write(
+            f"{label}: RFM de {len(result['users']):,} clientes en "
+            f"{middle - start:.2f} s, {len(cohort_data['months'])} cohortes en "
+            f"{end - middle:.2f} s (total {end - start:.2f} s)"
+        )
@@ -0,0 +1,38 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from essenza import cache
+
+from info.models import DailyCustomerSales, DailyProductSales, DailySales
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye los rollups diarios de ventas (totales, por producto y "
+        "por cliente) que usan los reportes de administración."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--day",
+            action="append",
+            type=datetime.date.fromisoformat,
+            dest="days",
+            help="Reconstruye solo este día (AAAA-MM-DD). Se puede repetir.",
+        )
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        with transaction.atomic():
+            DailySales.objects.rebuild(days)
+            DailyProductSales.objects.rebuild(days)
+            DailyCustomerSales.objects.rebuild(days)
+            cache.bump_on_commit("sales")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rollups reconstruidos ({DailySales.objects.count()} días, "
+                f"{DailyProductSales.objects.count()} filas por producto, "
+                f"{DailyCustomerSales.objects.count()} por cliente)."
+            )
+        )
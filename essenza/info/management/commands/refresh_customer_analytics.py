@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from info import customers
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula la segmentación RFM y la retención por cohortes de los "
+        "clientes registrados y guarda la instantánea que leen los reportes."
+    )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        analytics = customers.refresh()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Analítica de clientes actualizada ({analytics.customers} clientes, "
+                f"{analytics.orders} pedidos) en {time.perf_counter() - start:.1f} s."
+            )
+        )
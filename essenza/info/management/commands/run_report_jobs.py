@@ -0,0 +1,57 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from info.models import ReportJob, ReportJobStatus
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker de informes: genera en segundo plano las exportaciones pedidas "
+        "desde los reportes y borra los ficheros antiguos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5.0,
+            help="Segundos de espera cuando no hay informes pendientes.",
+        )
+        parser.add_argument(
+            "--keep-days",
+            type=int,
+            default=7,
+            help="Días que se conservan los informes terminados.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Vacía la cola una vez y termina (útil en cron y tests).",
+        )
+
+    def handle(self, *args, **options):
+        done = failed = 0
+        while True:
+            job = ReportJob.objects.run_next()
+            if job:
+                if job.status == ReportJobStatus.DONE:
+                    done += 1
+                    self.stdout.write(f"Generado {job.file.name} ({job.size} bytes).")
+                else:
+                    failed += 1
+                    self.stdout.write(f"Error en {job.download_name}: {job.error}")
+                continue
+            # Cola vacía: limpieza de informes antiguos
+            ReportJob.objects.purge(
+                timezone.now() - datetime.timedelta(days=options["keep_days"])
+            )
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Informes: {done} generados, {failed} con error.")
+        )
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_rollups(apps, schema_editor):
+    Order = apps.get_model("order", "Order")
+    OrderProduct = apps.get_model("order", "OrderProduct")
+    DailyProductSales = apps.get_model("info", "DailyProductSales")
+    DailyCustomerSales = apps.get_model("info", "DailyCustomerSales")
+
+    product_rows = (
+        OrderProduct.objects.annotate(day=TruncDate("order__placed_at"))
+        .values("day", "product_id")
+        .annotate(units=Sum("quantity"), revenue=Sum(F("quantity") * F("unit_price")))
+        .order_by()
+    )
+    DailyProductSales.objects.bulk_create(
+        [DailyProductSales(**row) for row in product_rows.iterator()], batch_size=1000
+    )
+    customer_rows = (
+        Order.objects.annotate(day=TruncDate("placed_at"))
+        .values("day", "user_id")
+        .annotate(orders=Count("id"), revenue=Sum("total_amount"))
+        .order_by()
+    )
+    DailyCustomerSales.objects.bulk_create(
+        [DailyCustomerSales(**row) for row in customer_rows.iterator()], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('order', '0009_order_user_placed_idx'),
+        ('product', '0004_product_held'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCustomerSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='daily_sales', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'day'], name='daily_customer_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'user'), name='unique_daily_customer_sales')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='product.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'product'), name='unique_daily_product_sales')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
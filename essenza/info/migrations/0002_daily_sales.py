@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:28
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_daily_sales(apps, schema_editor):
+    Order = apps.get_model("order", "Order")
+    DailySales = apps.get_model("info", "DailySales")
+
+    rows = (
+        Order.objects.annotate(day=TruncDate("placed_at"))
+        .values("day")
+        .annotate(orders=Count("id"), units=Sum("item_count"), revenue=Sum("total_amount"))
+        .order_by()
+    )
+    DailySales.objects.bulk_create(
+        [DailySales(**row) for row in rows.iterator()], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.RunPython(populate_daily_sales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0002_daily_sales'),
+        ('user', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerAnalytics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('computed_at', models.DateTimeField()),
+                ('customers', models.PositiveIntegerField()),
+                ('orders', models.PositiveIntegerField()),
+                ('segments', models.JSONField()),
+                ('cohorts', models.JSONField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CustomerRFM',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rfm', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('recency_days', models.PositiveIntegerField()),
+                ('frequency', models.PositiveIntegerField()),
+                ('monetary', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('r_score', models.PositiveSmallIntegerField()),
+                ('f_score', models.PositiveSmallIntegerField()),
+                ('m_score', models.PositiveSmallIntegerField()),
+                ('segment', models.CharField(choices=[('champions', 'Campeones'), ('loyal', 'Leales'), ('new', 'Nuevos'), ('promising', 'Prometedores'), ('at_risk', 'En riesgo'), ('lost', 'Perdidos'), ('needs_attention', 'Necesitan atención')], max_length=20)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-monetary'], name='rfm_monetary_idx'), models.Index(fields=['segment', '-monetary'], name='rfm_segment_idx')],
+            },
+        ),
+    ]
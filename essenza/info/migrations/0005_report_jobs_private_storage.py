@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:58
+
+import info.models
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import migrations, models
+
+
+def drop_public_reports(apps, schema_editor):
+    # Los informes ya generados estaban en MEDIA_ROOT, accesibles sin
+    # autenticación: se borran ficheros y trabajos (se pueden volver a pedir)
+    ReportJob = apps.get_model("info", "ReportJob")
+    public = FileSystemStorage(location=settings.MEDIA_ROOT)
+    generated = ReportJob.objects.exclude(file="")
+    for name in generated.values_list("file", flat=True):
+        public.delete(name)
+    generated.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0004_report_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_public_reports, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='reportjob',
+            name='file',
+            field=models.FileField(blank=True, storage=info.models.private_storage, upload_to=info.models.report_upload_to),
+        ),
+    ]
@@ -1,3 +1,505 @@
-from django.db import models
+"""
+Rollups diarios de ventas para los reportes de administración.
 
-# Create your models here.
+- ``DailySales``: totales del día (una fila por día, para las series).
+- ``DailyProductSales``: unidades e ingresos por producto y día.
+- ``DailyCustomerSales``: pedidos e importe por cliente y día.
+
+Los reportes leen de estas tablas en lugar de agregar ``OrderProduct`` y
+``Order`` enteros en cada visita: el coste depende del número de días del
+rango, no del número de líneas vendidas. ``order.services.place_order`` las
+actualiza al crear cada pedido y ``manage.py rebuild_daily_sales`` las
+reconstruye desde cero (p. ej. tras cargar fixtures o editar pedidos a mano).
+
+``CustomerRFM`` y ``CustomerAnalytics`` guardan la última segmentación RFM y
+retención por cohortes (``info.customers``) y ``ReportJob`` los informes
+pesados que se generan en segundo plano.
+"""
+
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import secrets
+import tempfile
+from itertools import islice
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, DecimalField, F, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from order.models import Order, OrderProduct
+
+from . import exports
+
+MONEY = {"max_digits": 12, "decimal_places": 2}
+
+
+def _bulk_insert(manager, objs, batch_size=1000):
+    # bulk_create por lotes sin cargar en memoria todas las filas
+    objs = iter(objs)
+    while batch := list(islice(objs, batch_size)):
+        manager.bulk_create(batch)
+
+
+class DailySalesManager(models.Manager):
+    def rebuild(self, days=None):
+        """Recalcula los totales (solo ``days`` si se indican) desde Order."""
+        source = Order.objects.annotate(day=TruncDate("placed_at"))
+        target = self.all()
+        if days is not None:
+            source = source.filter(day__in=days)
+            target = target.filter(day__in=days)
+        target.delete()
+        rows = (
+            source.values("day")
+            .annotate(
+                orders=Count("id"), units=Sum("item_count"), revenue=Sum("total_amount")
+            )
+            .order_by()
+        )
+        _bulk_insert(self, (self.model(**row) for row in rows.iterator()))
+
+    def record_order(self, order):
+        day = timezone.localdate(order.placed_at)
+        self.bulk_create([self.model(day=day)], ignore_conflicts=True)
+        self.filter(day=day).update(
+            orders=F("orders") + 1,
+            units=F("units") + order.item_count,
+            revenue=F("revenue") + order.total_amount,
+        )
+
+
+class DailySales(models.Model):
+    """Pedidos, unidades e ingresos de cada día."""
+
+    day = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(default=0, **MONEY)
+
+    objects = DailySalesManager()
+
+    def __str__(self):
+        return f"{self.orders} orders on {self.day}"
+
+
+class DailyProductSalesManager(models.Manager):
+    def rebuild(self, days=None):
+        """Recalcula el rollup (solo ``days`` si se indican) desde OrderProduct."""
+        source = OrderProduct.objects.annotate(day=TruncDate("order__placed_at"))
+        target = self.all()
+        if days is not None:
+            source = source.filter(day__in=days)
+            target = target.filter(day__in=days)
+        target.delete()
+        rows = (
+            source.values("day", "product_id")
+            .annotate(
+                units=Sum("quantity"), revenue=Sum(F("quantity") * F("unit_price"))
+            )
+            .order_by()
+        )
+        _bulk_insert(self, (self.model(**row) for row in rows.iterator()))
+
+    def record_order(self, order, lines):
+        """
+        Suma las líneas (producto, cantidad) del pedido a sus filas del día en
+        dos consultas: se aseguran las filas con ``ignore_conflicts`` y se
+        incrementan todas en un único UPDATE.
+        """
+        totals = {}
+        for product, qty in lines:
+            units, revenue = totals.get(product.pk, (0, 0))
+            totals[product.pk] = (units + qty, revenue + product.price * qty)
+        if not totals:
+            return
+        day = timezone.localdate(order.placed_at)
+        self.bulk_create(
+            [self.model(day=day, product_id=pk) for pk in totals], ignore_conflicts=True
+        )
+        self.filter(day=day, product_id__in=totals).update(
+            units=F("units")
+            + Case(
+                *[When(product_id=pk, then=Value(u)) for pk, (u, _) in totals.items()],
+                default=0,
+            ),
+            revenue=F("revenue")
+            + Case(
+                *[When(product_id=pk, then=Value(r)) for pk, (_, r) in totals.items()],
+                default=0,
+                output_field=DecimalField(**MONEY),
+            ),
+        )
+
+
+class DailyProductSales(models.Model):
+    """Unidades e ingresos por producto y día."""
+
+    day = models.DateField()
+    product = models.ForeignKey(
+        "product.Product", on_delete=models.CASCADE, related_name="daily_sales"
+    )
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(default=0, **MONEY)
+
+    objects = DailyProductSalesManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "product"], name="unique_daily_product_sales"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.units} of {self.product_id} on {self.day}"
+
+
+class DailyCustomerSalesManager(models.Manager):
+    def rebuild(self, days=None):
+        """Recalcula el rollup (solo ``days`` si se indican) desde Order."""
+        source = Order.objects.annotate(day=TruncDate("placed_at"))
+        target = self.all()
+        if days is not None:
+            source = source.filter(day__in=days)
+            target = target.filter(day__in=days)
+        target.delete()
+        rows = (
+            source.values("day", "user_id")
+            .annotate(orders=Count("id"), revenue=Sum("total_amount"))
+            .order_by()
+        )
+        _bulk_insert(self, (self.model(**row) for row in rows.iterator()))
+
+    def record_order(self, order):
+        """Suma el pedido a la fila (día, cliente); los invitados van juntos."""
+        day = timezone.localdate(order.placed_at)
+        changes = {
+            "orders": F("orders") + 1,
+            "revenue": F("revenue") + order.total_amount,
+        }
+        if order.user_id:
+            self.bulk_create(
+                [self.model(day=day, user_id=order.user_id)], ignore_conflicts=True
+            )
+            self.filter(day=day, user_id=order.user_id).update(**changes)
+            return
+        # Con user NULL la restricción única no aplica: se actualiza una sola
+        # fila de invitados del día y se crea si aún no existe. Si dos pedidos
+        # crean a la vez dos filas, los reportes las suman igual.
+        guest_row = self.filter(day=day, user__isnull=True).values("pk")[:1]
+        if not self.filter(pk__in=guest_row).update(**changes):
+            self.create(day=day, user=None, orders=1, revenue=order.total_amount)
+
+
+class DailyCustomerSales(models.Model):
+    """Pedidos e importe por cliente y día (``user`` vacío: invitados)."""
+
+    day = models.DateField()
+    # SET_NULL: al borrar un usuario sus ventas pasan a invitados sin perderse
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="daily_sales",
+    )
+    orders = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(default=0, **MONEY)
+
+    objects = DailyCustomerSalesManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "user"], name="unique_daily_customer_sales"
+            )
+        ]
+        indexes = [models.Index(fields=["user", "day"], name="daily_customer_user_idx")]
+
+    def __str__(self):
+        return f"{self.orders} orders of {self.user_id or 'guests'} on {self.day}"
+
+
+class Segment(models.TextChoices):
+    CHAMPIONS = "champions", "Campeones"
+    LOYAL = "loyal", "Leales"
+    NEW = "new", "Nuevos"
+    PROMISING = "promising", "Prometedores"
+    AT_RISK = "at_risk", "En riesgo"
+    LOST = "lost", "Perdidos"
+    NEEDS_ATTENTION = "needs_attention", "Necesitan atención"
+
+
+class CustomerRFM(models.Model):
+    """
+    Puntuación RFM (recencia, frecuencia, importe) de cada cliente registrado.
+    La calcula ``manage.py refresh_customer_analytics`` (ver ``info.customers``).
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="rfm",
+    )
+    recency_days = models.PositiveIntegerField()
+    frequency = models.PositiveIntegerField()
+    monetary = models.DecimalField(**MONEY)
+    r_score = models.PositiveSmallIntegerField()
+    f_score = models.PositiveSmallIntegerField()
+    m_score = models.PositiveSmallIntegerField()
+    segment = models.CharField(max_length=20, choices=Segment.choices)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-monetary"], name="rfm_monetary_idx"),
+            models.Index(fields=["segment", "-monetary"], name="rfm_segment_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.r_score}{self.f_score}{self.m_score}"
+
+
+class CustomerAnalytics(models.Model):
+    """
+    Última instantánea de la analítica de clientes: resumen por segmento y
+    matriz de retención por cohortes mensuales. Los reportes la leen tal cual,
+    sin recalcular nada en la petición.
+    """
+
+    computed_at = models.DateTimeField()
+    customers = models.PositiveIntegerField()
+    orders = models.PositiveIntegerField()
+    # {segmento: {"customers": n, "monetary": importe}}
+    segments = models.JSONField()
+    # {"months": ["2025-01", ...], "sizes": [...], "retention": [[%...], ...]}
+    cohorts = models.JSONField()
+
+    def __str__(self):
+        return f"Analítica de clientes ({self.computed_at:%Y-%m-%d %H:%M})"
+
+
+class ReportJobStatus(models.TextChoices):
+    PENDING = "pending", "Pendiente"
+    RUNNING = "running", "En curso"
+    DONE = "done", "Completado"
+    FAILED = "failed", "Fallido"
+
+
+ACTIVE_JOB_STATUSES = [ReportJobStatus.PENDING, ReportJobStatus.RUNNING]
+
+
+def params_hash(params):
+    """Huella de los parámetros de un informe (mismo informe, misma huella)."""
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class PrivateStorage(FileSystemStorage):
+    """
+    Ficheros bajo ``PRIVATE_MEDIA_ROOT``: sin URL pública, solo se entregan
+    desde vistas que comprueban permisos (``ReportJobDownloadView``).
+    """
+
+    @property
+    def base_location(self):
+        return settings.PRIVATE_MEDIA_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+    def url(self, name):
+        raise ValueError("Los ficheros privados no tienen URL pública.")
+
+
+def private_storage():
+    return PrivateStorage()
+
+
+def report_upload_to(job, filename):
+    # Prefijo aleatorio: el nombre no se deduce del informe ni de sus fechas
+    return f"reports/{secrets.token_hex(16)}/{filename}"
+
+
+class ReportJobManager(models.Manager):
+    # Un informe terminado se reutiliza durante este tiempo
+    REUSE_FOR = datetime.timedelta(hours=1)
+    # Un trabajo "en curso" más antiguo se da por abandonado (worker caído)
+    STALE_AFTER = datetime.timedelta(hours=1)
+
+    def enqueue(self, dataset, fmt, date_from=None, date_to=None, user=None):
+        """
+        Pide un informe para ``manage.py run_report_jobs``. Si ya hay uno
+        igual pendiente, en curso o terminado hace poco, devuelve ese.
+        Devuelve ``(job, created)``.
+        """
+        params = {
+            "dataset": dataset,
+            "format": fmt,
+            "from": date_from.isoformat() if date_from else None,
+            "to": date_to.isoformat() if date_to else None,
+        }
+        digest = params_hash(params)
+        same = self.filter(params_hash=digest)
+        while True:
+            existing = (
+                same.filter(
+                    models.Q(status__in=ACTIVE_JOB_STATUSES)
+                    | models.Q(
+                        status=ReportJobStatus.DONE,
+                        finished_at__gte=timezone.now() - self.REUSE_FOR,
+                    )
+                )
+                .order_by("-created_at")
+                .first()
+            )
+            if existing:
+                return existing, False
+            try:
+                with transaction.atomic():
+                    job = self.create(
+                        dataset=dataset,
+                        params=params,
+                        params_hash=digest,
+                        requested_by=user,
+                    )
+            except IntegrityError:
+                # Otra petición igual lo ha creado a la vez (restricción
+                # parcial). Se vuelve a buscar: puede haber terminado ya
+                continue
+            return job, True
+
+    def claim(self):
+        """Marca como en curso el trabajo pendiente más antiguo y lo devuelve."""
+        now = timezone.now()
+        with transaction.atomic():
+            # skip_locked permite varios workers en PostgreSQL (en SQLite se ignora)
+            job = (
+                self.filter(
+                    models.Q(status=ReportJobStatus.PENDING)
+                    | models.Q(
+                        status=ReportJobStatus.RUNNING,
+                        started_at__lt=now - self.STALE_AFTER,
+                    )
+                )
+                .select_for_update(skip_locked=True)
+                .order_by("created_at", "pk")
+                .first()
+            )
+            if job:
+                job.status = ReportJobStatus.RUNNING
+                job.started_at = now
+                job.attempts += 1
+                job.save(update_fields=["status", "started_at", "attempts"])
+        return job
+
+    def run_next(self):
+        """Genera el siguiente informe pendiente; ``None`` si no hay ninguno."""
+        job = self.claim()
+        if job:
+            job.generate()
+        return job
+
+    def purge(self, older_than):
+        """Borra los trabajos terminados antes de ``older_than`` y sus ficheros."""
+        old = self.filter(finished_at__lt=older_than).exclude(
+            status__in=ACTIVE_JOB_STATUSES
+        )
+        for job in old.exclude(file=""):
+            job.file.delete(save=False)
+        return old.delete()[0]
+
+
+class ReportJob(models.Model):
+    """
+    Informe pesado (exportación de ``info.exports``) generado fuera de la
+    petición por ``manage.py run_report_jobs`` en un fichero gzip bajo
+    ``PRIVATE_MEDIA_ROOT/reports/``. Contiene datos de clientes: solo se
+    descarga con ``ReportJobDownloadView``.
+    """
+
+    dataset = models.CharField(max_length=20)
+    # {"dataset", "format", "from", "to"}; params_hash identifica peticiones iguales
+    params = models.JSONField()
+    params_hash = models.CharField(max_length=64)
+    status = models.CharField(
+        max_length=10, choices=ReportJobStatus.choices, default=ReportJobStatus.PENDING
+    )
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="report_jobs",
+    )
+    file = models.FileField(
+        upload_to=report_upload_to, storage=private_storage, blank=True
+    )
+    size = models.PositiveBigIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ReportJobManager()
+
+    class Meta:
+        constraints = [
+            # Como mucho un trabajo pendiente o en curso por informe
+            models.UniqueConstraint(
+                fields=["params_hash"],
+                condition=models.Q(status__in=ACTIVE_JOB_STATUSES),
+                name="unique_active_report_job",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="report_job_queue_idx"),
+            models.Index(fields=["params_hash"], name="report_job_params_idx"),
+        ]
+
+    @property
+    def title(self):
+        return exports.TITLES.get(self.dataset, self.dataset)
+
+    @property
+    def download_name(self):
+        period = "-".join(d for d in (self.params["from"], self.params["to"]) if d)
+        name = f"{self.dataset}-{period}" if period else self.dataset
+        return f"{name}.{self.params['format']}.gz"
+
+    def generate(self):
+        """Escribe el informe comprimido y guarda el resultado del trabajo."""
+        params = self.params
+        date_from, date_to = (
+            datetime.date.fromisoformat(params[key]) if params[key] else None
+            for key in ("from", "to")
+        )
+        try:
+            with tempfile.TemporaryFile() as tmp:
+                with gzip.GzipFile(fileobj=tmp, mode="wb") as compressed:
+                    for block in exports.export(
+                        self.dataset, params["format"], date_from, date_to
+                    ):
+                        compressed.write(block.encode())
+                self.size = tmp.tell()
+                tmp.seek(0)
+                self.file.save(self.download_name, File(tmp), save=False)
+        except Exception as e:
+            self.status = ReportJobStatus.FAILED
+            self.error = f"{type(e).__name__}: {e}"[:1000]
+        else:
+            self.status = ReportJobStatus.DONE
+            self.error = ""
+        self.finished_at = timezone.now()
+        self.save()
+
+    def __str__(self):
+        return f"{self.download_name} [{self.status}]"
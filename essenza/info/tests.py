@@ -1,3 +1,896 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import tracemalloc
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache as django_cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from order.models import Order, OrderProduct
+from order.services import place_order
+from product.models import Category, Product
+
+from info import customers, exports
+from info.models import (
+    CustomerAnalytics,
+    CustomerRFM,
+    DailyCustomerSales,
+    DailyProductSales,
+    DailySales,
+    ReportJob,
+    ReportJobStatus,
+    Segment,
+)
+
+User = get_user_model()
+
+
+# ============================================================
+# TESTS: EXPORTACIONES EN STREAMING
+# ============================================================
+
+
+class SalesExportViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username="admin", email="admin@test.com", password="1234", role="admin"
+        )
+        cls.customer = User.objects.create_user(
+            username="cliente", email="cliente@test.com", password="1234"
+        )
+        cls.product = Product.objects.create(
+            name="Perfume, edición ñ",
+            price=Decimal("12.50"),
+            stock=100,
+            is_active=True,
+            category=Category.PERFUME,
+            brand="Marca",
+        )
+        cls.old_order = Order.objects.create(email="invitado@test.com", address="Calle")
+        cls.new_order = Order.objects.create(user=cls.customer, address="Calle 2")
+        for order, qty in ((cls.old_order, 1), (cls.new_order, 3)):
+            OrderProduct.objects.create(order=order, product=cls.product, quantity=qty)
+            order.recalculate_totals()
+        Order.objects.filter(pk=cls.old_order.pk).update(
+            placed_at=timezone.make_aware(datetime.datetime(2025, 1, 10, 12))
+        )
+        Order.objects.filter(pk=cls.new_order.pk).update(
+            placed_at=timezone.make_aware(datetime.datetime(2025, 3, 5, 23, 30))
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def _get(self, dataset, **params):
+        return self.client.get(reverse("info:sales_export", args=[dataset]), params)
+
+    def _csv(self, response):
+        body = b"".join(response.streaming_content).decode()
+        return list(csv.DictReader(io.StringIO(body)))
+
+    def test_only_admin_can_export(self):
+        """Los clientes reciben 403."""
+        self.client.force_login(self.customer)
+        self.assertEqual(self._get("orders").status_code, 403)
+
+    def test_orders_csv_is_streamed(self):
+        """La exportación es un StreamingHttpResponse descargable."""
+        response = self._get("orders")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertIn('filename="orders.csv"', response["Content-Disposition"])
+        rows = self._csv(response)
+        self.assertEqual(
+            [row["id"] for row in rows],
+            [str(self.old_order.pk), str(self.new_order.pk)],
+        )
+        self.assertEqual(rows[1]["total_amount"], "37.50")
+
+    def test_csv_neutralizes_formulas(self):
+        """Los textos de clientes que empiezan como una fórmula van con '."""
+        Order.objects.filter(pk=self.new_order.pk).update(
+            address='=HYPERLINK("http://x.test","pulsa")', email="@SUM(A1)@test.com"
+        )
+        row = self._csv(self._get("orders"))[1]
+        self.assertEqual(row["address"], '\'=HYPERLINK("http://x.test","pulsa")')
+        self.assertEqual(row["email"], "'@SUM(A1)@test.com")
+        # Los importes no son texto del cliente: un negativo se queda igual
+        self.assertEqual(exports._csv_cell(Decimal("-1.50")), "-1.50")
+
+        record = json.loads(
+            b"".join(self._get("orders", format="ndjson").streaming_content)
+            .decode()
+            .splitlines()[1]
+        )
+        self.assertEqual(record["email"], "@SUM(A1)@test.com")
+
+    def test_date_range_is_inclusive(self):
+        """``to`` incluye el día completo en la zona horaria local."""
+        rows = self._csv(
+            self._get("orders", **{"from": "2025-03-01", "to": "2025-03-05"})
+        )
+        self.assertEqual([row["id"] for row in rows], [str(self.new_order.pk)])
+
+    def test_lines_ndjson(self):
+        """NDJSON: un objeto JSON por línea, importes como texto."""
+        response = self._get("lines", format="ndjson", to="2025-01-31")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        records = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["product_name"], "Perfume, edición ñ")
+        self.assertEqual(Decimal(records[0]["subtotal"]), Decimal("12.50"))
+
+    def test_product_and_user_aggregates(self):
+        """Los agregados por producto y por usuario respetan el filtro de fechas."""
+        products = self._csv(self._get("products"))
+        self.assertEqual(products[0]["units"], "4")
+        self.assertEqual(Decimal(products[0]["revenue"]), Decimal("50.00"))
+
+        users = self._csv(self._get("users", **{"from": "2025-02-01"}))
+        self.assertEqual(len(users), 1)
+        self.assertEqual(users[0]["email"], "cliente@test.com")
+        self.assertEqual(Decimal(users[0]["total_spent"]), Decimal("37.50"))
+
+    def test_invalid_parameters(self):
+        """Formato o fechas no válidas: 400. Conjunto desconocido: 404."""
+        self.assertEqual(self._get("orders", format="xlsx").status_code, 400)
+        self.assertEqual(self._get("orders", **{"from": "ayer"}).status_code, 400)
+        self.assertEqual(self._get("nada").status_code, 404)
+
+    def _export_peak(self):
+        tracemalloc.start()
+        try:
+            response = self._get("orders")
+            size = sum(len(block) for block in response.streaming_content)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return size, peak
+
+    def _add_orders(self, count):
+        Order.objects.bulk_create(
+            (
+                Order(
+                    email=f"cliente{i}@test.com",
+                    address=f"Calle {i}",
+                    item_count=1,
+                    total_amount=Decimal("19.99"),
+                )
+                for i in range(count)
+            ),
+            batch_size=2000,
+        )
+
+    def test_memory_does_not_grow_with_exported_rows(self):
+        """
+        Pedidos reales exportados por la vista (``values_list().iterator()`` y
+        ``StreamingHttpResponse``): con cinco veces más filas, el pico de
+        memoria mientras se consume la respuesta es el mismo. Se mide con
+        tracemalloc, que a diferencia del RSS máximo del proceso se puede
+        acotar a este bloque.
+        """
+        self._add_orders(10_000)
+        small_size, small_peak = self._export_peak()
+        self._add_orders(40_000)
+        large_size, large_peak = self._export_peak()
+
+        self.assertGreater(large_size, 4 * small_size)
+        self.assertLess(large_peak, small_peak * 1.25 + 256 * 1024)
+        self.assertLess(large_peak, 4 * 1024 * 1024)
+
+
+# ============================================================
+# TESTS: ROLLUPS DIARIOS DE VENTAS
+# ============================================================
+
+
+def _rollup_state():
+    days = sorted(DailySales.objects.values_list("day", "orders", "units", "revenue"))
+    products = sorted(
+        DailyProductSales.objects.values_list("day", "product_id", "units", "revenue")
+    )
+    customers = sorted(
+        DailyCustomerSales.objects.values("day", "user_id")
+        .annotate(orders=Sum("orders"), revenue=Sum("revenue"))
+        .values_list("day", "user_id", "orders", "revenue"),
+        key=str,
+    )
+    return days, products, customers
+
+
+class DailySalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username="admin", email="admin@test.com", password="1234", role="admin"
+        )
+        cls.customer = User.objects.create_user(
+            username="cliente", email="cliente@test.com", password="1234"
+        )
+        cls.products = [
+            Product.objects.create(
+                name=f"Producto {i}",
+                price=Decimal("10.00") + i,
+                stock=1000,
+                is_active=True,
+                category=Category.MAQUILLAJE,
+                brand="Marca",
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        # Los agregados de los reportes se cachean (essenza.cache)
+        django_cache.clear()
+
+    def _place(self, lines, user=None, email="invitado@test.com"):
+        return place_order(user=user, email=email, address="Calle", lines=lines)
+
+    def test_place_order_updates_rollups(self):
+        """Cada pedido suma sus unidades, ingresos y pedidos del día."""
+        a, b, _ = self.products
+        self._place([(a, 2), (b, 1)], user=self.customer, email=self.customer.email)
+        self._place([(a, 1)], user=self.customer, email=self.customer.email)
+        self._place([(b, 3)])
+        self._place([(b, 1)])
+
+        today = timezone.localdate()
+        self.assertEqual(
+            DailyProductSales.objects.get(day=today, product=a).revenue,
+            Decimal("30.00"),
+        )
+        self.assertEqual(DailyProductSales.objects.get(day=today, product=b).units, 5)
+        row = DailyCustomerSales.objects.get(day=today, user=self.customer)
+        self.assertEqual((row.orders, row.revenue), (2, Decimal("41.00")))
+        guests = DailyCustomerSales.objects.get(day=today, user__isnull=True)
+        self.assertEqual((guests.orders, guests.revenue), (2, Decimal("44.00")))
+        totals = DailySales.objects.get(day=today)
+        self.assertEqual(
+            (totals.orders, totals.units, totals.revenue), (4, 8, Decimal("85.00"))
+        )
+
+    def test_rebuild_matches_incremental_updates(self):
+        """El comando de reconstrucción da las mismas cifras que los incrementos."""
+        a, b, c = self.products
+        self._place([(a, 2), (c, 1)], user=self.customer, email=self.customer.email)
+        self._place([(b, 1), (c, 4)])
+        incremental = _rollup_state()
+
+        DailySales.objects.all().delete()
+        DailyProductSales.objects.all().delete()
+        DailyCustomerSales.objects.all().delete()
+        call_command("rebuild_daily_sales", stdout=io.StringIO())
+        self.assertEqual(_rollup_state(), incremental)
+
+    def test_linking_guest_orders_moves_their_sales(self):
+        """Al enlazar pedidos de invitado sus ventas pasan al cliente."""
+        self._place([(self.products[0], 1)], email="nueva@test.com")
+        user = User.objects.create_user(
+            username="nueva", email="nueva@test.com", password="1234"
+        )
+        Order.objects.link_guest_orders(user)
+
+        self.assertEqual(DailyCustomerSales.objects.get(user=user).orders, 1)
+        self.assertFalse(DailyCustomerSales.objects.filter(user__isnull=True).exists())
+
+    def test_reports_read_rollups_with_date_range(self):
+        """Los reportes filtran por fechas sobre los rollups."""
+        order = self._place(
+            [(self.products[0], 2)], user=self.customer, email=self.customer.email
+        )
+        self._place([(self.products[1], 1)])
+        yesterday = timezone.localdate() - datetime.timedelta(days=1)
+        DailyProductSales.objects.filter(product=self.products[0]).update(day=yesterday)
+        DailyCustomerSales.objects.filter(user=self.customer).update(day=yesterday)
+
+        self.client.force_login(self.admin)
+        url = reverse("info:sales_reports_view", args=["product"])
+        resp = self.client.get(url, {"to": yesterday.isoformat()})
+        self.assertEqual(
+            [row["product__id"] for row in resp.context["sales_data"]],
+            [self.products[0].pk],
+        )
+
+        url = reverse("info:sales_reports_view", args=["user"])
+        resp = self.client.get(url, {"from": timezone.localdate().isoformat()})
+        self.assertEqual(list(resp.context["sales_data"]), [])
+
+        resp = self.client.get(reverse("info:sales_history_report"))
+        self.assertEqual(resp.context["daily_totals"]["orders"], 2)
+        self.assertEqual(
+            resp.context["daily_totals"]["revenue"],
+            order.total_amount + self.products[1].price,
+        )
+
+    def test_report_queries_do_not_depend_on_order_lines(self):
+        """Los reportes de producto y usuario no leen OrderProduct ni Order."""
+        self._place([(p, 1) for p in self.products], user=self.customer)
+        self.client.force_login(self.admin)
+        for report in ("product", "user"):
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(reverse("info:sales_reports_view", args=[report]))
+            sql = " ".join(q["sql"] for q in ctx.captured_queries)
+            self.assertNotIn('"order_orderproduct"', sql)
+            self.assertNotIn('"order_order"', sql)
+
+    def test_report_aggregates_are_cached_until_the_next_order(self):
+        """Los agregados salen de la caché hasta que una venta la invalida."""
+        a, b, _ = self.products
+        self._place([(a, 1)])
+        self.client.force_login(self.admin)
+        url = reverse("info:sales_reports_view", args=["product"])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url)
+        self.assertFalse(
+            any('"info_dailyproductsales"' in q["sql"] for q in ctx.captured_queries)
+        )
+        self.assertEqual(resp.context["sales_data"][0]["total_sold"], 1)
+
+        self._place([(a, 2), (b, 1)])
+        resp = self.client.get(url)
+        rows = resp.context["sales_data"]
+        self.assertEqual(
+            [(row["product__id"], row["total_sold"]) for row in rows],
+            [(a.pk, 3), (b.pk, 1)],
+        )
+
+
+# ============================================================
+# TESTS: HISTORIAL DE VENTAS
+# ============================================================
+
+
+class SalesHistoryReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username="admin", email="admin@test.com", password="1234", role="admin"
+        )
+        cls.url = reverse("info:sales_history_report")
+
+    def setUp(self):
+        django_cache.clear()
+        self.client.force_login(self.admin)
+
+    def _orders(self, count, prefix="a"):
+        # Tres clientes distintos y uno de cada cuatro pedidos de invitado
+        users = [
+            User.objects.create_user(
+                username=f"{prefix}{i}", email=f"{prefix}{i}@test.com", password="1234"
+            )
+            for i in range(3)
+        ]
+        Order.objects.bulk_create(
+            [
+                Order(
+                    user=users[i % 4] if i % 4 < 3 else None,
+                    email=f"pedido{i}@test.com",
+                    address="Calle",
+                    total_amount=Decimal("9.99"),
+                )
+                for i in range(count)
+            ]
+        )
+
+    def _query_count(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        return len(ctx)
+
+    def test_query_count_does_not_depend_on_orders(self):
+        """La página hace las mismas consultas con 5 pedidos que con 60."""
+        self._orders(5)
+        self.client.get(self.url)  # calienta la sesión
+        few = self._query_count()
+        self._orders(55, prefix="b")
+        self.assertEqual(self._query_count(), few)
+
+    def test_history_is_cursor_paginated(self):
+        """25 pedidos por página y el cursor conserva el filtro de fechas."""
+        self._orders(30)
+        today = timezone.localdate().isoformat()
+        first = self.client.get(self.url, {"from": today})
+        self.assertEqual(len(first.context["orders"]), 25)
+        self.assertContains(first, f"from={today}&amp;cursor=")
+
+        second = self.client.get(
+            self.url, {"from": today, "cursor": first.context["page"].next_cursor}
+        )
+        self.assertEqual(len(second.context["orders"]), 5)
+        self.assertFalse(second.context["page"].has_next)
+        self.assertContains(second, "Anónimo")
+
+
+# ============================================================
+# TESTS: EVOLUCIÓN DE VENTAS (SERIES TEMPORALES)
+# ============================================================
+
+
+class SalesTimeSeriesViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username="admin", email="admin@test.com", password="1234", role="admin"
+        )
+        cls.url = reverse("info:sales_timeseries")
+        lipstick = Product.objects.create(
+            name="Labial", price=10, stock=0, category=Category.MAQUILLAJE, brand="A"
+        )
+        perfume = Product.objects.create(
+            name="Colonia", price=30, stock=0, category=Category.PERFUME, brand="B"
+        )
+        # Lunes 3 y miércoles 5 de marzo de 2025; jueves 27 de febrero (anterior)
+        for day, product, units in (
+            (datetime.date(2025, 3, 3), lipstick, 2),
+            (datetime.date(2025, 3, 5), perfume, 1),
+            (datetime.date(2025, 3, 5), lipstick, 1),
+            (datetime.date(2025, 2, 27), perfume, 3),
+        ):
+            DailyProductSales.objects.create(
+                day=day, product=product, units=units, revenue=product.price * units
+            )
+            totals, _ = DailySales.objects.get_or_create(day=day)
+            totals.orders += 1
+            totals.units += units
+            totals.revenue += product.price * units
+            totals.save()
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def _get(self, **params):
+        params = {"from": "2025-03-03", "to": "2025-03-09", **params}
+        return self.client.get(self.url, params)
+
+    def test_daily_buckets_with_previous_period(self):
+        """Un cubo por día y el periodo anterior alineado con él."""
+        data = self._get().json()
+        self.assertEqual(len(data["buckets"]), 7)
+        self.assertEqual(data["revenue"][:3], [20, 0, 40])
+        self.assertEqual(data["orders"][:3], [1, 0, 2])
+        self.assertEqual(data["previous"]["from"], "2025-02-24")
+        self.assertEqual(data["previous"]["revenue"], [0, 0, 0, 90, 0, 0, 0])
+
+    def test_weekly_and_monthly_buckets_in_database(self):
+        """Las semanas empiezan en lunes y los meses el día 1."""
+        data = self._get(granularity="week", **{"from": "2025-02-26"}).json()
+        self.assertEqual(data["buckets"], ["2025-02-24", "2025-03-03"])
+        self.assertEqual(data["revenue"], [90, 60])
+
+        data = self._get(granularity="month", **{"from": "2025-02-01"}).json()
+        self.assertEqual(data["buckets"], ["2025-02-01", "2025-03-01"])
+        self.assertEqual(data["units"], [3, 4])
+
+    def test_category_and_brand_breakdown(self):
+        """El desglose reparte los ingresos de cada cubo."""
+        series = self._get(breakdown="category").json()["breakdown"]["series"]
+        self.assertEqual(series["Maquillaje"][:3], [20, 0, 10])
+        self.assertEqual(series["Perfume"][:3], [0, 0, 30])
+
+        series = self._get(breakdown="brand").json()["breakdown"]["series"]
+        self.assertEqual(set(series), {"A", "B"})
+
+    def test_breakdown_with_unknown_category(self):
+        """Una categoría fuera de las opciones sale con su valor, sin un 500."""
+        Product.objects.filter(name="Colonia").update(category="descatalogada")
+        resp = self._get(breakdown="category")
+        self.assertEqual(resp.status_code, 200)
+        series = resp.json()["breakdown"]["series"]
+        self.assertEqual(series["descatalogada"][:3], [0, 0, 30])
+        self.assertEqual(series["Perfume"][:3], [0, 0, 0])
+
+    def test_constant_queries(self):
+        """El número de consultas no depende de la longitud del rango."""
+        self.client.get(self.url)  # calienta la sesión
+        with CaptureQueriesContext(connection) as short:
+            self._get()
+        with CaptureQueriesContext(connection) as year:
+            self._get(**{"from": "2024-03-10"})
+        self.assertEqual(len(short), len(year))
+
+    def test_invalid_parameters(self):
+        """Granularidad, desglose o rango no válidos: 400."""
+        self.assertEqual(self._get(granularity="hour").status_code, 400)
+        self.assertEqual(self._get(breakdown="color").status_code, 400)
+        self.assertEqual(self._get(**{"from": "2025-03-10"}).status_code, 400)
+        self.assertEqual(self._get(**{"from": "2020-01-01"}).status_code, 400)
+
+    def test_report_page_renders_chart(self):
+        """La pestaña de evolución incluye la gráfica que pide los datos."""
+        resp = self.client.get(reverse("info:sales_reports_view", args=["timeseries"]))
+        self.assertContains(resp, 'id="ts-chart"')
+        self.assertContains(resp, self.url)
+
+
+# ============================================================
+# TESTS: ANALÍTICA DE CLIENTES (RFM Y COHORTES)
+# ============================================================
+
+
+def _orders_array(rows):
+    """Array ORDER_DTYPE a partir de (usuario, datetime local, importe)."""
+    return np.array(
+        [
+            (user, int(timezone.make_aware(placed).timestamp()), amount)
+            for user, placed, amount in rows
+        ],
+        dtype=customers.ORDER_DTYPE,
+    )
+
+
+class CustomerAnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username="admin", email="admin@test.com", password="1234", role="admin"
+        )
+        cls.ana = User.objects.create_user(
+            username="ana", email="ana@test.com", password="1234"
+        )
+        cls.luis = User.objects.create_user(
+            username="luis", email="luis@test.com", password="1234"
+        )
+        placed = [
+            (cls.ana, datetime.datetime(2025, 1, 31, 23, 30), "10.00"),
+            (cls.ana, datetime.datetime(2025, 3, 1, 0, 30), "20.50"),
+            (cls.luis, datetime.datetime(2025, 2, 14, 12), "5.25"),
+            (None, datetime.datetime(2025, 2, 14, 13), "99.00"),
+        ]
+        for user, when, amount in placed:
+            order = Order.objects.create(
+                user=user,
+                email="" if user else "invitado@test.com",
+                address="Calle",
+            )
+            Order.objects.filter(pk=order.pk).update(
+                placed_at=timezone.make_aware(when), total_amount=Decimal(amount)
+            )
+        cls.now = timezone.make_aware(datetime.datetime(2025, 3, 11, 12))
+
+    def test_load_orders_skips_guests_and_converts_in_the_database(self):
+        orders = customers.load_orders()
+        self.assertEqual(len(orders), 3)
+        self.assertNotIn(0, orders["user"])
+        expected = {
+            int(placed.timestamp())
+            for placed in Order.objects.filter(user__isnull=False).values_list(
+                "placed_at", flat=True
+            )
+        }
+        self.assertEqual(set(orders["placed"].tolist()), expected)
+        self.assertAlmostEqual(float(orders["amount"].sum()), 35.75)
+
+    def test_local_months_use_the_shop_timezone(self):
+        # 31/01 23:30 en Madrid es 22:30 UTC: sigue siendo enero
+        orders = _orders_array(
+            [
+                (1, datetime.datetime(2025, 1, 31, 23, 30), 1),
+                (1, datetime.datetime(2025, 3, 1, 0, 30), 1),
+                (1, datetime.datetime(2025, 3, 31, 23, 30), 1),
+            ]
+        )
+        months = customers.local_months(orders["placed"])
+        self.assertEqual(
+            [(m // 12, m % 12 + 1) for m in months.tolist()],
+            [(2025, 1), (2025, 3), (2025, 3)],
+        )
+
+    def test_rfm_metrics_and_scores(self):
+        now = int(self.now.timestamp())
+        day = datetime.timedelta(days=1)
+        base = datetime.datetime(2025, 3, 11, 12)
+        rows = []
+        # Cliente u hace u pedidos de 10 € y su último pedido fue hace 10*(5-u) días
+        for user in range(1, 6):
+            for i in range(user):
+                rows.append((user, base - day * (10 * (5 - user) + 30 * i), 10))
+        result = customers.rfm(_orders_array(rows), now)
+
+        self.assertEqual(result["users"].tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(result["frequency"].tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(result["monetary"].tolist(), [10, 20, 30, 40, 50])
+        self.assertEqual(result["recency_days"].tolist(), [40, 30, 20, 10, 0])
+        for key in ("r_score", "f_score", "m_score"):
+            self.assertEqual(result[key].tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(
+            result["segment"].tolist(),
+            [
+                Segment.LOST,
+                Segment.NEEDS_ATTENTION,
+                Segment.NEEDS_ATTENTION,
+                Segment.CHAMPIONS,
+                Segment.CHAMPIONS,
+            ],
+        )
+
+    def test_ties_share_the_same_score(self):
+        placed = datetime.datetime(2025, 3, 1, 12)
+        orders = _orders_array([(user, placed, 10) for user in range(1, 11)])
+        result = customers.rfm(orders, int(self.now.timestamp()))
+        for key in ("r_score", "f_score", "m_score"):
+            self.assertEqual(set(result[key].tolist()), {1})
+
+    def test_cohort_retention_matrix(self):
+        rows = [
+            # Cohorte de enero: dos clientes, uno vuelve en marzo
+            (1, datetime.datetime(2025, 1, 5, 12), 10),
+            (1, datetime.datetime(2025, 1, 20, 12), 10),
+            (1, datetime.datetime(2025, 3, 2, 12), 10),
+            (2, datetime.datetime(2025, 1, 8, 12), 10),
+            # Cohorte de febrero: un cliente que vuelve al mes siguiente
+            (3, datetime.datetime(2025, 2, 10, 12), 10),
+            (3, datetime.datetime(2025, 3, 10, 12), 10),
+        ]
+        result = customers.cohorts(_orders_array(rows))
+        self.assertEqual(result["months"], ["2025-01", "2025-02", "2025-03"])
+        self.assertEqual(result["sizes"], [2, 1, 0])
+        self.assertEqual(
+            result["retention"], [[100.0, 0.0, 50.0], [100.0, 100.0], [0.0]]
+        )
+
+    def test_cohorts_keep_only_the_latest_months(self):
+        rows = [(1, datetime.datetime(2024, 1, 10, 12), 10)] + [
+            (user, datetime.datetime(2025, month, 10, 12), 10)
+            for user, month in ((2, 1), (3, 2), (3, 3))
+        ]
+        result = customers.cohorts(_orders_array(rows), max_cohorts=3)
+        self.assertEqual(result["months"], ["2025-01", "2025-02", "2025-03"])
+        # El cliente de 2024 queda fuera aunque no tenga pedidos en la ventana
+        self.assertEqual(result["sizes"], [1, 1, 0])
+        self.assertEqual(result["retention"][1], [100.0, 100.0])
+
+    def test_cohorts_without_orders(self):
+        orders = np.empty(0, dtype=customers.ORDER_DTYPE)
+        self.assertEqual(
+            customers.cohorts(orders), {"months": [], "sizes": [], "retention": []}
+        )
+
+    def test_refresh_replaces_the_snapshot(self):
+        customers.refresh(now=self.now)
+        analytics = customers.refresh(now=self.now)
+
+        self.assertEqual(CustomerAnalytics.objects.count(), 1)
+        self.assertEqual((analytics.customers, analytics.orders), (2, 3))
+        rfm = {row.user_id: row for row in CustomerRFM.objects.all()}
+        self.assertEqual(set(rfm), {self.ana.pk, self.luis.pk})
+        self.assertEqual(rfm[self.ana.pk].frequency, 2)
+        self.assertEqual(rfm[self.ana.pk].monetary, Decimal("30.50"))
+        self.assertEqual(rfm[self.ana.pk].recency_days, 10)
+        self.assertEqual(rfm[self.luis.pk].monetary, Decimal("5.25"))
+        self.assertEqual(
+            sum(s["customers"] for s in analytics.segments.values()), 2
+        )
+        self.assertEqual(analytics.cohorts["months"], ["2025-01", "2025-02", "2025-03"])
+        self.assertEqual(analytics.cohorts["sizes"], [1, 1, 0])
+
+    def test_management_command(self):
+        out = io.StringIO()
+        call_command("refresh_customer_analytics", stdout=out)
+        self.assertIn("2 clientes", out.getvalue())
+        self.assertEqual(CustomerRFM.objects.count(), 2)
+
+    def test_report_tab_reads_the_snapshot(self):
+        url = reverse("info:sales_reports_view", args=["customers"])
+        self.client.force_login(self.admin)
+        response = self.client.get(url)
+        self.assertContains(response, "refresh_customer_analytics")
+
+        customers.refresh(now=self.now)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "ana@test.com")
+        self.assertContains(response, "2025-01")
+        # Sesión, usuario, instantánea y mejores clientes con su usuario en JOIN
+        self.assertEqual(len(ctx.captured_queries), 4)
+
+    def test_report_tab_requires_admin(self):
+        self.client.force_login(self.ana)
+        response = self.client.get(
+            reverse("info:sales_reports_view", args=["customers"])
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+# ============================================================
+# TESTS: INFORMES EN SEGUNDO PLANO
+# ============================================================
+
+
+class ReportJobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username="admin", email="admin@test.com", password="1234", role="admin"
+        )
+        cls.customer = User.objects.create_user(
+            username="cliente", email="cliente@test.com", password="1234"
+        )
+        product = Product.objects.create(
+            name="Crema", price=Decimal("8.00"), stock=50, is_active=True
+        )
+        order = Order.objects.create(user=cls.customer, address="Calle")
+        OrderProduct.objects.create(order=order, product=product, quantity=2)
+        order.recalculate_totals()
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=os.path.join(media.name, "public"),
+            PRIVATE_MEDIA_ROOT=os.path.join(media.name, "private"),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.admin)
+
+    def _request(self, **data):
+        return self.client.post(
+            reverse("info:report_jobs"), {"dataset": "orders", "format": "csv", **data}
+        )
+
+    def _run_worker(self):
+        call_command("run_report_jobs", "--once", stdout=io.StringIO())
+
+    def test_request_enqueues_without_running_the_export(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self._request(**{"from": "2025-01-01", "to": "2025-12-31"})
+        self.assertRedirects(
+            response, reverse("info:sales_reports_view", args=["jobs"])
+        )
+        self.assertFalse(
+            any('"order_order"' in q["sql"] for q in ctx.captured_queries)
+        )
+        job = ReportJob.objects.get()
+        self.assertEqual(job.status, ReportJobStatus.PENDING)
+        self.assertEqual(job.requested_by, self.admin)
+        self.assertEqual(
+            job.params,
+            {
+                "dataset": "orders",
+                "format": "csv",
+                "from": "2025-01-01",
+                "to": "2025-12-31",
+            },
+        )
+
+    def test_identical_requests_share_one_job(self):
+        self._request()
+        self._request()
+        self.assertEqual(ReportJob.objects.count(), 1)
+        self._request(format="ndjson")
+        self._request(**{"from": "2025-01-01"})
+        self.assertEqual(ReportJob.objects.count(), 3)
+
+        # Terminado hace poco también se reutiliza; pasado REUSE_FOR, no
+        self._run_worker()
+        self._request()
+        self.assertEqual(ReportJob.objects.count(), 3)
+        ReportJob.objects.update(
+            finished_at=timezone.now() - ReportJob.objects.REUSE_FOR
+        )
+        self._request()
+        self.assertEqual(ReportJob.objects.count(), 4)
+
+    def test_only_one_active_job_per_params(self):
+        job, created = ReportJob.objects.enqueue("orders", "csv")
+        self.assertTrue(created)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ReportJob.objects.create(
+                dataset="orders", params=job.params, params_hash=job.params_hash
+            )
+
+    def test_enqueue_retries_when_the_conflicting_job_already_failed(self):
+        create = ReportJob.objects.create
+        calls = []
+
+        def flaky_create(**kwargs):
+            # El trabajo que provocó el conflicto terminó (con error) antes de
+            # volver a buscarlo: no queda ninguno activo ni reutilizable
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise IntegrityError("unique_active_report_job")
+            return create(**kwargs)
+
+        with mock.patch.object(ReportJob.objects, "create", flaky_create):
+            job, created = ReportJob.objects.enqueue("orders", "csv")
+        self.assertTrue(created)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(ReportJob.objects.get(), job)
+
+    def test_worker_writes_compressed_file_and_download(self):
+        job, _ = ReportJob.objects.enqueue("lines", "csv")
+        self._run_worker()
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJobStatus.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertRegex(job.file.name, r"^reports/[0-9a-f]{32}/lines\.csv\.gz$")
+        self.assertEqual(job.size, job.file.size)
+        # Fuera de MEDIA_ROOT (servido sin autenticación en DEBUG)
+        self.assertTrue(job.file.path.startswith(settings.PRIVATE_MEDIA_ROOT))
+        self.assertFalse(os.path.exists(settings.MEDIA_ROOT))
+        with self.assertRaises(ValueError):
+            job.file.url
+
+        response = self.client.get(reverse("info:report_job_download", args=[job.pk]))
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertIn('filename="lines.csv.gz"', response["Content-Disposition"])
+        text = gzip.decompress(b"".join(response.streaming_content)).decode()
+        rows = list(csv.reader(io.StringIO(text)))
+        self.assertEqual(rows[0][0], "order_id")
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(Decimal(rows[1][-1]), Decimal("16.00"))
+
+    def test_failed_job_records_error(self):
+        params = {"dataset": "nada", "format": "csv", "from": None, "to": None}
+        job = ReportJob.objects.create(dataset="nada", params=params, params_hash="x")
+        self._run_worker()
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJobStatus.FAILED)
+        self.assertIn("KeyError", job.error)
+        response = self.client.get(reverse("info:report_job_download", args=[job.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_stale_running_job_is_claimed_again(self):
+        job, _ = ReportJob.objects.enqueue("orders", "csv")
+        self.assertEqual(ReportJob.objects.claim(), job)
+        self.assertIsNone(ReportJob.objects.claim())
+        ReportJob.objects.update(
+            started_at=timezone.now() - ReportJob.objects.STALE_AFTER
+        )
+        claimed = ReportJob.objects.claim()
+        self.assertEqual(claimed, job)
+        self.assertEqual(claimed.attempts, 2)
+
+    def test_purge_removes_old_files(self):
+        job, _ = ReportJob.objects.enqueue("orders", "csv")
+        ReportJob.objects.run_next()
+        job.refresh_from_db()
+        storage = job.file.storage
+        self.assertTrue(storage.exists(job.file.name))
+        ReportJob.objects.update(
+            finished_at=timezone.now() - datetime.timedelta(days=8)
+        )
+        self._run_worker()
+        self.assertFalse(ReportJob.objects.exists())
+        self.assertFalse(storage.exists(job.file.name))
+
+    def test_jobs_tab_lists_status_and_downloads(self):
+        done, _ = ReportJob.objects.enqueue("products", "csv")
+        ReportJob.objects.run_next()
+        ReportJob.objects.enqueue("users", "ndjson")
+        response = self.client.get(reverse("info:sales_reports_view", args=["jobs"]))
+        self.assertContains(response, "Ventas por producto (CSV)")
+        self.assertContains(response, "Pendiente")
+        self.assertContains(
+            response, reverse("info:report_job_download", args=[done.pk])
+        )
+        self.assertTrue(response.context["jobs_running"])
+
+    def test_requires_admin_and_valid_params(self):
+        self.assertEqual(self._request(dataset="nada").status_code, 400)
+        self.assertEqual(self._request(format="xml").status_code, 400)
+        self.assertEqual(self._request(**{"from": "ayer"}).status_code, 400)
+        self.client.force_login(self.customer)
+        self.assertEqual(self._request().status_code, 403)
+        self.assertFalse(ReportJob.objects.exists())
@@ -0,0 +1,161 @@
+"""
+Series temporales de ventas para la gráfica de reportes.
+
+Todo sale de los rollups diarios (``info.models``), agrupados en la base de
+datos por día, semana (lunes) o mes con ``TruncWeek``/``TruncMonth``. Los
+totales usan ``DailySales`` (una fila por día) y los desgloses por categoría o
+marca ``DailyProductSales``. Los días
+de los rollups ya son fechas locales (``Europe/Madrid``, ``TIME_ZONE``), así
+que los cubos no cruzan la medianoche UTC. Python solo coloca cada fila en su
+posición de la serie; el coste depende del número de cubos, no de pedidos.
+"""
+
+import datetime
+
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from product.models import Category
+
+from .models import DailyProductSales, DailySales
+
+GRANULARITIES = {
+    "day": F("day"),
+    "week": TruncWeek("day"),
+    "month": TruncMonth("day"),
+}
+BREAKDOWNS = {"category": "product__category", "brand": "product__brand"}
+# Series por marca: las de más ingresos y el resto en "Otros"
+MAX_SERIES = 6
+
+
+def _bucket_start(day, granularity):
+    if granularity == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _next_bucket(day, granularity):
+    if granularity == "month":
+        return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return day + datetime.timedelta(days=7 if granularity == "week" else 1)
+
+
+def buckets(date_from, date_to, granularity):
+    """Inicio de cada cubo entre ``date_from`` y ``date_to`` (ambos incluidos)."""
+    result = []
+    current = _bucket_start(date_from, granularity)
+    while current <= date_to:
+        result.append(current)
+        current = _next_bucket(current, granularity)
+    return result
+
+
+def _number(value):
+    # JSON compacto: importes como número con dos decimales
+    return round(float(value), 2) if value else 0
+
+
+def _in_range(model, date_from, date_to):
+    return model.objects.filter(day__gte=date_from, day__lte=date_to)
+
+
+def _bucketed(queryset, granularity, group=(), **aggregates):
+    return (
+        queryset.annotate(bucket=GRANULARITIES[granularity])
+        .values("bucket", *group)
+        .annotate(**aggregates)
+        .order_by()
+    )
+
+
+def _totals(date_from, date_to, granularity):
+    """Ingresos, unidades y pedidos por cubo (una consulta sobre DailySales)."""
+    positions = {b: i for i, b in enumerate(buckets(date_from, date_to, granularity))}
+    series = {key: [0] * len(positions) for key in ("revenue", "units", "orders")}
+    rows = _bucketed(
+        _in_range(DailySales, date_from, date_to),
+        granularity,
+        revenue=Sum("revenue"),
+        units=Sum("units"),
+        orders=Sum("orders"),
+    )
+    for row in rows:
+        i = positions[row["bucket"]]
+        series["revenue"][i] = _number(row["revenue"])
+        series["units"][i] = row["units"]
+        series["orders"][i] = row["orders"]
+    return series
+
+
+def _breakdown(date_from, date_to, granularity, breakdown, total_revenue):
+    """Ingresos por cubo y categoría o marca (una consulta, dos por marca)."""
+    field = BREAKDOWNS[breakdown]
+    positions = {b: i for i, b in enumerate(buckets(date_from, date_to, granularity))}
+    in_range = _in_range(DailyProductSales, date_from, date_to)
+    if breakdown == "category":
+        # Pocas categorías fijas: todas tienen serie
+        keys = list(Category.values)
+    else:
+        keys = list(
+            in_range.values(field)
+            .annotate(revenue=Sum("revenue"))
+            .order_by("-revenue", field)
+            .values_list(field, flat=True)[:MAX_SERIES]
+        )
+        in_range = in_range.filter(**{f"{field}__in": keys})
+    rows = _bucketed(in_range, granularity, group=(field,), revenue=Sum("revenue"))
+
+    series = {key: [0] * len(positions) for key in keys}
+    for row in rows:
+        # Una categoría que ya no está en Category (datos antiguos o editados
+        # a mano) tiene su propia serie con el valor en crudo como etiqueta
+        values = series.setdefault(row[field], [0] * len(positions))
+        values[positions[row["bucket"]]] = _number(row["revenue"])
+    labels = dict(Category.choices) if breakdown == "category" else {}
+    result = {labels.get(key, key): values for key, values in series.items()}
+
+    if breakdown == "brand":
+        others = [
+            _number(total - sum(values[i] for values in series.values()))
+            for i, total in enumerate(total_revenue)
+        ]
+        if any(others):
+            result["Otros"] = others
+    return result
+
+
+def sales_series(date_from, date_to, granularity="day", breakdown=None):
+    """
+    Serie de ventas de ``date_from`` a ``date_to`` y la del periodo anterior
+    de la misma duración, alineadas cubo a cubo para compararlas.
+    """
+    length = date_to - date_from + datetime.timedelta(days=1)
+    previous_to = date_from - datetime.timedelta(days=1)
+    previous_from = previous_to - length + datetime.timedelta(days=1)
+
+    current = _totals(date_from, date_to, granularity)
+    previous = _totals(previous_from, previous_to, granularity)
+    size = len(current["revenue"])
+    data = {
+        "granularity": granularity,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "buckets": [b.isoformat() for b in buckets(date_from, date_to, granularity)],
+        **current,
+        "previous": {
+            "from": previous_from.isoformat(),
+            "to": previous_to.isoformat(),
+            # Mismo número de cubos que el periodo actual
+            **{key: (values + [0] * size)[:size] for key, values in previous.items()},
+        },
+    }
+    if breakdown:
+        data["breakdown"] = {
+            "by": breakdown,
+            "series": _breakdown(
+                date_from, date_to, granularity, breakdown, current["revenue"]
+            ),
+        }
+    return data
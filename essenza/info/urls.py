@@ -13,6 +13,22 @@ urlpatterns = [
         {"report_type": "history"},
         name="sales_history_report",
     ),
+    path(
+        "reports/export/<str:dataset>/",
+        views.SalesExportView.as_view(),
+        name="sales_export",
+    ),
+    path("reports/jobs/new/", views.ReportJobView.as_view(), name="report_jobs"),
+    path(
+        "reports/jobs/<int:pk>/download/",
+        views.ReportJobDownloadView.as_view(),
+        name="report_job_download",
+    ),
+    path(
+        "reports/timeseries/data/",
+        views.SalesTimeSeriesView.as_view(),
+        name="sales_timeseries",
+    ),
     path(
         "reports/<str:report_type>/",
         views.SalesReportsView.as_view(),
@@ -1,24 +1,69 @@
 # essenza/info/views.py
 
+import datetime
+
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db.models import F, Sum
-from django.shortcuts import render
+from django.db.models import Sum
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.utils import timezone
 from django.views import View
-from order.models import Order, OrderProduct
+from essenza import cache
+from essenza.pagination import KeysetPaginator
+from order.models import Order
+
+from . import exports, timeseries
+from .models import (
+    ACTIVE_JOB_STATUSES,
+    CustomerAnalytics,
+    CustomerRFM,
+    DailyCustomerSales,
+    DailyProductSales,
+    DailySales,
+    ReportJob,
+    ReportJobStatus,
+)
 
 
 def info_view(request):
     return render(request, "info/info.html")
 
 
+def _date_range(params):
+    """Fechas ``from`` y ``to`` (AAAA-MM-DD) de GET o POST; ValueError si no valen."""
+    return tuple(
+        datetime.date.fromisoformat(value) if value else None
+        for value in (params.get("from"), params.get("to"))
+    )
+
+
+def _day_filter(queryset, date_from, date_to):
+    if date_from:
+        queryset = queryset.filter(day__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(day__lte=date_to)
+    return queryset
+
+
 class SalesReportsView(LoginRequiredMixin, UserPassesTestMixin, View):
     """
-    Maneja la visualización de los tres tipos de reportes:
-    history (Historial de Pedidos), product (Ventas por Producto), user (Ventas por Usuario).
+    Maneja la visualización de los tipos de reportes: history (Historial de
+    Pedidos), product (Ventas por Producto), user (Ventas por Usuario),
+    timeseries (Evolución de Ventas), customers (Segmentos y Cohortes) y jobs
+    (Informes Generados en segundo plano).
     """
 
     raise_exception = True
+    history_per_page = 25
+    top_customers = 20
+    jobs_shown = 50
 
     def test_func(self):
         return self.request.user.is_authenticated and self.request.user.role == "admin"
@@ -40,43 +85,265 @@ class SalesReportsView(LoginRequiredMixin, UserPassesTestMixin, View):
                 "name": "Ventas por Usuario",
                 "url": reverse("info:sales_reports_view", args=["user"]),
             },
+            {
+                "id": "timeseries",
+                "name": "Evolución de Ventas",
+                "url": reverse("info:sales_reports_view", args=["timeseries"]),
+            },
+            {
+                "id": "customers",
+                "name": "Segmentos y Cohortes",
+                "url": reverse("info:sales_reports_view", args=["customers"]),
+            },
+            {
+                "id": "jobs",
+                "name": "Informes Generados",
+                "url": reverse("info:sales_reports_view", args=["jobs"]),
+            },
+        ]
+
+        # Exportaciones completas (CSV/NDJSON) del reporte actual, que se
+        # generan en segundo plano (ReportJobView)
+        export_datasets = [
+            (dataset, exports.TITLES[dataset])
+            for dataset in {
+                "product": ["products"],
+                "user": ["users"],
+                "timeseries": [],
+                "customers": [],
+                "jobs": list(exports.DATASETS),
+            }.get(report_type, ["orders", "lines"])
         ]
 
         context = {
             "reports_nav": reports_nav,
             "current_report": report_type,
+            "export_datasets": export_datasets,
         }
 
+        try:
+            date_from, date_to = _date_range(request.GET)
+        except ValueError:
+            return HttpResponseBadRequest("Fechas no válidas (AAAA-MM-DD).")
+        context["date_from"] = date_from
+        context["date_to"] = date_to
+
+        # Los tres reportes leen de los rollups diarios (info.models): el
+        # coste depende de los días del rango, no de las líneas vendidas. Los
+        # agregados se cachean por rango y se invalidan con cada venta
+        product_sales = _day_filter(DailyProductSales.objects, date_from, date_to)
+        customer_sales = _day_filter(DailyCustomerSales.objects, date_from, date_to)
+        period = f"{date_from}:{date_to}"
+
         if report_type == "product":
             context["report_title"] = "Ventas Totales por Producto"
             context["template_name"] = "info/product_sales.html"
-            context["sales_data"] = (
-                OrderProduct.objects.values("product__id", "product__name")
-                .annotate(
-                    total_sold=Sum("quantity"),
-                    total_revenue=Sum(F("quantity") * F("product__price")),
-                )
-                .order_by("-total_revenue")
+            context["sales_data"] = cache.cached(
+                ("catalog", "sales"),
+                f"reports:product:{period}",
+                lambda: list(
+                    product_sales.values("product__id", "product__name")
+                    .annotate(total_sold=Sum("units"), total_revenue=Sum("revenue"))
+                    .order_by("-total_revenue")
+                ),
             )
 
         elif report_type == "user":
             context["report_title"] = "Ventas Totales por Usuario"
             context["template_name"] = "info/user_sales.html"
-            context["sales_data"] = (
-                Order.objects.values("user__id", "user__first_name", "user__email")
-                .annotate(
-                    total_spent=Sum(
-                        F("order_products__quantity")
-                        * F("order_products__product__price")
-                    )
+            context["sales_data"] = cache.cached(
+                "sales",
+                f"reports:user:{period}",
+                lambda: list(
+                    customer_sales.filter(user__isnull=False)
+                    .values("user__id", "user__first_name", "user__email")
+                    .annotate(total_spent=Sum("revenue"))
+                    .order_by("-total_spent")
+                ),
+            )
+
+        elif report_type == "timeseries":
+            # La gráfica pide los datos a SalesTimeSeriesView
+            context["report_title"] = "Evolución de Ventas"
+            context["template_name"] = "info/sales_timeseries.html"
+
+        elif report_type == "customers":
+            # Instantánea de refresh_customer_analytics: no se recalcula aquí
+            context["report_title"] = "Segmentos y Cohortes de Clientes"
+            context["template_name"] = "info/customer_analytics.html"
+            analytics = CustomerAnalytics.objects.order_by("-computed_at").first()
+            context["analytics"] = analytics
+            if analytics:
+                context["segments"] = analytics.segments.values()
+                cohorts = analytics.cohorts
+                context["cohorts"] = list(
+                    zip(cohorts["months"], cohorts["sizes"], cohorts["retention"])
                 )
-                .exclude(user__isnull=True)
-                .order_by("-total_spent")
+                context["cohort_ages"] = range(len(cohorts["months"]))
+                context["top_customers"] = CustomerRFM.objects.select_related(
+                    "user"
+                ).order_by("-monetary")[: self.top_customers]
+
+        elif report_type == "jobs":
+            context["report_title"] = "Informes Generados"
+            context["template_name"] = "info/report_jobs.html"
+            jobs = list(
+                ReportJob.objects.select_related("requested_by").order_by(
+                    "-created_at", "-pk"
+                )[: self.jobs_shown]
+            )
+            context["jobs"] = jobs
+            # La página se recarga sola mientras haya informes por terminar
+            context["jobs_running"] = any(
+                job.status in ACTIVE_JOB_STATUSES for job in jobs
             )
 
         else:
             context["report_title"] = "Historial Completo de Ventas"
             context["template_name"] = "info/sales_history.html"
-            context["orders"] = Order.objects.all().order_by("-placed_at")
+            # Resumen por día (una fila por día en DailySales)
+            daily_sales = cache.cached(
+                "sales",
+                f"reports:daily:{period}",
+                lambda: list(
+                    _day_filter(DailySales.objects, date_from, date_to)
+                    .order_by("-day")
+                    .values("day", "orders", "units", "revenue")
+                ),
+            )
+            context["daily_sales"] = daily_sales
+            context["daily_totals"] = {
+                key: sum(row[key] for row in daily_sales)
+                for key in ("orders", "units", "revenue")
+            }
+            # Listado por cursor con el cliente en el mismo JOIN; el total es
+            # la columna desnormalizada del pedido (sin consultas por fila)
+            orders = (
+                Order.objects.filter(**exports.placed_range("", date_from, date_to))
+                .select_related("user")
+                .only("email", "placed_at", "total_amount", "user__username")
+            )
+            page = KeysetPaginator(
+                orders, ("-placed_at", "-pk"), self.history_per_page
+            ).page(request.GET.get("cursor"))
+            context["orders"] = page.object_list
+            context["page"] = page
 
         return render(request, "info/reports_master.html", context)
+
+
+class SalesExportView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Exportación completa de un reporte (pedidos, líneas, ventas por producto
+    o por usuario) en CSV o NDJSON, filtrable por fechas con ``from`` y ``to``
+    (AAAA-MM-DD, ambas incluidas). Se envía en streaming: la memoria del
+    worker es la misma exporte diez filas o varios millones.
+    """
+
+    raise_exception = True
+
+    def test_func(self):
+        return self.request.user.is_authenticated and self.request.user.role == "admin"
+
+    def get(self, request, dataset):
+        if dataset not in exports.DATASETS:
+            raise Http404("Exportación desconocida")
+        fmt = request.GET.get("format", "csv")
+        if fmt not in exports.WRITERS:
+            return HttpResponseBadRequest("Formato no soportado (csv o ndjson).")
+        try:
+            date_from, date_to = _date_range(request.GET)
+        except ValueError:
+            return HttpResponseBadRequest("Fechas no válidas (AAAA-MM-DD).")
+
+        response = StreamingHttpResponse(
+            exports.export(dataset, fmt, date_from, date_to),
+            content_type=exports.CONTENT_TYPES[fmt],
+        )
+        period = "-".join(str(d) for d in (date_from, date_to) if d)
+        filename = f"{dataset}-{period}" if period else dataset
+        response["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+        return response
+
+
+class ReportJobView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Pide en segundo plano la exportación ``dataset`` en ``format`` para las
+    fechas ``from`` y ``to`` (POST) y vuelve a la lista de informes. Las
+    peticiones iguales comparten trabajo (``ReportJob.objects.enqueue``); la
+    consulta la ejecuta ``manage.py run_report_jobs``, nunca la petición.
+    """
+
+    raise_exception = True
+
+    def test_func(self):
+        return self.request.user.is_authenticated and self.request.user.role == "admin"
+
+    def post(self, request):
+        dataset = request.POST.get("dataset")
+        fmt = request.POST.get("format", "csv")
+        if dataset not in exports.DATASETS or fmt not in exports.WRITERS:
+            return HttpResponseBadRequest("Informe o formato no válido.")
+        try:
+            date_from, date_to = _date_range(request.POST)
+        except ValueError:
+            return HttpResponseBadRequest("Fechas no válidas (AAAA-MM-DD).")
+        ReportJob.objects.enqueue(dataset, fmt, date_from, date_to, user=request.user)
+        return redirect("info:sales_reports_view", report_type="jobs")
+
+
+class ReportJobDownloadView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """Descarga el fichero comprimido de un informe terminado."""
+
+    raise_exception = True
+
+    def test_func(self):
+        return self.request.user.is_authenticated and self.request.user.role == "admin"
+
+    def get(self, request, pk):
+        job = get_object_or_404(
+            ReportJob.objects.exclude(file=""), pk=pk, status=ReportJobStatus.DONE
+        )
+        return FileResponse(
+            job.file.open("rb"),
+            as_attachment=True,
+            filename=job.download_name,
+            content_type="application/gzip",
+        )
+
+
+class SalesTimeSeriesView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Datos de la gráfica de evolución en JSON compacto: ingresos, unidades y
+    pedidos por día, semana o mes (``granularity``), el periodo anterior de la
+    misma duración y, opcionalmente, el desglose por categoría o marca
+    (``breakdown``). Por defecto, los últimos 365 días.
+    """
+
+    raise_exception = True
+    # Límite de cubos por petición (dos años de días)
+    max_buckets = 731
+
+    def test_func(self):
+        return self.request.user.is_authenticated and self.request.user.role == "admin"
+
+    def get(self, request):
+        granularity = request.GET.get("granularity", "day")
+        breakdown = request.GET.get("breakdown") or None
+        if granularity not in timeseries.GRANULARITIES or (
+            breakdown and breakdown not in timeseries.BREAKDOWNS
+        ):
+            return HttpResponseBadRequest("Parámetros no válidos.")
+        try:
+            date_from, date_to = _date_range(request.GET)
+        except ValueError:
+            return HttpResponseBadRequest("Fechas no válidas (AAAA-MM-DD).")
+        date_to = date_to or timezone.localdate()
+        date_from = date_from or date_to - datetime.timedelta(days=364)
+        if date_from > date_to:
+            return HttpResponseBadRequest("El rango de fechas está invertido.")
+        if len(timeseries.buckets(date_from, date_to, granularity)) > self.max_buckets:
+            return HttpResponseBadRequest("Demasiados intervalos: usa semanas o meses.")
+
+        data = timeseries.sales_series(date_from, date_to, granularity, breakdown)
+        return JsonResponse(data, json_dumps_params={"separators": (",", ":")})
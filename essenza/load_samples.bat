@@ -26,6 +26,11 @@ echo --- Aplicando migraciones...
 python manage.py migrate --noinput
 IF %ERRORLEVEL% NEQ 0 GOTO :ERROR
 
+echo.
+echo --- Creando la tabla de cache (createcachetable)...
+python manage.py createcachetable
+IF %ERRORLEVEL% NEQ 0 GOTO :ERROR
+
 echo.
 echo --- Copiando imagenes de sampleo a 'media/'...
 XCOPY _sample_assets media /E /I /Y
@@ -46,6 +51,26 @@ echo --- Cargando datos de ORDER...
 python manage.py loaddata order/sample/sample.json
 IF %ERRORLEVEL% NEQ 0 GOTO :ERROR
 
+echo.
+echo --- Recalculando ventas diarias (rollup)...
+python manage.py rebuild_sales_rollup
+IF %ERRORLEVEL% NEQ 0 GOTO :ERROR
+
+echo.
+echo --- Recalculando reportes diarios (producto y cliente)...
+python manage.py rebuild_daily_sales
+IF %ERRORLEVEL% NEQ 0 GOTO :ERROR
+
+echo.
+echo --- Enlazando pedidos de invitado a sus cuentas...
+python manage.py link_guest_orders
+IF %ERRORLEVEL% NEQ 0 GOTO :ERROR
+
+echo.
+echo --- Calculando segmentos y cohortes de clientes...
+python manage.py refresh_customer_analytics
+IF %ERRORLEVEL% NEQ 0 GOTO :ERROR
+
 echo.
 echo ========================================================
 echo !PROCESO COMPLETADO CON EXITO! 
@@ -1,8 +1,17 @@
 from django.contrib import admin
 
-from .models import Order, OrderProduct
+from .models import (
+    EmailOutbox,
+    Order,
+    OrderProduct,
+    StockReservation,
+    StockReservationItem,
+)
 
 # Register your models here.
 
 admin.site.register(Order)
 admin.site.register(OrderProduct)
+admin.site.register(StockReservation)
+admin.site.register(StockReservationItem)
+admin.site.register(EmailOutbox)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class OrderConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "order"
+
+    def ready(self):
+        # Registra los receptores que invalidan la caché de ventas
+        from . import signals  # noqa: F401
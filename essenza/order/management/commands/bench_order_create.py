@@ -0,0 +1,75 @@
+import random
+import string
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from order.models import Order
+
+
+def legacy_create(**fields):
+    """
+    Reproduce el alta anterior: código aleatorio comprobado con una consulta
+    por intento y búsqueda del usuario por email en cada guardado.
+    """
+    chars = string.ascii_uppercase + string.digits
+    while True:
+        code = "".join(random.choices(chars, k=8))
+        if not Order.objects.filter(tracking_code=code).exists():
+            break
+    user = get_user_model().objects.filter(email=fields["email"]).first()
+    return Order.objects.create(tracking_code=code, user=user, **fields)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el rendimiento de Order.objects.create con el localizador "
+        "derivado del id frente al generador aleatorio anterior. Todo se "
+        "ejecuta en una transacción que se deshace."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=5000)
+        parser.add_argument(
+            "--existing",
+            type=int,
+            default=50_000,
+            help="Pedidos previos en la tabla (el índice único crece).",
+        )
+
+    def handle(self, *args, **options):
+        count = options["orders"]
+        with transaction.atomic():
+            self._populate(options["existing"])
+            for label, create in (
+                ("anterior", legacy_create),
+                ("derivado del id", Order.objects.create),
+            ):
+                queries = []
+                with connection.execute_wrapper(
+                    lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)
+                ):
+                    start = time.perf_counter()
+                    for i in range(count):
+                        create(email=f"bench{i}@example.com", address="Calle Bench")
+                    elapsed = time.perf_counter() - start
+                selects = sum(sql.lstrip().upper().startswith("SELECT") for sql in queries)
+                self.stdout.write(
+                    f"{label:>16}: {count / elapsed:,.0f} pedidos/s, "
+                    f"{len(queries) / count:.1f} consultas por pedido "
+                    f"({selects / count:.1f} SELECT)"
+                )
+            transaction.set_rollback(True)
+
+    def _populate(self, count):
+        chars = string.ascii_uppercase + string.digits
+        codes = {"".join(random.choices(chars, k=8)) for _ in range(count)}
+        Order.objects.bulk_create(
+            [
+                Order(email="old@example.com", address="Calle", tracking_code=code)
+                for code in codes
+            ],
+            batch_size=2000,
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from info.models import DailyCustomerSales
+
+from order.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Asigna a su cuenta los pedidos hechos como invitado cuyo email "
+        "coincide con un usuario registrado. Ejecutar una vez tras desplegar; "
+        "a partir de ahí el registro y el cambio de email los enlazan solos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        linked = Order.objects.backfill_guest_users(batch_size=options["batch_size"])
+        if linked:
+            # Las ventas enlazadas dejan de ser de invitado en los reportes
+            DailyCustomerSales.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Pedidos enlazados: {linked}."))
@@ -0,0 +1,180 @@
+import statistics
+import threading
+import time
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models.functions import TruncDate
+from django.test import Client, override_settings
+from django.urls import reverse
+from info.models import DailyCustomerSales, DailySales
+
+from order.models import EmailOutbox, Order, StockReservation
+from order.services import reserve_stock
+from order.stripe_fake import checkout_session_completed, signed_event
+from product.models import Category, Product
+
+LOCAL_SECRET = "whsec_loadtest"
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga del checkout sin Stripe: reserva stock como "
+        "create_checkout, envía eventos checkout.session.completed firmados al "
+        "webhook (repetidos para comprobar la idempotencia) y abre la página de "
+        "éxito. Crea productos de prueba y al terminar los borra con sus pedidos "
+        "y recalcula los rollups diarios de esos días. Usar solo en bases de "
+        "datos de desarrollo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument(
+            "--duplicates",
+            type=int,
+            default=2,
+            help="Veces que se entrega cada evento (Stripe puede repetirlos).",
+        )
+        parser.add_argument(
+            "--url",
+            help=(
+                "URL base de un servidor en marcha (p. ej. http://127.0.0.1:8000). "
+                "Sin ella las peticiones se hacen en proceso con el cliente de Django."
+            ),
+        )
+        parser.add_argument("--keep", action="store_true", help="No borra los datos.")
+
+    def handle(self, *args, **options):
+        secret = settings.STRIPE_WEBHOOK_SECRET or LOCAL_SECRET
+        if options["url"] and not settings.STRIPE_WEBHOOK_SECRET:
+            self.stderr.write("Define STRIPE_WEBHOOK_SECRET igual que en el servidor.")
+            return
+
+        products = Product.objects.bulk_create(
+            [
+                Product(
+                    name=f"Loadtest {i}",
+                    description="Producto de prueba de carga",
+                    category=Category.PERFUME,
+                    brand="Loadtest",
+                    price=10,
+                    stock=options["orders"],
+                    is_active=True,
+                )
+                for i in range(10)
+            ]
+        )
+        jobs = list(range(options["orders"]))
+        lock = threading.Lock()
+        timings, errors = [], []
+
+        def worker():
+            client = Client()
+            while True:
+                with lock:
+                    if not jobs:
+                        break
+                    n = jobs.pop()
+                try:
+                    self._run_one(n, products, secret, options, client, timings, lock)
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+            connection.close()
+
+        before = Order.objects.count()
+        start = time.perf_counter()
+        with override_settings(STRIPE_WEBHOOK_SECRET=secret):
+            threads = [
+                threading.Thread(target=worker) for _ in range(options["concurrency"])
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - start
+        created = Order.objects.count() - before
+
+        timings.sort()
+        if timings:
+            self.stdout.write(
+                f"Webhook: mediana {statistics.median(timings):.1f} ms, "
+                f"p95 {timings[int(len(timings) * 0.95) - 1]:.1f} ms "
+                f"({len(timings)} entregas)"
+            )
+        self.stdout.write(
+            f"{created} pedidos creados de {options['orders']} en {elapsed:.1f} s "
+            f"({options['orders'] / elapsed:.1f} checkouts/s), {len(errors)} errores"
+        )
+        for error in errors[:5]:
+            self.stderr.write(f"  {type(error).__name__}: {error}")
+
+        if not options["keep"]:
+            orders = Order.objects.filter(order_products__product__in=products).distinct()
+            days = set(
+                orders.annotate(day=TruncDate("placed_at")).values_list("day", flat=True)
+            )
+            EmailOutbox.objects.filter(
+                subject__in=[
+                    f"Confirmación de Pedido #{code} - Essenza"
+                    for code in orders.values_list("tracking_code", flat=True)
+                ]
+            ).delete()
+            orders.delete()
+            StockReservation.objects.filter(items__product__in=products).delete()
+            Product.objects.filter(pk__in=[p.pk for p in products]).delete()
+            # Los rollups por producto caen con los productos, pero place_order
+            # también sumó cada pedido a los totales del día y por cliente: se
+            # recalculan esos días a partir de los pedidos que quedan
+            DailySales.objects.rebuild(days=days)
+            DailyCustomerSales.objects.rebuild(days=days)
+
+        if created == options["orders"]:
+            self.stdout.write(self.style.SUCCESS("Un pedido por pago."))
+        else:
+            self.stdout.write(self.style.ERROR("Pedidos perdidos o duplicados."))
+
+    def _run_one(self, n, products, secret, options, client, timings, lock):
+        product = products[n % len(products)]
+        # Lo mismo que hace create_checkout antes de ir a Stripe
+        reservation = reserve_stock([(product, 1)])
+        event = checkout_session_completed(reservation, f"loadtest{n}@example.com")
+        payload, signature = signed_event(event, secret)
+        session_id = event["data"]["object"]["id"]
+
+        for _ in range(options["duplicates"]):
+            start = time.perf_counter()
+            status = self._post(options["url"], client, payload, signature)
+            with lock:
+                timings.append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                raise RuntimeError(f"webhook respondió {status}")
+
+        success = reverse("successful_payment") + f"?session_id={session_id}"
+        if options["url"]:
+            urllib.request.urlopen(options["url"].rstrip("/") + success).read()
+        else:
+            client.get(success)
+
+    def _post(self, url, client, payload, signature):
+        path = reverse("stripe_webhook")
+        if not url:
+            return client.post(
+                path,
+                payload,
+                content_type="application/json",
+                HTTP_STRIPE_SIGNATURE=signature,
+            ).status_code
+        request = urllib.request.Request(
+            url.rstrip("/") + path,
+            data=payload.encode(),
+            headers={
+                "Content-Type": "application/json",
+                "Stripe-Signature": signature,
+            },
+        )
+        with urllib.request.urlopen(request) as response:
+            return response.status
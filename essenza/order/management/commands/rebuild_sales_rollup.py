@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from essenza import cache
+
+from order.models import ProductSalesRollup
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el rollup de unidades vendidas por producto y día."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            ProductSalesRollup.objects.rebuild()
+            cache.bump_on_commit("sales")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rollup reconstruido ({ProductSalesRollup.objects.count()} filas)."
+            )
+        )
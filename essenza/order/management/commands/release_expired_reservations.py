@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from order.services import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = (
+        "Libera el stock retenido por reservas de checkout caducadas. Cada "
+        "checkout ya libera las de sus productos; esto barre el resto (cron)."
+    )
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations()
+        self.stdout.write(self.style.SUCCESS(f"Reservas liberadas: {released}."))
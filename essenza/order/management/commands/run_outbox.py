@@ -0,0 +1,51 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from order.models import EmailOutbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker del outbox de correos: envía en lotes los correos pendientes "
+        "reutilizando una conexión y reintenta los fallidos con espera exponencial."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5.0,
+            help="Segundos de espera cuando no hay correos pendientes.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Vacía la cola una vez y termina (útil en cron y tests).",
+        )
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = EmailOutbox.objects.send_pending(
+                options["batch_size"], connection=connection
+            )
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                self.stdout.write(f"Lote: {sent} enviados, {failed} con error.")
+                # Un lote lleno puede indicar que quedan más pendientes
+                if sent + failed >= options["batch_size"]:
+                    continue
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Outbox: {total_sent} enviados, {total_failed} con error."
+            )
+        )
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-17 00:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollup(apps, schema_editor):
+    OrderProduct = apps.get_model("order", "OrderProduct")
+    ProductSalesRollup = apps.get_model("order", "ProductSalesRollup")
+    rows = (
+        OrderProduct.objects.annotate(day=TruncDate("order__placed_at"))
+        .values("product_id", "day")
+        .annotate(units=Sum("quantity"))
+        .order_by()
+    )
+    ProductSalesRollup.objects.bulk_create(
+        [ProductSalesRollup(product_id=r["product_id"], day=r["day"], units=r["units"]) for r in rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0001_initial'),
+        ('product', '0003_product_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollup', to='product.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'product'], name='sales_rollup_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'day'), name='unique_product_sales_day')],
+            },
+        ),
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:02
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Order = apps.get_model("order", "Order")
+    OrderProduct = apps.get_model("order", "OrderProduct")
+    Product = apps.get_model("product", "Product")
+
+    # El precio histórico no se guardaba: usamos el precio actual del producto
+    OrderProduct.objects.filter(unit_price__isnull=True).update(
+        unit_price=Subquery(
+            Product.objects.filter(pk=OuterRef("product_id")).values("price")[:1]
+        )
+    )
+
+    lines = OrderProduct.objects.filter(order=OuterRef("pk")).values("order")
+    Order.objects.update(
+        total_amount=Coalesce(
+            Subquery(
+                lines.annotate(total=Sum(F("quantity") * F("unit_price"))).values("total")
+            ),
+            Value(0, output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        ),
+        item_count=Coalesce(
+            Subquery(lines.annotate(total=Sum("quantity")).values("total")),
+            Value(0),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0002_product_sales_rollup'),
+        ('product', '0003_product_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='orderproduct',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderproduct',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+    ]
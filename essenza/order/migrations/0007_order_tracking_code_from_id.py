@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0006_order_stripe_session'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='tracking_code',
+            field=models.CharField(editable=False, max_length=10, null=True, unique=True, verbose_name='Localizador'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0008_order_list_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-placed_at', '-id'], name='order_user_placed_idx'),
+        ),
+    ]
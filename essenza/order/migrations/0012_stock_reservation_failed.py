@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0011_email_outbox_sending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockreservation',
+            name='stripe_session_id',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='stockreservation',
+            name='status',
+            field=models.CharField(choices=[('active', 'Activa'), ('committed', 'Confirmada'), ('released', 'Liberada'), ('failed', 'Sin stock')], default='active', max_length=10),
+        ),
+    ]
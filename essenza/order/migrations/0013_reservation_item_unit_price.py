@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0012_stock_reservation_failed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockreservationitem',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+    ]
@@ -1,9 +1,15 @@
-import random
-import string
+import uuid
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.core.mail import EmailMessage, get_connection
+from django.db import models, transaction
+from django.db.models import Case, Exists, F, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Lower, TruncDate
 from django.utils import timezone
+from essenza import cache
+
+from .tracking import encode_tracking_code
 
 
 # Create your models here.
@@ -13,6 +19,70 @@ class Status(models.TextChoices):
     ENTREGADO = "entregado", "Entregado"
 
 
+class OrderQuerySet(models.QuerySet):
+    def for_email(self, email):
+        """Pedidos de ``email`` sin distinguir mayúsculas (usa el índice lower(email))."""
+        return self.alias(email_lower=Lower("email")).filter(
+            email_lower=email.strip().lower()
+        )
+
+
+class OrderManager(models.Manager.from_queryset(OrderQuerySet)):
+
+    def link_guest_orders(self, user):
+        """
+        Asigna a ``user`` los pedidos hechos como invitado con su email. Se
+        llama al registrarse o cambiar de email, de modo que el historial
+        solo tiene que filtrar por ``user_id``.
+        """
+        # Importación local: info.models depende de este módulo
+        from info.models import DailyCustomerSales
+
+        guest_orders = self.for_email(user.email).filter(user__isnull=True)
+        with transaction.atomic():
+            days = set(
+                guest_orders.annotate(day=TruncDate("placed_at")).values_list(
+                    "day", flat=True
+                )
+            )
+            linked = guest_orders.update(user=user)
+            if linked:
+                # Sus ventas dejan de contar como de invitado en los reportes
+                DailyCustomerSales.objects.rebuild(days)
+                cache.bump_on_commit("sales")
+        return linked
+
+    def backfill_guest_users(self, batch_size=5000):
+        """
+        Enlaza todos los pedidos de invitado cuyo email tenga cuenta, por
+        lotes de ``batch_size`` ids para no bloquear la tabla entera.
+        Devuelve cuántos pedidos se han enlazado.
+        """
+        owner = (
+            get_user_model()
+            .objects.alias(email_lower=Lower("email"))
+            .filter(email_lower=Lower(OuterRef("email")))
+            .values("pk")[:1]
+        )
+        linked, last_pk = 0, 0
+        while True:
+            ids = list(
+                self.filter(user__isnull=True, pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                if linked:
+                    cache.bump_on_commit("sales")
+                return linked
+            last_pk = ids[-1]
+            linked += (
+                self.filter(pk__in=ids)
+                .filter(Exists(owner))
+                .update(user_id=Subquery(owner))
+            )
+
+
 class Order(models.Model):
     user = models.ForeignKey(
         "user.Usuario",
@@ -26,45 +96,99 @@ class Order(models.Model):
     placed_at = models.DateTimeField(default=timezone.now)
     status = models.CharField(choices=Status.choices, default=Status.EN_PREPARACION)
 
+    # Totales desnormalizados: se escriben al crear el pedido para que los
+    # listados e informes no tengan que recorrer las líneas
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+
+    # Sesión de Stripe que originó el pedido: garantiza un solo pedido por pago
+    stripe_session_id = models.CharField(
+        max_length=255, unique=True, null=True, blank=True, editable=False
+    )
+
+    # Se calcula a partir del id (ver order.tracking), así que la fila se
+    # inserta sin él y se completa justo después en la misma transacción
     tracking_code = models.CharField(
-        max_length=8,
+        max_length=10,
         unique=True,
+        null=True,
         editable=False,  # No se puede editar manualmente
         verbose_name="Localizador",
     )
+    # Sello de versión de las filas cacheadas con {% cache %} en
+    # order/order_history.html y order/order_list_admin.html
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = OrderManager()
+
+    class Meta:
+        indexes = [
+            # Historial del usuario: un único filtro por user_id ordenado por fecha
+            models.Index(
+                fields=["user", "-placed_at", "-id"], name="order_user_placed_idx"
+            ),
+            # Listado de administración: paginación por (placed_at, id) con y
+            # sin filtro de estado; el de estado sirve también para los contadores
+            models.Index(
+                fields=["status", "-placed_at", "-id"], name="order_status_placed_idx"
+            ),
+            models.Index(fields=["-placed_at", "-id"], name="order_placed_idx"),
+            # Búsqueda por email sin distinguir mayúsculas (admin, seguimiento
+            # de pedidos y enlace de pedidos de invitado; ver OrderManager.for_email)
+            models.Index(
+                Lower("email"), F("placed_at").desc(), name="order_email_lower_idx"
+            ),
+        ]
 
     @property
-    def total_price(self):
-        total = 0
-        for product in self.order_products.all():
-            total += product.subtotal
-        return total
+    def products_updated_at(self):
+        """
+        Última modificación de los productos del pedido. Las filas cacheadas
+        muestran sus nombres, así que va en la clave junto a ``updated_at``;
+        se calcula con las líneas precargadas por las vistas, sin consultas.
+        """
+        return max(
+            (line.product.updated_at for line in self.order_products.all()),
+            default=None,
+        )
+
+    def recalculate_totals(self, save=True):
+        """Recalcula total_amount e item_count a partir de las líneas."""
+        totals = self.order_products.aggregate(
+            amount=Sum(F("quantity") * F("unit_price")), items=Sum("quantity")
+        )
+        self.total_amount = totals["amount"] or 0
+        self.item_count = totals["items"] or 0
+        if save:
+            self.save(update_fields=["total_amount", "item_count"])
 
     def save(self, *args, **kwargs):
         """
         Sobrescribimos el método save para generar el tracking_code
-        automáticamente antes de guardar si aún no tiene uno.
+        automáticamente al crear el pedido. El código se deriva del id, así
+        que no hace falta comprobar si ya existe.
         """
+        adding = self._state.adding
+        if kwargs.get("update_fields"):
+            # auto_now solo se guarda si está en update_fields
+            kwargs["update_fields"] = {*kwargs["update_fields"], "updated_at"}
 
-        if not self.tracking_code:
-            self.tracking_code = self._generate_unique_tracking_code()
-
-        if not self.user and self.email:
+        # Solo al crear: asociamos los pedidos de invitado a su cuenta
+        if adding and not self.user and self.email:
             User = get_user_model()
             existing_user = User.objects.filter(email=self.email).first()
 
             if existing_user:
                 self.user = existing_user
-        super().save(*args, **kwargs)
 
-    def _generate_unique_tracking_code(self):
-        """Genera un código único de 8 caracteres alfanuméricos."""
-        chars = string.ascii_uppercase + string.digits
-        while True:
-            code = "".join(random.choices(chars, k=8))
-            # Verifica que no exista para evitar duplicados
-            if not Order.objects.filter(tracking_code=code).exists():
-                return code
+        if not adding or self.tracking_code:
+            super().save(*args, **kwargs)
+            return
+
+        with transaction.atomic(using=kwargs.get("using"), savepoint=False):
+            super().save(*args, **kwargs)
+            self.tracking_code = encode_tracking_code(self.pk)
+            Order.objects.filter(pk=self.pk).update(tracking_code=self.tracking_code)
 
     def __str__(self):
         return f"Order {self.id} [{self.tracking_code}] - {self.email}"
@@ -78,10 +202,292 @@ class OrderProduct(models.Model):
         "product.Product", on_delete=models.CASCADE, related_name="product_orders"
     )
     quantity = models.IntegerField()
+    # Precio del producto en el momento de la compra
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
 
     @property
     def subtotal(self):
-        return self.quantity * self.product.price
+        return self.quantity * self.unit_price
+
+    def save(self, *args, **kwargs):
+        if self.unit_price is None:
+            self.unit_price = self.product.price
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.quantity} of {self.product.name} in order {self.order.tracking_code}"
+
+
+class ProductSalesRollupManager(models.Manager):
+    def rebuild(self):
+        """Recalcula el rollup completo a partir de OrderProduct."""
+        self.all().delete()
+        rows = (
+            OrderProduct.objects.annotate(day=TruncDate("order__placed_at"))
+            .values("product_id", "day")
+            .annotate(units=Sum("quantity"))
+            .order_by()
+        )
+        self.bulk_create(
+            [
+                self.model(product_id=row["product_id"], day=row["day"], units=row["units"])
+                for row in rows.iterator()
+            ],
+            batch_size=1000,
+        )
+
+    def record_order(self, order, quantities):
+        """
+        Suma las unidades de un pedido a la fila (producto, día) del rollup.
+        ``quantities`` es un diccionario {product_id: unidades}.
+
+        Dos consultas sea cual sea el tamaño del pedido: se aseguran las filas
+        con ``ignore_conflicts`` y se incrementan todas en un único UPDATE, de
+        modo que dos pedidos simultáneos no pisan sus unidades.
+        """
+        if not quantities:
+            return
+        day = timezone.localdate(order.placed_at)
+        self.bulk_create(
+            [self.model(product_id=pk, day=day, units=0) for pk in quantities],
+            ignore_conflicts=True,
+        )
+        self.filter(day=day, product_id__in=quantities).update(
+            units=F("units")
+            + Case(
+                *[When(product_id=pk, then=qty) for pk, qty in quantities.items()],
+                default=0,
+            )
+        )
+
+
+class ProductSalesRollup(models.Model):
+    """Unidades vendidas por producto y día (para el escaparate)."""
+
+    product = models.ForeignKey(
+        "product.Product", on_delete=models.CASCADE, related_name="sales_rollup"
+    )
+    day = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+
+    objects = ProductSalesRollupManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "day"], name="unique_product_sales_day"
+            )
+        ]
+        indexes = [models.Index(fields=["day", "product"], name="sales_rollup_day_idx")]
+
+    def __str__(self):
+        return f"{self.units} of {self.product_id} on {self.day}"
+
+
+class ReservationStatus(models.TextChoices):
+    ACTIVE = "active", "Activa"
+    COMMITTED = "committed", "Confirmada"
+    RELEASED = "released", "Liberada"
+    # Pagada, pero sin stock para crear el pedido: hay que devolver el importe
+    FAILED = "failed", "Sin stock"
+
+
+class StockReservation(models.Model):
+    """
+    Retención temporal de stock durante un checkout. Mientras está activa sus
+    unidades cuentan en ``Product.held``; al pagar se confirma y al cancelar o
+    caducar se libera (ver ``order.services``).
+    """
+
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey(
+        "user.Usuario",
+        on_delete=models.SET_NULL,
+        related_name="stock_reservations",
+        null=True,
+        blank=True,
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=ReservationStatus.choices,
+        default=ReservationStatus.ACTIVE,
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+    # Sesión de Stripe pagada que no llegó a ser pedido (estado 'failed'): la
+    # página de éxito la busca para avisar al cliente en vez de seguir esperando
+    stripe_session_id = models.CharField(
+        max_length=255, unique=True, null=True, blank=True, editable=False
+    )
+
+    class Meta:
+        # El barrido busca reservas activas caducadas
+        indexes = [
+            models.Index(fields=["status", "expires_at"], name="reservation_expiry_idx")
+        ]
+
+    def __str__(self):
+        return f"Reservation {self.token} [{self.status}]"
+
+
+class StockReservationItem(models.Model):
+    reservation = models.ForeignKey(
+        StockReservation, on_delete=models.CASCADE, related_name="items"
+    )
+    product = models.ForeignKey(
+        "product.Product", on_delete=models.CASCADE, related_name="reservation_items"
+    )
+    quantity = models.PositiveIntegerField()
+    # Precio enviado a Stripe al crear el checkout: el pedido se guarda con
+    # este y no con el del producto cuando llega el webhook (vacío en las
+    # reservas anteriores a este campo)
+    unit_price = models.DecimalField(
+        max_digits=10, decimal_places=2, null=True, blank=True
+    )
+
+    def __str__(self):
+        return f"{self.quantity} of {self.product_id} held by {self.reservation_id}"
+
+
+class OutboxStatus(models.TextChoices):
+    PENDING = "pending", "Pendiente"
+    SENDING = "sending", "Enviando"
+    SENT = "sent", "Enviado"
+    FAILED = "failed", "Fallido"
+
+
+class EmailOutboxManager(models.Manager):
+    # Reintentos: 1, 2, 4, 8... minutos hasta MAX_ATTEMPTS intentos
+    MAX_ATTEMPTS = 6
+    BACKOFF_SECONDS = 60
+    # Tiempo que un worker se reserva un lote; si muere sin terminar, pasado
+    # este plazo el lote vuelve a estar pendiente para otro
+    LEASE_SECONDS = 10 * 60
+
+    def enqueue(self, subject, body, to, from_email=None):
+        """
+        Guarda un correo para que lo envíe ``manage.py run_outbox``. Llamado
+        dentro de la transacción del pedido, el correo solo existe si el
+        pedido se llega a guardar.
+        """
+        return self.create(
+            subject=subject,
+            body=body,
+            from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+            to=list(to),
+        )
+
+    def due(self, now=None):
+        # Los 'enviando' con el plazo vencido son lotes de un worker caído
+        return self.filter(
+            status__in=[OutboxStatus.PENDING, OutboxStatus.SENDING],
+            next_attempt_at__lte=now or timezone.now(),
+        )
+
+    def claim(self, batch_size=50):
+        """
+        Reserva un lote de correos pendientes para este worker: los marca como
+        'enviando' hasta dentro de ``LEASE_SECONDS`` en una transacción corta,
+        así que ningún otro worker los toma mientras se envían.
+
+        Cada reclamación cuenta como intento. Un correo cuyo envío tumba al
+        worker vuelve a la cola al vencer el plazo, y sin esto se reclamaría
+        para siempre; al agotar ``MAX_ATTEMPTS`` queda como fallido.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            # skip_locked permite varios workers en PostgreSQL (en SQLite se ignora)
+            batch = list(
+                self.due(now)
+                .select_for_update(skip_locked=True)
+                .order_by("next_attempt_at", "pk")[:batch_size]
+            )
+            exhausted = [e.pk for e in batch if e.attempts >= self.MAX_ATTEMPTS]
+            batch = [e for e in batch if e.attempts < self.MAX_ATTEMPTS]
+            self.filter(pk__in=exhausted).update(
+                status=OutboxStatus.FAILED,
+                last_error="El worker no terminó el envío en ningún intento",
+            )
+            self.filter(pk__in=[email.pk for email in batch]).update(
+                status=OutboxStatus.SENDING,
+                attempts=F("attempts") + 1,
+                next_attempt_at=now + timezone.timedelta(seconds=self.LEASE_SECONDS),
+            )
+        for email in batch:
+            email.attempts += 1
+        return batch
+
+    def send_pending(self, batch_size=50, connection=None):
+        """
+        Envía un lote de correos pendientes por una única conexión del
+        backend de email. Devuelve ``(enviados, fallidos)``.
+
+        El lote se reserva con ``claim`` y se envía fuera de cualquier
+        transacción: un servidor SMTP lento no deja filas bloqueadas ni una
+        transacción abierta. Cada mensaje se manda por separado sobre la
+        conexión abierta para saber cuál falla: los que fallan se reprograman
+        con espera exponencial y, tras ``MAX_ATTEMPTS`` intentos, quedan como
+        fallidos.
+        """
+        batch = self.claim(batch_size)
+        if not batch:
+            return 0, 0
+
+        connection = connection or get_connection()
+        sent, failed = [], []
+        with connection:
+            for email in batch:
+                try:
+                    connection.send_messages([email.as_message(connection)])
+                except Exception as e:
+                    email.last_error = f"{type(e).__name__}: {e}"[:1000]
+                    failed.append(email)
+                else:
+                    sent.append(email.pk)
+
+        now = timezone.now()
+        for email in failed:
+            if email.attempts >= self.MAX_ATTEMPTS:
+                email.status = OutboxStatus.FAILED
+            else:
+                delay = self.BACKOFF_SECONDS * 2 ** (email.attempts - 1)
+                email.status = OutboxStatus.PENDING
+                email.next_attempt_at = now + timezone.timedelta(seconds=delay)
+        with transaction.atomic():
+            self.filter(pk__in=sent).update(status=OutboxStatus.SENT, sent_at=now)
+            self.bulk_update(
+                failed, ["attempts", "status", "next_attempt_at", "last_error"]
+            )
+        return len(sent), len(failed)
+
+
+class EmailOutbox(models.Model):
+    """Correo transaccional pendiente de envío (patrón outbox)."""
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField()
+    status = models.CharField(
+        max_length=10, choices=OutboxStatus.choices, default=OutboxStatus.PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    objects = EmailOutboxManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="outbox_due_idx")
+        ]
+
+    def as_message(self, connection=None):
+        return EmailMessage(
+            self.subject, self.body, self.from_email, self.to, connection=connection
+        )
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} [{self.status}]"
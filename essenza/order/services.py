@@ -0,0 +1,366 @@
+"""
+Servicio de preparación de pedidos (fulfillment) y reservas de stock.
+
+Crea el pedido, sus líneas y descuenta el stock con un número de consultas
+constante, independiente del tamaño del carrito:
+
+- un único ``UPDATE ... SET stock = stock - CASE ...`` con la condición
+  ``stock - held >= cantidad`` por línea,
+- un ``INSERT`` para el pedido,
+- un ``bulk_create`` para todas las líneas,
+- las consultas de los rollups de ventas (dos por tabla).
+
+Si alguna línea no tiene stock suficiente no se toca ningún producto y se
+lanza ``InsufficientStock`` con las líneas que han fallado.
+
+Reservas: al empezar el checkout se retienen las unidades del carrito
+(``Product.held``) con el mismo UPDATE condicional, de modo que dos compradores
+no pueden pagar la última unidad. La reserva se confirma al crear el pedido y
+se libera al cancelar o al caducar: cada reserva o compra libera antes las
+reservas caducadas de sus productos, y ``manage.py release_expired_reservations``
+barre el resto.
+Confirmar y liberar "reclaman" la reserva con un UPDATE sobre su estado, así
+que solo uno de los dos llega a mover el stock.
+"""
+
+import logging
+import uuid
+
+from cart.models import Cart
+from cart.services import forget_cart_count
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.urls import reverse
+from django.utils import timezone
+from essenza import cache
+from info.models import DailyCustomerSales, DailyProductSales, DailySales
+from product.models import Product
+
+from .models import (
+    EmailOutbox,
+    Order,
+    OrderProduct,
+    ProductSalesRollup,
+    ReservationStatus,
+    Status,
+    StockReservation,
+    StockReservationItem,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStock(Exception):
+    """Alguna línea pide más unidades de las que hay en stock."""
+
+    def __init__(self, failed_lines):
+        # Lista de (producto, cantidad pedida)
+        self.failed_lines = failed_lines
+        names = ", ".join(product.name for product, _ in failed_lines)
+        super().__init__(f"No hay stock suficiente de: {names}")
+
+
+class ReservationAlreadyCommitted(Exception):
+    """La reserva ya se convirtió en pedido (pago procesado dos veces)."""
+
+
+def _quantities(lines):
+    quantities = {}
+    for product, qty in lines:
+        quantities[product.pk] = quantities.get(product.pk, 0) + qty
+    return quantities
+
+
+def _quantity_case(quantities):
+    return Case(
+        *[When(pk=pk, then=Value(qty)) for pk, qty in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def _guarded_update(lines, changes):
+    """
+    Aplica ``changes(needed)`` a todos los productos de ``lines`` en un único
+    UPDATE, solo si cada uno tiene ``stock - held >= cantidad``. Si falla
+    alguna línea se deshace todo y se lanza ``InsufficientStock``.
+    """
+    quantities = _quantities(lines)
+    # Sin barrido programado: las reservas caducadas de estos productos se
+    # liberan aquí, antes de comprobar el stock disponible
+    release_expired_reservations(products=quantities)
+    needed = _quantity_case(quantities)
+    try:
+        with transaction.atomic():
+            updated = Product.objects.filter(
+                pk__in=quantities, stock__gte=F("held") + needed
+            ).update(**changes(needed), updated_at=timezone.now())
+            if updated != len(quantities):
+                # Sale del savepoint: se deshace el cambio parcial
+                raise InsufficientStock([])
+    except InsufficientStock:
+        available = set(
+            Product.objects.filter(
+                pk__in=quantities, stock__gte=F("held") + needed
+            ).values_list("pk", flat=True)
+        )
+        raise InsufficientStock(
+            [(product, qty) for product, qty in lines if product.pk not in available]
+        )
+    # Cambian las unidades disponibles que muestra el catálogo cacheado
+    cache.bump_on_commit("catalog")
+
+
+def decrement_stock(lines):
+    """
+    Resta del stock las cantidades de ``lines`` (lista de (producto, cantidad))
+    en un único UPDATE, respetando las unidades retenidas por otras reservas.
+    """
+    if lines:
+        _guarded_update(lines, lambda needed: {"stock": F("stock") - needed})
+
+
+def reserve_stock(lines, user=None, ttl=None):
+    """
+    Retiene las unidades de ``lines`` durante ``ttl`` (por defecto
+    ``STOCK_RESERVATION_TTL_MINUTES``) y devuelve la ``StockReservation``.
+    Cada línea guarda el precio actual del producto, el que se cobra.
+    Lanza ``InsufficientStock`` si alguna línea no está disponible.
+    """
+    if ttl is None:
+        ttl = timezone.timedelta(minutes=settings.STOCK_RESERVATION_TTL_MINUTES)
+    now = timezone.now()
+    with transaction.atomic():
+        _guarded_update(lines, lambda needed: {"held": F("held") + needed})
+        reservation = StockReservation.objects.create(
+            user=user, created_at=now, expires_at=now + ttl
+        )
+        prices = {product.pk: product.price for product, _ in lines}
+        StockReservationItem.objects.bulk_create(
+            [
+                StockReservationItem(
+                    reservation=reservation,
+                    product_id=pk,
+                    quantity=qty,
+                    unit_price=prices[pk],
+                )
+                for pk, qty in _quantities(lines).items()
+            ]
+        )
+    return reservation
+
+
+def _claim(reservation, status):
+    """Pasa la reserva de activa a ``status``; False si otro se adelantó."""
+    claimed = StockReservation.objects.filter(
+        pk=reservation.pk, status=ReservationStatus.ACTIVE
+    ).update(status=status)
+    if claimed:
+        reservation.status = status
+    return bool(claimed)
+
+
+def commit_reservation(reservation):
+    """
+    Convierte la retención en venta: resta las unidades de ``stock`` y de
+    ``held`` a la vez. Devuelve False si la reserva ya no estaba activa.
+    """
+    with transaction.atomic():
+        if not _claim(reservation, ReservationStatus.COMMITTED):
+            return False
+        quantities = dict(reservation.items.values_list("product_id", "quantity"))
+        needed = _quantity_case(quantities)
+        Product.objects.filter(pk__in=quantities).update(
+            stock=F("stock") - needed,
+            held=F("held") - needed,
+            updated_at=timezone.now(),
+        )
+        cache.bump_on_commit("catalog")
+    return True
+
+
+def release_reservation(reservation):
+    """Devuelve las unidades retenidas. False si la reserva ya no estaba activa."""
+    with transaction.atomic():
+        if not _claim(reservation, ReservationStatus.RELEASED):
+            return False
+        quantities = dict(reservation.items.values_list("product_id", "quantity"))
+        Product.objects.filter(pk__in=quantities).update(
+            held=F("held") - _quantity_case(quantities), updated_at=timezone.now()
+        )
+        cache.bump_on_commit("catalog")
+    return True
+
+
+def release_expired_reservations(now=None, products=None):
+    """
+    Libera las reservas activas caducadas (solo las que retienen alguno de
+    los ids de ``products``, si se indica). Devuelve cuántas se liberaron.
+    """
+    expired = StockReservation.objects.filter(
+        status=ReservationStatus.ACTIVE, expires_at__lte=now or timezone.now()
+    )
+    if products is not None:
+        expired = expired.filter(items__product_id__in=products).distinct()
+    expired = expired.only("pk")
+    return sum(release_reservation(reservation) for reservation in list(expired))
+
+
+def place_order(
+    *,
+    user,
+    email,
+    address,
+    lines,
+    status=Status.EN_PREPARACION,
+    reservation=None,
+    stripe_session_id=None,
+):
+    """
+    Crea un pedido a partir de ``lines`` (lista de (producto, cantidad)).
+
+    Guarda el precio actual de cada producto en la línea, calcula los
+    totales, descuenta el stock y actualiza los rollups de ventas, todo en
+    una transacción. Si se pasa la ``reservation`` del checkout se confirma en
+    lugar de volver a comprobar el stock (si ya había caducado, se intenta
+    descontar como una compra normal; si ya estaba confirmada se lanza
+    ``ReservationAlreadyCommitted``). Devuelve el pedido creado.
+    """
+    with transaction.atomic():
+        # Primero el stock: si falta algo no se llega a crear el pedido
+        if reservation is None:
+            decrement_stock(lines)
+        elif not commit_reservation(reservation):
+            reservation.refresh_from_db(fields=["status"])
+            if reservation.status == ReservationStatus.COMMITTED:
+                raise ReservationAlreadyCommitted(str(reservation.token))
+            # Caducó y se liberó antes del pago: se intenta como compra normal
+            decrement_stock(lines)
+        order = Order.objects.create(
+            user=user,
+            email=email,
+            address=address,
+            status=status,
+            stripe_session_id=stripe_session_id,
+            total_amount=sum(product.price * qty for product, qty in lines),
+            item_count=sum(qty for _, qty in lines),
+        )
+        OrderProduct.objects.bulk_create(
+            [
+                OrderProduct(
+                    order=order, product=product, quantity=qty, unit_price=product.price
+                )
+                for product, qty in lines
+            ]
+        )
+        ProductSalesRollup.objects.record_order(order, _quantities(lines))
+        DailySales.objects.record_order(order)
+        DailyProductSales.objects.record_order(order, lines)
+        DailyCustomerSales.objects.record_order(order)
+    return order
+
+
+def queue_order_confirmation(order, tracking_url):
+    """
+    Deja en el outbox el correo de confirmación del pedido. Se llama dentro de
+    la transacción del pedido; lo envía ``manage.py run_outbox``.
+    """
+    subject = f"Confirmación de Pedido #{order.tracking_code} - Essenza"
+
+    # Mensaje simple en texto plano
+    message = f"""
+    Hola!
+
+    Gracias por tu compra en Essenza.
+    Tu pedido ha sido confirmado y se está preparando.
+
+    Detalles del pedido:
+    Nº de localizador: {order.tracking_code}
+    Total: {order.total_amount} €
+    Dirección de envío: {order.address}
+
+    Puedes seguir el estado de tu pedido aquí:
+    {tracking_url}
+
+    Gracias por confiar en nosotros.
+    """
+    return EmailOutbox.objects.enqueue(subject, message, [order.email])
+
+
+def _shipping_address(customer_details):
+    address = customer_details["address"]
+    shipping_address = (
+        f"{address['line1']}, {address['city']}, "
+        f"{address['postal_code']}, {address['country']}"
+    )
+    if address.get("line2"):
+        shipping_address += f", {address['line2']}"
+    return shipping_address
+
+
+def fulfill_checkout_session(session):
+    """
+    Crea el pedido de una sesión de Stripe pagada (evento
+    ``checkout.session.completed``). Es idempotente: Stripe puede entregar el
+    mismo evento varias veces y ``Order.stripe_session_id`` es único, así que
+    las repeticiones devuelven el pedido ya creado.
+
+    Las líneas salen de la reserva de stock enlazada en
+    ``client_reference_id``. Devuelve el pedido o ``None`` si no hay reserva.
+    Si no queda stock la reserva pasa a 'failed' con la sesión de Stripe y se
+    lanza ``InsufficientStock``.
+    """
+    existing = Order.objects.filter(stripe_session_id=session["id"]).first()
+    if existing:
+        return existing
+
+    try:
+        token = uuid.UUID(session.get("client_reference_id") or "")
+    except ValueError:
+        token = None
+    reservation = StockReservation.objects.filter(token=token).first()
+    if reservation is None:
+        logger.warning("Sesión de Stripe %s sin reserva de stock", session["id"])
+        return None
+
+    customer_details = session["customer_details"]
+    email = customer_details["email"]
+    lines = []
+    for item in reservation.items.select_related("product"):
+        # Se cobra el precio del checkout: si el producto ha cambiado de precio
+        # desde entonces, el pedido y los rollups deben coincidir con Stripe
+        if item.unit_price is not None:
+            item.product.price = item.unit_price
+        lines.append((item.product, item.quantity))
+    try:
+        with transaction.atomic():
+            order = place_order(
+                user=get_user_model().objects.filter(email=email).first(),
+                email=email,
+                address=_shipping_address(customer_details),
+                lines=lines,
+                reservation=reservation,
+                stripe_session_id=session["id"],
+            )
+            queue_order_confirmation(
+                order, settings.DOMAIN_URL.rstrip("/") + reverse("order_search")
+            )
+            # El carrito pagado ya no hace falta (los anónimos se vacían en la
+            # página de éxito, que es quien tiene su sesión)
+            if reservation.user_id:
+                Cart.objects.filter(user_id=reservation.user_id).delete()
+                transaction.on_commit(
+                    lambda: forget_cart_count(reservation.user_id)
+                )
+    except (IntegrityError, ReservationAlreadyCommitted):
+        # Otra entrega del mismo evento se adelantó
+        return Order.objects.filter(stripe_session_id=session["id"]).first()
+    except InsufficientStock:
+        # La reserva caducó antes del pago y ya no queda stock. Se anota en la
+        # reserva para que la página de éxito lo diga y se pueda reembolsar
+        StockReservation.objects.filter(pk=reservation.pk).update(
+            status=ReservationStatus.FAILED, stripe_session_id=session["id"]
+        )
+        raise
+    return order
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from essenza import cache
+
+from .models import Order, OrderProduct
+
+
+@receiver([post_save, post_delete], sender=Order)
+@receiver([post_save, post_delete], sender=OrderProduct)
+def invalidate_sales_cache(sender, **kwargs):
+    # bulk_create/update no emiten señales: quien los use hace su propio bump
+    cache.bump_on_commit("sales")
@@ -0,0 +1,55 @@
+"""
+Eventos de Stripe falsos para probar el webhook sin conexión.
+
+Genera el JSON de un ``checkout.session.completed`` con la misma forma que el
+real y lo firma como Stripe (cabecera ``Stripe-Signature`` con HMAC-SHA256),
+de modo que ``stripe.Webhook.construct_event`` lo acepta. Lo usan los tests y
+``manage.py loadtest_checkout``.
+"""
+
+import hashlib
+import hmac
+import json
+import time
+import uuid
+
+
+def checkout_session_completed(reservation, email, session_id=None, address=None):
+    """Evento de sesión pagada enlazada a ``reservation`` (client_reference_id)."""
+    address = address or {
+        "line1": "Calle Falsa 123",
+        "line2": None,
+        "city": "Sevilla",
+        "postal_code": "41001",
+        "country": "ES",
+    }
+    session_id = session_id or f"cs_test_{uuid.uuid4().hex}"
+    return {
+        "id": f"evt_{uuid.uuid4().hex}",
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {
+            "object": {
+                "id": session_id,
+                "object": "checkout.session",
+                "client_reference_id": str(reservation.token),
+                "payment_status": "paid",
+                "customer_details": {"email": email, "address": address},
+            }
+        },
+    }
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """Devuelve la cabecera ``Stripe-Signature`` para ``payload`` (str)."""
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def signed_event(event, secret):
+    """``(cuerpo, cabecera de firma)`` listos para enviar al webhook."""
+    payload = json.dumps(event)
+    return payload, sign_payload(payload, secret)
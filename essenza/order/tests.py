@@ -1,9 +1,44 @@
+import threading
+import time
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core import mail
+from django.core.cache import cache as django_cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import DatabaseError, close_old_connections, connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from essenza.pagination import encode_cursor
+from info.models import DailyCustomerSales, DailySales
 from product.models import Category, Product
 
-from order.models import Order, OrderProduct, Status
+from order.models import (
+    EmailOutbox,
+    Order,
+    OrderProduct,
+    OutboxStatus,
+    ProductSalesRollup,
+    ReservationStatus,
+    Status,
+    StockReservation,
+)
+from order.tracking import decode_tracking_code, encode_tracking_code
+from order.stripe_fake import checkout_session_completed, signed_event
+from order.services import (
+    InsufficientStock,
+    ReservationAlreadyCommitted,
+    place_order,
+    queue_order_confirmation,
+    release_reservation,
+    reserve_stock,
+)
+from order.views import SUCCESS_POLLS
 
 User = get_user_model()
 
@@ -86,6 +121,60 @@ class OrderListUserViewTests(TestCase):
         self.assertEqual(resp.status_code, 302)
         self.assertTrue("login" in resp.url)
 
+    def test_history_lists_only_own_orders(self):
+        """El historial muestra los pedidos del usuario, también los 'en preparación'."""
+        self.client.force_login(self.user)
+        resp = self.client.get(self.url)
+        self.assertEqual(
+            {o.pk for o in resp.context["orders"]},
+            {self.order_user.pk, self.order_hidden.pk},
+        )
+
+    def test_history_is_one_query_without_distinct(self):
+        """Filtra solo por user_id: sin OR por email ni DISTINCT."""
+        self.client.force_login(self.user)
+        self.client.get(self.url)  # calienta la sesión
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url)
+        order_queries = [
+            q["sql"] for q in ctx.captured_queries if '"order_order"' in q["sql"]
+        ]
+        self.assertEqual(len(order_queries), 1)
+        self.assertNotIn("DISTINCT", order_queries[0])
+        self.assertNotIn('"email"', order_queries[0].split("WHERE")[1])
+
+    def test_history_is_paginated(self):
+        """El historial se pagina por cursor."""
+        Order.objects.bulk_create(
+            [
+                Order(user=self.user, email=self.user.email, address="Calle")
+                for _ in range(15)
+            ]
+        )
+        self.client.force_login(self.user)
+        first = self.client.get(self.url)
+        self.assertEqual(len(first.context["orders"]), 10)
+        self.assertTrue(first.context["page"].has_next)
+        second = self.client.get(
+            self.url, {"cursor": first.context["page"].next_cursor}
+        )
+        self.assertEqual(len(second.context["orders"]), 7)
+        seen = {o.pk for o in first.context["orders"]}
+        self.assertFalse(seen & {o.pk for o in second.context["orders"]})
+
+    def test_backfill_links_guest_orders(self):
+        """El comando enlaza pedidos de invitado por email sin distinguir mayúsculas."""
+        guest = Order.objects.create(email="x@test.com", address="Calle")
+        Order.objects.filter(pk=guest.pk).update(email="USER@test.com")
+        orphan = Order.objects.create(email="nadie@test.com", address="Calle")
+        out = StringIO()
+        call_command("link_guest_orders", batch_size=1, stdout=out)
+        guest.refresh_from_db()
+        orphan.refresh_from_db()
+        self.assertEqual(guest.user, self.user)
+        self.assertIsNone(orphan.user)
+        self.assertIn("Pedidos enlazados: 1", out.getvalue())
+
 
 # ============================================================
 # TESTS: LISTADO DE PEDIDOS DEL ADMIN
@@ -150,6 +239,76 @@ class OrderListAdminViewTests(TestCase):
             resp, self.order.tracking_code
         )  # Debe salir el tracking code
 
+    def _many_orders(self, count, status=Status.EN_PREPARACION):
+        for i in range(count):
+            order = Order.objects.create(
+                email=f"lote{i}@test.com", status=status, address="Calle Lote"
+            )
+            for _ in range(4):
+                OrderProduct.objects.create(order=order, product=self.product, quantity=1)
+
+    def test_query_count_does_not_grow_with_orders(self):
+        """El número de consultas no depende de cuántos pedidos haya."""
+        self.client.login(email="admin@test.com", password="1234")
+        self._many_orders(3)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        self._many_orders(30)
+        with CaptureQueriesContext(connection) as many:
+            resp = self.client.get(self.url)
+
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(resp.context["orders"]), 20)
+        self.assertTrue(resp.context["page"].has_next)
+        self.assertContains(resp, "+ 1 más...")
+
+    def test_cursor_pagination_by_date(self):
+        """Las páginas siguen el orden por fecha sin repetir pedidos."""
+        self.client.login(email="admin@test.com", password="1234")
+        self._many_orders(25)
+
+        first = self.client.get(self.url)
+        second = self.client.get(
+            self.url, {"cursor": first.context["page"].next_cursor}
+        )
+        seen = [o.pk for o in first.context["orders"]] + [
+            o.pk for o in second.context["orders"]
+        ]
+        self.assertEqual(len(seen), 26)
+        self.assertEqual(len(set(seen)), 26)
+        self.assertFalse(second.context["page"].has_next)
+
+    def test_tampered_cursor_returns_first_page(self):
+        """Un cursor con una fecha o un id inválidos se ignora."""
+        self.client.login(email="admin@test.com", password="1234")
+        for values in (["ayer", 1], ["2026-01-01T00:00:00+00:00", "abc"]):
+            resp = self.client.get(self.url, {"cursor": encode_cursor(values)})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(self.order, resp.context["orders"])
+
+    def test_status_counts(self):
+        """Las pestañas muestran cuántos pedidos hay en cada estado."""
+        self.client.login(email="admin@test.com", password="1234")
+        self._many_orders(2)
+        resp = self.client.get(self.url, {"status": Status.ENVIADO})
+
+        self.assertEqual(
+            resp.context["status_counts"],
+            {"total": 3, "en_preparacion": 2, "enviado": 1, "entregado": 0},
+        )
+        self.assertEqual(list(resp.context["orders"]), [self.order])
+
+    def test_search_by_tracking_prefix_and_email(self):
+        """Se puede buscar por el inicio del localizador o por el email."""
+        self.client.login(email="admin@test.com", password="1234")
+        self._many_orders(5)
+
+        resp = self.client.get(self.url, {"q": self.order.tracking_code[:6].lower()})
+        self.assertEqual(list(resp.context["orders"]), [self.order])
+
+        resp = self.client.get(self.url, {"q": "CLIENTE@test.com"})
+        self.assertEqual(list(resp.context["orders"]), [self.order])
+
 
 class OrderTrackViewTests(TestCase):
     @classmethod
@@ -211,3 +370,714 @@ class OrderTrackViewTests(TestCase):
         resp = self.client.post(self.url_search, data)
         self.assertEqual(resp.status_code, 200)
         self.assertTrue(resp.context["searched"])  # Indica que se intentó buscar
+
+
+# ============================================================
+# TESTS: TOTALES DESNORMALIZADOS
+# ============================================================
+
+
+class OrderTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(self):
+        self.product = Product.objects.create(
+            name="Producto Totales",
+            price="10.00",
+            stock=10,
+            is_active=True,
+            category=Category.MAQUILLAJE,
+            brand="Marca T",
+        )
+        self.order = Order.objects.create(
+            email="totales@test.com", status=Status.ENVIADO, address="Calle T"
+        )
+        OrderProduct.objects.create(order=self.order, product=self.product, quantity=3)
+        self.order.recalculate_totals()
+
+    def test_line_snapshots_product_price(self):
+        """La línea guarda el precio del producto en el momento de la compra."""
+        line = self.order.order_products.get()
+        self.assertEqual(str(line.unit_price), "10.00")
+        self.assertEqual(str(line.subtotal), "30.00")
+
+    def test_totals_ignore_later_price_changes(self):
+        """Cambiar el precio del producto no altera los pedidos ya hechos."""
+        Product.objects.filter(pk=self.product.pk).update(price="99.00")
+
+        self.order.recalculate_totals()
+        self.order.refresh_from_db()
+        self.assertEqual(str(self.order.total_amount), "30.00")
+        self.assertEqual(self.order.item_count, 3)
+
+
+# ============================================================
+# TESTS: SERVICIO DE PREPARACIÓN DE PEDIDOS
+# ============================================================
+
+
+class PlaceOrderServiceTests(TestCase):
+    @classmethod
+    def setUpTestData(self):
+        self.products = [
+            Product.objects.create(
+                name=f"Producto {i}",
+                price=Decimal("5.00"),
+                stock=10,
+                is_active=True,
+                category=Category.TRATAMIENTO,
+                brand="Marca S",
+            )
+            for i in range(20)
+        ]
+
+    def _place(self, lines):
+        return place_order(
+            user=None, email="servicio@test.com", address="Calle S", lines=lines
+        )
+
+    def test_creates_lines_and_decrements_stock(self):
+        """Crea las líneas con su precio y resta el stock de cada producto."""
+        order = self._place([(self.products[0], 3), (self.products[1], 10)])
+
+        self.assertEqual(order.order_products.count(), 2)
+        self.assertEqual(str(order.total_amount), "65.00")
+        self.assertEqual(order.item_count, 13)
+        self.products[0].refresh_from_db()
+        self.products[1].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 7)
+        self.assertEqual(self.products[1].stock, 0)
+        self.assertEqual(
+            ProductSalesRollup.objects.get(product=self.products[0]).units, 3
+        )
+
+    def test_insufficient_stock_reports_failed_lines(self):
+        """Si falta stock no se crea el pedido ni se toca ningún producto."""
+        with self.assertRaises(InsufficientStock) as ctx:
+            self._place(
+                [(self.products[0], 2), (self.products[1], 11), (self.products[2], 50)]
+            )
+
+        self.assertEqual(
+            ctx.exception.failed_lines,
+            [(self.products[1], 11), (self.products[2], 50)],
+        )
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(
+            list(
+                Product.objects.filter(pk__in=[p.pk for p in self.products[:3]])
+                .order_by("pk")
+                .values_list("stock", flat=True)
+            ),
+            [10, 10, 10],
+        )
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        """Un carrito de 2 líneas y uno de 15 hacen las mismas consultas."""
+        # El primer pedido del día crea la fila de invitados del rollup diario
+        self._place([(self.products[0], 1)])
+        with CaptureQueriesContext(connection) as small:
+            self._place([(p, 1) for p in self.products[:2]])
+        with CaptureQueriesContext(connection) as large:
+            self._place([(p, 1) for p in self.products[2:17]])
+
+        self.assertEqual(len(small), len(large))
+
+
+# ============================================================
+# TESTS: RESERVAS DE STOCK
+# ============================================================
+
+
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(self):
+        self.product = Product.objects.create(
+            name="Producto Reservado",
+            price=Decimal("8.00"),
+            stock=5,
+            is_active=True,
+            category=Category.PERFUME,
+            brand="Marca R",
+        )
+
+    def _place(self, qty, reservation=None):
+        return place_order(
+            user=None,
+            email="reserva@test.com",
+            address="Calle R",
+            lines=[(self.product, qty)],
+            reservation=reservation,
+        )
+
+    def test_hold_reduces_available_but_not_stock(self):
+        """La reserva retiene unidades sin tocar el stock."""
+        reserve_stock([(self.product, 3)])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        self.assertEqual(self.product.available, 2)
+
+        with self.assertRaises(InsufficientStock):
+            reserve_stock([(self.product, 3)])
+
+    def test_commit_moves_held_units_to_sale(self):
+        """Al pagar se descuentan del stock las unidades retenidas."""
+        reservation = reserve_stock([(self.product, 2)])
+        self._place(2, reservation)
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.held), (3, 0))
+        self.assertEqual(reservation.status, ReservationStatus.COMMITTED)
+
+        with self.assertRaises(ReservationAlreadyCommitted):
+            self._place(2, reservation)
+
+    def test_direct_purchase_respects_holds(self):
+        """Una compra sin reserva no puede llevarse unidades retenidas."""
+        reserve_stock([(self.product, 4)])
+        with self.assertRaises(InsufficientStock):
+            self._place(2)
+
+    def test_release_and_sweeper(self):
+        """Cancelar o caducar devuelve las unidades; liberar dos veces no hace nada."""
+        cancelled = reserve_stock([(self.product, 1)])
+        self.assertTrue(release_reservation(cancelled))
+        self.assertFalse(release_reservation(cancelled))
+
+        reserve_stock([(self.product, 2)], ttl=timezone.timedelta(seconds=-1))
+        reserve_stock([(self.product, 1)])
+        call_command("release_expired_reservations", stdout=StringIO())
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.held, 1)
+
+    def test_expired_holds_are_released_without_sweeper(self):
+        """Una reserva caducada no bloquea el stock aunque no corra el barrido."""
+        expired = reserve_stock(
+            [(self.product, 5)], ttl=timezone.timedelta(seconds=-1)
+        )
+        reserve_stock([(self.product, 4)])
+
+        expired.refresh_from_db()
+        self.assertEqual(expired.status, ReservationStatus.RELEASED)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.held, 4)
+
+    def test_catalog_shows_available_units(self):
+        """El catálogo muestra 'agotado' cuando todo el stock está retenido."""
+        reserve_stock([(self.product, 5)])
+        resp = self.client.get(reverse("catalog_page"))
+        self.assertEqual(resp.json()["results"][0]["stock"], 0)
+
+    def test_editing_product_keeps_concurrent_holds(self):
+        """Guardar un producto leído antes de una reserva no pisa ``held``."""
+        stale = Product.objects.get(pk=self.product.pk)
+        reserve_stock([(self.product, 2)])
+        stale.stock = 7
+        stale.save()
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.held), (7, 2))
+
+    @mock.patch("order.views.stripe.checkout.Session.create")
+    def test_stripe_session_respects_minimum_expiry(self, create_session):
+        """La sesión de Stripe caduca a 30 min o más y la reserva dura más."""
+        create_session.return_value = mock.Mock(url="https://stripe.test/pay")
+        session = self.client.session
+        session["cart_session"] = {str(self.product.pk): {"quantity": 1}}
+        session.save()
+        for minutes in (5, 30):
+            with self.settings(STOCK_RESERVATION_TTL_MINUTES=minutes):
+                start = time.time()
+                self.client.get(reverse("create_checkout"))
+            expires_at = create_session.call_args.kwargs["expires_at"]
+            self.assertGreaterEqual(expires_at, start + 30 * 60)
+            reservation = StockReservation.objects.latest("pk")
+            self.assertGreater(reservation.expires_at.timestamp(), expires_at)
+
+
+class StockReservationConcurrencyTests(TransactionTestCase):
+    """Muchos checkouts simultáneos compitiendo por pocas unidades."""
+
+    BUYERS = 24
+    STOCK = 5
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Última unidad",
+            price=Decimal("20.00"),
+            stock=self.STOCK,
+            is_active=True,
+            category=Category.PERFUME,
+            brand="Marca C",
+        )
+
+    def _retry(self, func):
+        # SQLite en memoria no espera a los bloqueos: falla y se reintenta
+        for attempt in range(50):
+            try:
+                return func()
+            except DatabaseError:
+                time.sleep(0.01 * (attempt % 5 + 1))
+        raise DatabaseError("bloqueado")
+
+    def _checkout(self, barrier, results):
+        try:
+            barrier.wait()
+            reservation = self._retry(lambda: reserve_stock([(self.product, 1)]))
+            self._retry(
+                lambda: place_order(
+                    user=None,
+                    email="concurrente@test.com",
+                    address="Calle C",
+                    lines=[(self.product, 1)],
+                    reservation=reservation,
+                )
+            )
+            results.append("ok")
+        except InsufficientStock:
+            results.append("agotado")
+        except DatabaseError:
+            results.append("bloqueado")
+        finally:
+            close_old_connections()
+            connection.close()
+
+    def test_no_oversell(self):
+        """Nunca se venden más unidades de las que hay en stock."""
+        barrier = threading.Barrier(self.BUYERS)
+        results = []
+        threads = [
+            threading.Thread(target=self._checkout, args=(barrier, results))
+            for _ in range(self.BUYERS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.product.refresh_from_db()
+        sold = results.count("ok")
+        self.assertEqual(sold, self.STOCK)
+        self.assertEqual(results.count("agotado"), self.BUYERS - self.STOCK)
+        self.assertEqual(self.product.stock, self.STOCK - sold)
+        self.assertEqual(self.product.held, 0)
+        self.assertEqual(Order.objects.count(), sold)
+        self.assertGreaterEqual(self.product.stock, 0)
+
+
+# ============================================================
+# TESTS: OUTBOX DE CORREOS
+# ============================================================
+
+
+class FlakyEmailBackend(EmailBackend):
+    """Backend locmem que falla con los destinatarios que contienen 'falla'."""
+
+    opened = 0
+
+    def open(self):
+        FlakyEmailBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        if any("falla" in to for message in messages for to in message.to):
+            raise ConnectionError("proveedor caído")
+        return super().send_messages(messages)
+
+
+class EmailOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(self):
+        self.product = Product.objects.create(
+            name="Producto Correo",
+            price=Decimal("12.00"),
+            stock=5,
+            is_active=True,
+            category=Category.CABELLO,
+            brand="Marca E",
+        )
+
+    def test_confirmation_is_queued_not_sent(self):
+        """El correo del pedido se guarda en el outbox y no se envía en la petición."""
+        order = place_order(
+            user=None,
+            email="cliente@test.com",
+            address="Calle E",
+            lines=[(self.product, 1)],
+        )
+        queue_order_confirmation(order, "http://testserver/order/search/")
+
+        self.assertEqual(len(mail.outbox), 0)
+        queued = EmailOutbox.objects.get()
+        self.assertEqual(queued.to, ["cliente@test.com"])
+        self.assertIn(order.tracking_code, queued.subject)
+
+    def test_run_outbox_sends_batch_over_one_connection(self):
+        """El worker vacía la cola abriendo una sola conexión por lote."""
+        for i in range(5):
+            EmailOutbox.objects.enqueue(f"Asunto {i}", "Cuerpo", [f"c{i}@test.com"])
+
+        FlakyEmailBackend.opened = 0
+        sent, failed = EmailOutbox.objects.send_pending(
+            connection=FlakyEmailBackend()
+        )
+
+        self.assertEqual((sent, failed), (5, 0))
+        self.assertEqual(FlakyEmailBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(EmailOutbox.objects.due().exists())
+
+    def test_failed_email_is_retried_with_backoff(self):
+        """Un fallo reprograma el correo y tras varios intentos queda como fallido."""
+        EmailOutbox.objects.enqueue("Bien", "Cuerpo", ["ok@test.com"])
+        failing = EmailOutbox.objects.enqueue("Mal", "Cuerpo", ["falla@test.com"])
+
+        sent, failed = EmailOutbox.objects.send_pending(
+            connection=FlakyEmailBackend()
+        )
+        self.assertEqual((sent, failed), (1, 1))
+
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, OutboxStatus.PENDING)
+        self.assertEqual(failing.attempts, 1)
+        self.assertGreater(failing.next_attempt_at, timezone.now())
+        self.assertIn("proveedor caído", failing.last_error)
+
+        EmailOutbox.objects.filter(pk=failing.pk).update(
+            attempts=EmailOutbox.objects.MAX_ATTEMPTS - 1,
+            next_attempt_at=timezone.now(),
+        )
+        EmailOutbox.objects.send_pending(connection=FlakyEmailBackend())
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, OutboxStatus.FAILED)
+
+    def test_run_outbox_command(self):
+        """``manage.py run_outbox --once`` envía con el backend configurado (locmem)."""
+        EmailOutbox.objects.enqueue("Asunto", "Cuerpo", ["cmd@test.com"])
+        call_command("run_outbox", "--once", stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["cmd@test.com"])
+        self.assertEqual(EmailOutbox.objects.get().status, OutboxStatus.SENT)
+
+    def test_batch_is_claimed_before_sending(self):
+        """Mientras se envía, el lote está reservado y otro worker no lo ve."""
+        EmailOutbox.objects.enqueue("Asunto", "Cuerpo", ["lease@test.com"])
+        seen = []
+
+        class InspectingBackend(FlakyEmailBackend):
+            def send_messages(self, messages):
+                seen.append(
+                    (
+                        EmailOutbox.objects.get().status,
+                        EmailOutbox.objects.due().exists(),
+                    )
+                )
+                return super().send_messages(messages)
+
+        EmailOutbox.objects.send_pending(connection=InspectingBackend())
+        self.assertEqual(seen, [(OutboxStatus.SENDING, False)])
+        self.assertEqual(EmailOutbox.objects.get().status, OutboxStatus.SENT)
+
+    def test_expired_lease_is_sent_again(self):
+        """Un lote de un worker caído vuelve a la cola al vencer su plazo."""
+        EmailOutbox.objects.enqueue("Asunto", "Cuerpo", ["caido@test.com"])
+        self.assertEqual(len(EmailOutbox.objects.claim()), 1)
+        self.assertEqual(EmailOutbox.objects.send_pending(), (0, 0))
+
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(EmailOutbox.objects.send_pending(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(EmailOutbox.objects.get().attempts, 2)
+
+    def test_email_that_kills_the_worker_ends_failed(self):
+        """Reclamar tras un plazo vencido cuenta como intento."""
+        EmailOutbox.objects.enqueue("Asunto", "Cuerpo", ["mortal@test.com"])
+        for _ in range(EmailOutbox.objects.MAX_ATTEMPTS):
+            # El worker reclama el lote y muere sin llegar a enviarlo
+            self.assertEqual(len(EmailOutbox.objects.claim()), 1)
+            EmailOutbox.objects.update(next_attempt_at=timezone.now())
+
+        self.assertEqual(EmailOutbox.objects.claim(), [])
+        email = EmailOutbox.objects.get()
+        self.assertEqual(email.status, OutboxStatus.FAILED)
+        self.assertEqual(email.attempts, EmailOutbox.objects.MAX_ATTEMPTS)
+
+
+# ============================================================
+# TESTS: WEBHOOK DE STRIPE
+# ============================================================
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET="whsec_test")
+class StripeWebhookTests(TestCase):
+    @classmethod
+    def setUpTestData(self):
+        self.product = Product.objects.create(
+            name="Producto Webhook",
+            price=Decimal("15.00"),
+            stock=4,
+            is_active=True,
+            category=Category.MAQUILLAJE,
+            brand="Marca W",
+        )
+        self.url = reverse("stripe_webhook")
+
+    def _deliver(self, event, secret="whsec_test"):
+        payload, signature = signed_event(event, secret)
+        return self.client.post(
+            self.url,
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=signature,
+        )
+
+    def test_creates_order_once(self):
+        """Entregar el mismo evento varias veces crea un único pedido."""
+        reservation = reserve_stock([(self.product, 2)])
+        event = checkout_session_completed(reservation, "webhook@test.com")
+
+        for _ in range(3):
+            self.assertEqual(self._deliver(event).status_code, 200)
+
+        order = Order.objects.get()
+        self.assertEqual(order.stripe_session_id, event["data"]["object"]["id"])
+        self.assertEqual(order.item_count, 2)
+        self.assertEqual(EmailOutbox.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.held), (2, 0))
+
+    def test_order_keeps_checkout_price(self):
+        """Un cambio de precio entre el checkout y el webhook no altera el pedido."""
+        reservation = reserve_stock([(self.product, 2)])
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal("20.00"))
+        self._deliver(checkout_session_completed(reservation, "webhook@test.com"))
+
+        order = Order.objects.get()
+        self.assertEqual(order.total_amount, Decimal("30.00"))
+        self.assertEqual(
+            order.order_products.get().unit_price, Decimal("15.00")
+        )
+
+    def test_confirmation_email_is_sent_by_worker(self):
+        """El correo del pedido creado por el webhook lo envía el worker."""
+        reservation = reserve_stock([(self.product, 1)])
+        self._deliver(checkout_session_completed(reservation, "webhook@test.com"))
+        self.assertEqual(EmailOutbox.objects.get().status, OutboxStatus.PENDING)
+
+        call_command("run_outbox", "--once", stdout=StringIO())
+        self.assertEqual(EmailOutbox.objects.get().status, OutboxStatus.SENT)
+        self.assertEqual(mail.outbox[0].to, ["webhook@test.com"])
+
+    def test_rejects_bad_signature(self):
+        """Un evento sin firma válida no crea nada."""
+        reservation = reserve_stock([(self.product, 1)])
+        event = checkout_session_completed(reservation, "webhook@test.com")
+
+        self.assertEqual(self._deliver(event, secret="whsec_otro").status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_success_page_only_reads_order(self):
+        """La página de éxito muestra el pedido sin volver a crearlo."""
+        reservation = reserve_stock([(self.product, 1)])
+        event = checkout_session_completed(reservation, "webhook@test.com")
+        session_id = event["data"]["object"]["id"]
+        url = reverse("successful_payment") + f"?session_id={session_id}"
+
+        resp = self.client.get(url)
+        self.assertIsNone(resp.context["order"])
+        self.assertContains(resp, "Confirmando tu pago")
+
+        self._deliver(event)
+        with self.assertNumQueries(1):
+            resp = self.client.get(url)
+        self.assertEqual(resp.context["order"], Order.objects.get())
+        self.client.get(url)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_success_page_stops_polling(self):
+        """Si el webhook no llega, la página deja de recargarse y avisa."""
+        url = reverse("successful_payment")
+        resp = self.client.get(url, {"session_id": "cs_sin_webhook"})
+        self.assertContains(
+            resp, "url=?session_id=cs_sin_webhook&amp;attempt=1", count=1
+        )
+
+        resp = self.client.get(
+            url, {"session_id": "cs_sin_webhook", "attempt": SUCCESS_POLLS}
+        )
+        self.assertNotContains(resp, 'http-equiv="refresh"')
+        self.assertContains(resp, "te enviaremos un email")
+
+    def test_paid_without_stock_is_reported(self):
+        """Si al pagar ya no queda stock, la página de éxito avisa y no recarga."""
+        reservation = reserve_stock([(self.product, 2)])
+        event = checkout_session_completed(reservation, "webhook@test.com")
+        session_id = event["data"]["object"]["id"]
+        # La reserva caduca y otro cliente retiene todo el stock
+        release_reservation(reservation)
+        reserve_stock([(self.product, 4)])
+
+        with self.assertLogs("order.views", "ERROR"):
+            self.assertEqual(self._deliver(event).status_code, 200)
+        self.assertFalse(Order.objects.exists())
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, ReservationStatus.FAILED)
+        self.assertEqual(reservation.stripe_session_id, session_id)
+
+        resp = self.client.get(
+            reverse("successful_payment") + f"?session_id={session_id}"
+        )
+        self.assertTrue(resp.context["failed"])
+        self.assertContains(resp, "devolveremos el importe")
+        self.assertNotContains(resp, 'http-equiv="refresh"')
+
+
+class LoadtestCheckoutCommandTests(TransactionTestCase):
+    """El comando de carga usa hilos: necesita datos confirmados en la base."""
+
+    def test_cleanup_restores_daily_rollups(self):
+        product = Product.objects.create(
+            name="Venta real",
+            price=Decimal("12.00"),
+            stock=5,
+            is_active=True,
+            category=Category.PERFUME,
+            brand="Marca R",
+        )
+        place_order(
+            user=None, email="real@example.com", address="C/ Real 1", lines=[(product, 2)]
+        )
+        before = (
+            list(DailySales.objects.values("day", "orders", "units", "revenue")),
+            list(DailyCustomerSales.objects.values("day", "orders", "revenue")),
+        )
+
+        out = StringIO()
+        call_command(
+            "loadtest_checkout",
+            orders=3,
+            concurrency=1,
+            duplicates=1,
+            stdout=out,
+            stderr=StringIO(),
+        )
+
+        self.assertIn("Un pedido por pago.", out.getvalue())
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(
+            (
+                list(DailySales.objects.values("day", "orders", "units", "revenue")),
+                list(DailyCustomerSales.objects.values("day", "orders", "revenue")),
+            ),
+            before,
+        )
+
+
+# ============================================================
+# TESTS: LOCALIZADORES DERIVADOS DEL ID
+# ============================================================
+
+
+class TrackingCodeTests(TestCase):
+    def test_codes_are_a_reversible_permutation(self):
+        """Ids distintos dan códigos distintos y el código se puede invertir."""
+        ids = list(range(1, 5000)) + [2**40, 2**50 - 1]
+        codes = [encode_tracking_code(n) for n in ids]
+
+        self.assertEqual(len(set(codes)), len(ids))
+        self.assertTrue(all(len(code) == 10 for code in codes))
+        self.assertEqual([decode_tracking_code(code) for code in codes], ids)
+        # Ids consecutivos no dan códigos consecutivos
+        self.assertNotEqual(codes[0][:8], codes[1][:8])
+
+    def test_create_does_not_probe_for_duplicates(self):
+        """Crear un pedido no consulta si el código ya existe."""
+        user = User.objects.create_user(
+            username="codigo", email="codigo@test.com", password="1234"
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            order = Order.objects.create(
+                user=user, email=user.email, address="Calle Código"
+            )
+
+        self.assertFalse(
+            [q for q in ctx.captured_queries if q["sql"].startswith("SELECT")]
+        )
+        self.assertEqual(order.tracking_code, encode_tracking_code(order.pk))
+        order.refresh_from_db()
+        self.assertEqual(order.tracking_code, encode_tracking_code(order.pk))
+
+    def test_guest_user_lookup_only_on_insert(self):
+        """El usuario se busca por email al crear, no al cambiar el estado."""
+        order = Order.objects.create(email="invitado@test.com", address="Calle I")
+
+        with self.assertNumQueries(1):
+            order.status = Status.ENVIADO
+            order.save()
+
+
+# ============================================================
+# TESTS: CACHÉ DE FRAGMENTOS DE LOS LISTADOS
+# ============================================================
+
+
+class OrderRowCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username="admin_filas", email="admin_filas@test.com", password="1234"
+        )
+        cls.admin.role = "admin"
+        cls.admin.save()
+        cls.product = Product.objects.create(
+            name="Colonia Fila",
+            price="8.00",
+            stock=10,
+            is_active=True,
+            category=Category.PERFUME,
+            brand="Brand",
+        )
+        cls.order = Order.objects.create(
+            user=cls.admin, email="filas@test.com", address="Calle Original"
+        )
+        OrderProduct.objects.create(order=cls.order, product=cls.product, quantity=2)
+
+    def setUp(self):
+        django_cache.clear()
+        self.client.force_login(self.admin)
+
+    def test_row_is_reused_until_the_order_changes(self):
+        url = reverse("order_list_admin")
+        self.assertContains(self.client.get(url), "Calle Original")
+
+        # Un UPDATE que no toca updated_at no invalida la fila cacheada
+        Order.objects.filter(pk=self.order.pk).update(address="Calle Nueva")
+        self.assertContains(self.client.get(url), "Calle Original")
+        self.assertContains(self.client.get(reverse("order_history")), "Calle Nueva")
+
+        self.client.post(
+            reverse("order_update_status", args=[self.order.tracking_code]),
+            {"status": Status.ENVIADO},
+        )
+        self.assertContains(self.client.get(url), "Calle Nueva")
+
+    def test_rows_refresh_when_a_product_changes(self):
+        """Las filas muestran el nombre del producto: editarlo las invalida."""
+        urls = [reverse("order_list_admin"), reverse("order_history")]
+        for url in urls:
+            self.assertContains(self.client.get(url), "Colonia Fila")
+
+        self.product.name = "Colonia Renombrada"
+        self.product.save()
+        for url in urls:
+            response = self.client.get(url)
+            self.assertContains(response, "Colonia Renombrada")
+            self.assertNotContains(response, "Colonia Fila")
+
+    def test_partial_save_refreshes_updated_at(self):
+        stamp = self.order.updated_at
+        self.order.recalculate_totals()
+        self.order.refresh_from_db()
+        self.assertGreater(self.order.updated_at, stamp)
+        self.assertEqual(self.order.item_count, 2)
@@ -8,6 +8,7 @@ urlpatterns = [
     path("create_checkout/", views.create_checkout, name="create_checkout"),
     path("success/", views.successful_payment, name="successful_payment"),
     path("cancelled/", views.cancelled_payment, name="cancelled_payment"),
+    path("webhook/stripe/", views.stripe_webhook, name="stripe_webhook"),
     path(
         "track/<str:tracking_code>/",
         views.OrderTrackingView.as_view(),
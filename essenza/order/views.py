@@ -1,34 +1,59 @@
+import logging
+from urllib.parse import urlencode
+
 import stripe
-from cart.models import Cart
+from cart.services import clear_cart, forget_cart_count, get_cart_summary
 from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.core.exceptions import PermissionDenied
 from django.core.mail import send_mail
-from django.db import transaction  # Para la integridad de datos
-from django.db.models import (
-    F,  # Para restar el stock de forma segura
-    Prefetch,
-    Q,
-)
+from django.db.models import Count, Prefetch
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.urls import reverse
+from django.utils import timezone
 from django.views import View
-from product.models import Product
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from essenza.pagination import KeysetPaginator
+
+from .models import (
+    Order,
+    OrderProduct,
+    ReservationStatus,
+    Status,
+    StockReservation,
+)
+from .services import (
+    InsufficientStock,
+    fulfill_checkout_session,
+    release_reservation,
+    reserve_stock,
+)
 
-from .models import Order, OrderProduct, Status
+logger = logging.getLogger(__name__)
 
 # Configuración de Stripe
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+# Stripe exige que la sesión de pago caduque entre 30 minutos y 24 horas después
+# de crearla; se deja un minuto de holgura por la latencia de la llamada
+STRIPE_SESSION_MIN_TTL = timezone.timedelta(minutes=31)
+STRIPE_SESSION_MAX_TTL = timezone.timedelta(hours=23)
+# La retención de stock dura algo más que la sesión de Stripe: un pago hecho en
+# el último momento todavía encuentra su reserva activa
+RESERVATION_MARGIN = timezone.timedelta(minutes=5)
+# Recargas de la página de éxito esperando al webhook (cada 3 s: un minuto).
+# Si no llega (webhook mal configurado, pago sin reserva) se deja de recargar
+SUCCESS_POLLS = 20
+
 
 # =======================================================
 # LISTADO DE PEDIDOS - ADMIN
 # =======================================================
 class OrderListAdminView(LoginRequiredMixin, UserPassesTestMixin, View):
     template_name = "order/order_list_admin.html"
+    paginate_by = 20
 
     def test_func(self):
         return self.request.user.is_authenticated and self.request.user.role == "admin"
@@ -39,15 +64,11 @@ class OrderListAdminView(LoginRequiredMixin, UserPassesTestMixin, View):
         return redirect("dashboard")
 
     def get(self, request):
-        orders = (
-            Order.objects.select_related("user")
-            .prefetch_related(
-                Prefetch(
-                    "order_products",
-                    queryset=OrderProduct.objects.select_related("product"),
-                )
+        orders = Order.objects.prefetch_related(
+            Prefetch(
+                "order_products",
+                queryset=OrderProduct.objects.select_related("product"),
             )
-            .order_by("-placed_at")
         )
         # 2. Lógica de Filtrado
         status_filter = request.GET.get("status")
@@ -59,7 +80,39 @@ class OrderListAdminView(LoginRequiredMixin, UserPassesTestMixin, View):
 
         if status_filter in valid_statuses:
             orders = orders.filter(status=status_filter)
-        return render(request, self.template_name, {"orders": orders})
+
+        # 3. Búsqueda por email o por inicio del localizador (ambas con índice)
+        q = request.GET.get("q", "").strip()
+        if "@" in q:
+            orders = orders.for_email(q)
+        elif q:
+            # Rango [prefijo, prefijo siguiente) en vez de LIKE: usa el índice
+            # único de tracking_code en cualquier motor
+            prefix = q.upper()
+            orders = orders.filter(
+                tracking_code__gte=prefix,
+                tracking_code__lt=prefix[:-1] + chr(ord(prefix[-1]) + 1),
+            )
+
+        # 4. Contadores de las pestañas en una sola consulta
+        counts = dict(
+            Order.objects.values_list("status").annotate(total=Count("id")).order_by()
+        )
+        status_counts = {
+            "total": sum(counts.values()),
+            **{value: counts.get(value, 0) for value in valid_statuses},
+        }
+
+        page = KeysetPaginator(orders, ("-placed_at", "-pk"), self.paginate_by).page(
+            request.GET.get("cursor")
+        )
+        context = {
+            "orders": page.object_list,
+            "page": page,
+            "query": q,
+            "status_counts": status_counts,
+        }
+        return render(request, self.template_name, context)
 
 
 # =======================================================
@@ -67,24 +120,25 @@ class OrderListAdminView(LoginRequiredMixin, UserPassesTestMixin, View):
 # =======================================================
 class OrderHistoryView(LoginRequiredMixin, View):
     template_name = "order/order_history.html"
+    paginate_by = 10
 
     def get(self, request):
-        # CORRECCIÓN 1: Usamos Q para buscar por Usuario O por Email
-        # Esto permite ver pedidos hechos como invitado si el email coincide
-        orders = (
-            Order.objects.filter(Q(user=request.user) | Q(email=request.user.email))
-            # CORRECCIÓN 2: Eliminado .exclude(status=Status.EN_PREPARACION)
-            # Ahora los pedidos 'en preparación' (recién pagados) SÍ se muestran.
-            .prefetch_related(
-                Prefetch(
-                    "order_products",
-                    queryset=OrderProduct.objects.select_related("product"),
-                )
+        # Los pedidos de invitado se enlazan a la cuenta al registrarse o
+        # cambiar de email (Order.objects.link_guest_orders), así que basta
+        # con filtrar por usuario: una sola consulta sobre el índice
+        # (user, placed_at). Los pedidos 'en preparación' también se muestran.
+        orders = Order.objects.filter(user=request.user).prefetch_related(
+            Prefetch(
+                "order_products",
+                queryset=OrderProduct.objects.select_related("product"),
             )
-            .order_by("-placed_at")
-            .distinct()  # Evita duplicados si user y email coinciden en el mismo pedido
         )
-        return render(request, self.template_name, {"orders": orders})
+        page = KeysetPaginator(orders, ("-placed_at", "-pk"), self.paginate_by).page(
+            request.GET.get("cursor")
+        )
+        return render(
+            request, self.template_name, {"orders": page.object_list, "page": page}
+        )
 
 
 # =======================================================
@@ -116,7 +170,8 @@ class OrderSearchView(View):
                             queryset=OrderProduct.objects.select_related("product"),
                         )
                     )
-                    .get(tracking_code=order_tracking_code, email__iexact=email)
+                    .for_email(email)
+                    .get(tracking_code=order_tracking_code)
                 )
             except Order.DoesNotExist:
                 error = "No se ha encontrado ningún pedido con esos datos."
@@ -142,7 +197,15 @@ class OrderSearchView(View):
 class OrderTrackingView(View):
     def get(self, request, tracking_code):
         # Buscamos el pedido por su código único
-        order = get_object_or_404(Order, tracking_code=tracking_code)
+        order = get_object_or_404(
+            Order.objects.prefetch_related(
+                Prefetch(
+                    "order_products",
+                    queryset=OrderProduct.objects.select_related("product"),
+                )
+            ),
+            tracking_code=tracking_code,
+        )
         return render(request, "order/tracking.html", {"order": order})
 
 
@@ -187,48 +250,51 @@ def create_checkout(request):
         raise PermissionDenied("Los administradores no pueden realizar compras.")
 
     domain_url = settings.DOMAIN_URL
-    cart_items_temp = []
-
-    if request.user.is_authenticated:
-        cart = get_object_or_404(Cart, user=request.user)
-        for item in cart.cart_products.all():
-            cart_items_temp.append(
-                {
-                    "product": item.product,
-                    "quantity": item.quantity,
-                    "price": item.product.price,
-                }
-            )
-    else:
-        cart_session = request.session.get("cart_session", {})
-        if not cart_session:
-            return redirect("cart_detail")
-
-        product_pks = [int(pk) for pk in cart_session.keys()]
-        products = Product.objects.filter(pk__in=product_pks)
-
-        for product in products:
-            qty = cart_session[str(product.pk)]["quantity"]
-            cart_items_temp.append(
-                {"product": product, "quantity": qty, "price": product.price}
-            )
+    cart = get_cart_summary(request)
+    if not cart:
+        return redirect("cart_detail")
+
+    # Retenemos el stock mientras el cliente paga. Si repite el checkout se
+    # libera antes la reserva anterior para no bloquear unidades dos veces
+    previous = request.session.pop("stock_reservation", None)
+    if previous:
+        reservation = StockReservation.objects.filter(token=previous).first()
+        if reservation:
+            release_reservation(reservation)
+    session_ttl = min(
+        max(
+            timezone.timedelta(minutes=settings.STOCK_RESERVATION_TTL_MINUTES),
+            STRIPE_SESSION_MIN_TTL,
+        ),
+        STRIPE_SESSION_MAX_TTL,
+    )
+    try:
+        reservation = reserve_stock(
+            [(line.product, line.quantity) for line in cart],
+            user=request.user if request.user.is_authenticated else None,
+            ttl=session_ttl + RESERVATION_MARGIN,
+        )
+    except InsufficientStock as e:
+        messages.error(request, str(e))
+        return redirect("cart_detail")
+    request.session["stock_reservation"] = str(reservation.token)
 
     line_items_stripe = []
-    for item in cart_items_temp:
-        amount_in_cents = int(item["price"] * 100)
+    for line in cart:
+        amount_in_cents = int(line.product.price * 100)
         line_items_stripe.append(
             {
                 "price_data": {
                     "currency": "eur",
                     "unit_amount": amount_in_cents,
                     "product_data": {
-                        "name": item["product"].name,
-                        "description": item["product"].description[:100]
-                        if item["product"].description
+                        "name": line.product.name,
+                        "description": line.product.description[:100]
+                        if line.product.description
                         else "Producto Essenza",
                     },
                 },
-                "quantity": item["quantity"],
+                "quantity": line.quantity,
             }
         )
 
@@ -243,152 +309,112 @@ def create_checkout(request):
                 "allowed_countries": ["ES"],
             },
             customer_email=customer_email,
+            # Enlaza el pago con la reserva de stock
+            client_reference_id=str(reservation.token),
+            # Contado desde ahora (no desde la reserva) para no quedar nunca por
+            # debajo del mínimo de Stripe; la reserva caduca después
+            expires_at=int((timezone.now() + session_ttl).timestamp()),
             success_url=domain_url + "/order/success/?session_id={CHECKOUT_SESSION_ID}",
             cancel_url=domain_url + "/order/cancelled/",
         )
         return redirect(checkout_session.url, code=303)
 
     except Exception as e:
+        release_reservation(reservation)
         return HttpResponse(f"Error al conectar con Stripe: {e}")
 
 
-def successful_payment(request):
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
     """
-    Verifica el pago, crea el pedido y ACTUALIZA EL STOCK.
-    Usa una transacción atómica para asegurar que todo se guarda o nada.
+    Webhook de Stripe. Verifica la firma y, con ``checkout.session.completed``,
+    crea el pedido (una sola vez por sesión de Stripe, ver
+    ``fulfill_checkout_session``). Stripe reintenta si no respondemos 2xx.
     """
-    session_id = request.GET.get("session_id")
-
-    if not session_id:
-        return HttpResponse("Error: No se ha recibido confirmación de pago.")
-
     try:
-        session = stripe.checkout.Session.retrieve(session_id)
-        customer_details = session.customer_details
-        stripe_email = customer_details.email
-
-        address_data = customer_details.address
-        shipping_address = f"{address_data.line1}, {address_data.city}, {address_data.postal_code}, {address_data.country}"
-        if address_data.line2:
-            shipping_address += f", {address_data.line2}"
-
-        if session.payment_status == "paid":
-            # --- INICIO DE TRANSACCIÓN ---
-            # Esto asegura que si falla la creación de productos, no se crea el pedido vacío
-            with transaction.atomic():
-                items_to_process = []
-                cart_to_delete = None
-
-                # Si esta logueado
-                if request.user.is_authenticated:
-                    cart = Cart.objects.filter(user=request.user).first()
-                    if cart:
-                        cart_to_delete = cart
-                        for cart_item in cart.cart_products.select_related(
-                            "product"
-                        ).all():
-                            items_to_process.append(
-                                {
-                                    "product": cart_item.product,
-                                    "quantity": cart_item.quantity,
-                                }
-                            )
-                # Si no esta logueado, usamos la sesion
-                else:
-                    cart_session = request.session.get("cart_session", {})
-                    if cart_session:
-                        product_pks = [int(pk) for pk in cart_session.keys()]
-                        products = Product.objects.filter(pk__in=product_pks)
-                        for product in products:
-                            qty = cart_session[str(product.pk)]["quantity"]
-                            items_to_process.append(
-                                {"product": product, "quantity": qty}
-                            )
-
-                if not items_to_process:
-                    # Si no hay productos, no creamos el pedido.
-                    return HttpResponse(
-                        "Error: No se encontraron productos en el carrito para procesar el pedido."
-                    )
-
-                # 3. Buscar usuario por email
-                User = get_user_model()
-                user_for_order = User.objects.filter(email=stripe_email).first()
-
-                # 4. Crear el Pedido
-                new_order = Order.objects.create(
-                    user=user_for_order,  # Si no existe el usuario, se pone None
-                    status=Status.EN_PREPARACION,
-                    address=shipping_address,
-                    email=stripe_email,
-                )
-
-                # 5. Crear OrderProducts y actualizamos el Stock
-                for item_data in items_to_process:
-                    product = item_data["product"]
-                    qty = item_data["quantity"]
-
-                    OrderProduct.objects.create(
-                        order=new_order, product=product, quantity=qty
-                    )
-
-                    Product.objects.filter(pk=product.pk).update(stock=F("stock") - qty)
+        event = stripe.Webhook.construct_event(
+            request.body,
+            request.headers.get("Stripe-Signature", ""),
+            settings.STRIPE_WEBHOOK_SECRET,
+        )
+    except (ValueError, stripe.SignatureVerificationError):
+        return HttpResponse(status=400)
 
-                # 6. Borrar el carrito
-                if cart_to_delete:
-                    cart_to_delete.delete()
-                else:
-                    request.session["cart_session"] = {}
-                    request.session.modified = True
-            # --- ENVÍO DE CORREO DE CONFIRMACIÓN ---
+    if event["type"] == "checkout.session.completed":
+        session = event["data"]["object"]
+        if session["payment_status"] == "paid":
             try:
-                # 1. Generar la URL absoluta de seguimiento
-                tracking_url = request.build_absolute_uri(reverse("order_search"))
-
-                # 2. Definir asunto y mensaje
-                subject = f"Confirmación de Pedido #{new_order.tracking_code} - Essenza"
-
-                # Mensaje simple en texto plano
-                message = f"""
-                Hola!
-
-                Gracias por tu compra en Essenza.
-                Tu pedido ha sido confirmado y se está preparando.
+                fulfill_checkout_session(session)
+            except InsufficientStock as e:
+                # Reintentar no lo arregla: se registra para gestionarlo a mano
+                logger.error("Pago %s sin stock: %s", session["id"], e)
 
-                Detalles del pedido:
-                Nº de localizador: {new_order.tracking_code}
-                Total: {new_order.total_price} €
-                Dirección de envío: {new_order.address}
+    return HttpResponse(status=200)
 
-                Puedes seguir el estado de tu pedido aquí:
-                {tracking_url}
 
-                Gracias por confiar en nosotros.
-                """
-
-                # 3. Enviar el correo
-                s = send_mail(
-                    subject,
-                    message,
-                    settings.DEFAULT_FROM_EMAIL,  # Asegúrate de tener esto en settings.py
-                    [new_order.email],  # El email del destinatario
-                    fail_silently=True,  # Si falla, no rompe la web
-                )
-                print(s)
-            except Exception as e:
-                # Si falla el correo, lo imprimimos en consola pero dejamos pasar al usuario
-                print(f"Error enviando email: {e}")
+def successful_payment(request):
+    """
+    Página de éxito tras el pago. Solo lee el pedido: lo crea el webhook de
+    Stripe, así que recargar la página no repite nada. Si el webhook aún no ha
+    llegado se muestra un aviso que se recarga solo (``SUCCESS_POLLS`` veces;
+    después se avisa de que el pedido llegará por email); si llegó pero no
+    quedaba stock, un aviso de que se devolverá el importe.
+    """
+    session_id = request.GET.get("session_id")
+    try:
+        attempt = max(int(request.GET.get("attempt", 0)), 0)
+    except ValueError:
+        attempt = 0
 
-            return render(request, "order/success.html", {"order": new_order})
+    if not session_id:
+        return HttpResponse("Error: No se ha recibido confirmación de pago.")
 
+    order = Order.objects.filter(stripe_session_id=session_id).first()
+    cart = None
+    failed = False
+    next_poll_url = None
+    if order:
+        # El carrito de los invitados vive en su sesión: se vacía aquí (el de
+        # los usuarios lo borra el webhook al crear el pedido)
+        request.session.pop("stock_reservation", None)
+        if request.user.is_authenticated:
+            forget_cart_count(request.user.pk)
         else:
-            return HttpResponse("El pago no se ha completado.")
+            clear_cart(request)
+    elif StockReservation.objects.filter(
+        stripe_session_id=session_id, status=ReservationStatus.FAILED
+    ).exists():
+        # El carrito se conserva: no se ha comprado nada
+        request.session.pop("stock_reservation", None)
+        failed = True
+    else:
+        # Mientras llega el webhook se muestra lo que se está pagando
+        cart = get_cart_summary(request)
+        if attempt < SUCCESS_POLLS:
+            next_poll_url = "?" + urlencode(
+                {"session_id": session_id, "attempt": attempt + 1}
+            )
 
-    except Exception as e:
-        return HttpResponse(f"Error verificando el pago o creando el pedido: {e}")
+    return render(
+        request,
+        "order/success.html",
+        {
+            "order": order,
+            "cart": cart,
+            "failed": failed,
+            "next_poll_url": next_poll_url,
+        },
+    )
 
 
 def cancelled_payment(request):
+    # Devolvemos al catálogo el stock retenido para este checkout
+    token = request.session.pop("stock_reservation", None)
+    if token:
+        reservation = StockReservation.objects.filter(token=token).first()
+        if reservation:
+            release_reservation(reservation)
     return render(request, "order/cancel.html")
 
 
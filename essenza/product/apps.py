@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ProductConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "product"
+
+    def ready(self):
+        # Registra los receptores del índice de búsqueda y de la caché
+        from . import signals  # noqa: F401
@@ -0,0 +1,79 @@
+import re
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.management.base import BaseCommand
+from django.template import engines, loader
+from django.test import RequestFactory
+from django.utils import timezone
+
+from product.models import Category, Product
+
+FRAGMENT_TAGS = re.compile(r"{% (?:cache [^%]*|endcache) %}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el renderizado de la plantilla del catálogo con N productos en "
+        "memoria, sin caché de fragmentos y con ella (fría, caliente y con un "
+        "producto modificado)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=500)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        categories = list(Category.values)
+        products = [
+            Product(
+                pk=i,
+                name=f"Producto {i:05d}",
+                brand=f"Marca {i % 40}",
+                category=categories[i % len(categories)],
+                price=Decimal(i % 90) + Decimal("0.95"),
+                stock=i % 25,
+                is_active=True,
+                updated_at=now,
+            )
+            for i in range(1, options["products"] + 1)
+        ]
+        request = RequestFactory().get("/catalog/")
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        context = {"products": products, "page": None, "query": ""}
+
+        cached = loader.get_template("product/catalog.html")
+        source = cached.template.source
+        plain = engines["django"].from_string(FRAGMENT_TAGS.sub("", source))
+
+        def render(template):
+            start = time.perf_counter()
+            template.render(context, request)
+            return time.perf_counter() - start
+
+        repeat = options["repeat"]
+        results = {
+            "sin caché de fragmentos": min(render(plain) for _ in range(repeat))
+        }
+        cold = []
+        for _ in range(repeat):
+            # Sello nuevo en todos: claves sin usar, sin vaciar la caché real
+            stamp = timezone.now()
+            for product in products:
+                product.updated_at = stamp
+            cold.append(render(cached))
+        results["fría (renderiza y guarda)"] = min(cold)
+        results["caliente"] = min(render(cached) for _ in range(repeat))
+        changed = []
+        for _ in range(repeat):
+            products[0].updated_at = timezone.now()
+            changed.append(render(cached))
+        results["un producto modificado"] = min(changed)
+
+        self.stdout.write(f"Catálogo con {len(products)} productos:")
+        for label, seconds in results.items():
+            self.stdout.write(f"  {label}: {seconds * 1000:.1f} ms")
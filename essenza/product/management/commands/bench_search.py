@@ -0,0 +1,78 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from product.models import Category, Product
+from product.search import get_backend, search_products
+
+TYPES = [
+    "champú", "crema", "sérum", "aceite", "mascarilla", "perfume", "tinte",
+    "labial", "máscara", "bálsamo", "tónico", "exfoliante", "laca", "gel",
+]
+SYLLABLES = ["ra", "lu", "mé", "so", "ve", "na", "ti", "cá", "lo", "ré", "mi", "zu"]
+BRANDS = ["Essenza", "Lumière", "Nórdica", "Verde", "Aurora", "Solé", "Marea"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide la latencia de búsqueda (índice vs name__icontains) sobre un "
+        "catálogo sintético. Todo se ejecuta en una transacción que se deshace."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100_000)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        vocabulary = sorted(
+            {"".join(rng.choices(SYLLABLES, k=3)) for _ in range(3000)}
+        )
+        # Mezcla de búsquedas selectivas (nombre concreto) y amplias (tipo/marca)
+        queries = rng.sample(vocabulary, 8) + ["champu", "crema aurora", "perfume"]
+        with transaction.atomic():
+            self._populate(options["products"], vocabulary, rng)
+            for label, run in (
+                (
+                    "icontains",
+                    lambda q: Product.objects.filter(name__icontains=q).order_by("name"),
+                ),
+                ("índice", lambda q: search_products(Product.objects.all(), q)),
+            ):
+                timings = []
+                for _ in range(options["repeat"]):
+                    for q in queries:
+                        start = time.perf_counter()
+                        list(run(q)[:24])
+                        timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                self.stdout.write(
+                    f"{label:>10}: mediana {statistics.median(timings):.2f} ms, "
+                    f"p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms"
+                )
+            transaction.set_rollback(True)
+
+    def _populate(self, count, vocabulary, rng):
+        categories = [c for c, _ in Category.choices]
+        products = [
+            Product(
+                name=f"{rng.choice(TYPES)} {' '.join(rng.sample(vocabulary, 2))}".capitalize(),
+                brand=rng.choice(BRANDS),
+                description=" ".join(rng.choices(vocabulary + TYPES, k=12)),
+                category=rng.choice(categories),
+                price=rng.randint(100, 9000) / 100,
+                stock=rng.randint(0, 200),
+                is_active=True,
+            )
+            for _ in range(count)
+        ]
+        start = time.perf_counter()
+        Product.objects.bulk_create(products, batch_size=2000)
+        # bulk_create no emite señales: indexamos todo de una vez
+        get_backend().rebuild(Product.objects.iterator(chunk_size=2000))
+        self.stdout.write(
+            f"{count} productos creados e indexados en {time.perf_counter() - start:.1f} s"
+        )
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from product.models import Product
+from product.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de búsqueda de productos desde cero."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            get_backend().rebuild(Product.objects.iterator(chunk_size=2000))
+        self.stdout.write(
+            self.style.SUCCESS(f"Índice reconstruido ({Product.objects.count()} productos).")
+        )
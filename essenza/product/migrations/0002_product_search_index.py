@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2025-12-01 10:12
+
+import django.db.models.deletion
+import product.models
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    from product.search import get_backend
+
+    Product = apps.get_model("product", "Product")
+    alias = schema_editor.connection.alias
+    get_backend(alias).rebuild(Product.objects.using(alias).iterator())
+
+
+def drop_search_index(apps, schema_editor):
+    from product.search import get_backend
+
+    get_backend(schema_editor.connection.alias).drop_index()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchEntry',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='product.product')),
+                ('document', product.models.SearchDocumentField(db_column='product_search')),
+            ],
+            options={
+                'db_table': 'product_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
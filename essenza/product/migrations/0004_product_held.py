@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 00:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0003_product_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='held',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
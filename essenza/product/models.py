@@ -18,7 +18,64 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     photo = models.ImageField(upload_to="products/", null=True, blank=True)
     stock = models.IntegerField(default=0)
+    # Unidades retenidas por checkouts en curso (ver order.services). Solo se
+    # modifica con UPDATE condicionales; el disponible real es stock - held
+    held = models.PositiveIntegerField(default=0, editable=False)
     is_active = models.BooleanField(default=False)
+    # Sello de versión de las tarjetas cacheadas con {% cache %} en
+    # product/catalog.html y product/dashboard.html. Los UPDATE masivos de
+    # stock lo ponen a mano (order.services)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Paginación por cursor (nombre, id) del catálogo y de los listados
+            models.Index(fields=["is_active", "name", "id"], name="product_active_name_idx"),
+            models.Index(fields=["name", "id"], name="product_name_idx"),
+        ]
+
+    @property
+    def available(self):
+        """Unidades que se pueden comprar ahora mismo."""
+        return max(self.stock - self.held, 0)
+
+    def save(self, *args, **kwargs):
+        # Al editar un producto no se reescribe ``held`` con el valor leído,
+        # que puede haber cambiado por una reserva concurrente
+        if self.pk and not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                f.name
+                for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != "held"
+            ]
+        elif kwargs.get("update_fields"):
+            # auto_now solo se guarda si está en update_fields
+            kwargs["update_fields"] = {*kwargs["update_fields"], "updated_at"}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
+
+
+class SearchDocumentField(models.TextField):
+    """Columna del índice de texto completo (ver ``product.search``)."""
+
+
+class ProductSearchEntry(models.Model):
+    """
+    Fila del índice de búsqueda. La tabla la crea y mantiene ``product.search``
+    (FTS5 en SQLite, tsvector + GIN en PostgreSQL); aquí solo se expone al ORM.
+    """
+
+    product = models.OneToOneField(
+        Product,
+        primary_key=True,
+        db_column="rowid",
+        on_delete=models.DO_NOTHING,
+        related_name="search_entry",
+    )
+    document = SearchDocumentField(db_column="product_search")
+
+    class Meta:
+        managed = False
+        db_table = "product_search"
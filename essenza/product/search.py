@@ -0,0 +1,260 @@
+"""
+Búsqueda de productos con índice de texto completo.
+
+El motor se elige según ``DATABASES["default"]["ENGINE"]``:
+
+- SQLite: tabla virtual FTS5 (``product_search``) con ``unicode61``.
+- PostgreSQL: tabla ``product_search`` con un ``tsvector`` e índice GIN.
+- Cualquier otro motor: ``icontains`` sobre los campos de texto (sin índice).
+
+En ambos motores indexados la tabla se expone al ORM con el modelo no
+gestionado ``ProductSearchEntry`` (``rowid`` = id del producto), de modo que
+la búsqueda es un único JOIN con el índice.
+
+El texto se normaliza en Python (minúsculas y sin tildes) tanto al indexar
+como al buscar, de modo que "champu" encuentra "Champú" en todos los motores.
+El índice se mantiene sincronizado mediante las señales de ``product.signals``.
+"""
+
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, FloatField, Func, Lookup, Q, Value
+
+from .models import ProductSearchEntry, SearchDocumentField
+
+SEARCH_TABLE = ProductSearchEntry._meta.db_table
+
+# Campos de Product que forman parte del documento indexado
+INDEXED_FIELDS = ("name", "brand", "description", "category")
+
+
+def normalize(text):
+    """Pasa a minúsculas y elimina tildes/diacríticos."""
+    decomposed = unicodedata.normalize("NFKD", str(text or ""))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(query):
+    """Devuelve los términos normalizados de una búsqueda (solo alfanuméricos)."""
+    return re.findall(r"\w+", normalize(query))
+
+
+def _document(product):
+    """Texto normalizado de cada columna indexada de un producto."""
+    category_label = dict(product._meta.get_field("category").choices or []).get(
+        product.category, ""
+    )
+    return (
+        normalize(product.name),
+        normalize(product.brand),
+        normalize(product.description),
+        normalize(f"{product.category} {category_label}"),
+    )
+
+
+@SearchDocumentField.register_lookup
+class FullTextMatch(Lookup):
+    """``search_entry__document__matches=<consulta ya compilada por el motor>``."""
+
+    lookup_name = "matches"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", [*lhs_params, *rhs_params]
+
+    def as_postgresql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} @@ to_tsquery('simple', {rhs})", [*lhs_params, *rhs_params]
+
+
+class SearchRank(Func):
+    """Relevancia de la fila del índice (mayor es mejor)."""
+
+    output_field = FloatField()
+
+    def __init__(self, query, **extra):
+        super().__init__(F("search_entry__document"), Value(query), **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # bm25 devuelve valores más bajos cuanto mejor: lo invertimos.
+        # Pesos por columna: nombre > marca > categoría > descripción
+        document, _ = self.source_expressions
+        sql, params = compiler.compile(document)
+        return f"-bm25({sql}, 10.0, 5.0, 1.0, 3.0)", params
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        document, query = self.source_expressions
+        doc_sql, doc_params = compiler.compile(document)
+        query_sql, query_params = compiler.compile(query)
+        return (
+            f"ts_rank({doc_sql}, to_tsquery('simple', {query_sql}))",
+            [*doc_params, *query_params],
+        )
+
+
+class BaseSearchBackend:
+    """Interfaz común. Cada motor implementa el índice y la consulta."""
+
+    def __init__(self, alias="default"):
+        self.alias = alias
+
+    @property
+    def connection(self):
+        return connections[self.alias]
+
+    def create_index(self):
+        pass
+
+    def drop_index(self):
+        pass
+
+    def index(self, product):
+        pass
+
+    def index_many(self, products):
+        for product in products:
+            self.index(product)
+
+    def remove(self, pk):
+        pass
+
+    def rebuild(self, products, batch_size=2000):
+        """Vacía el índice y lo vuelve a llenar con ``products``."""
+        self.drop_index()
+        self.create_index()
+        batch = []
+        for product in products:
+            batch.append(product)
+            if len(batch) >= batch_size:
+                self.index_many(batch)
+                batch = []
+        self.index_many(batch)
+
+    def compile_query(self, terms):
+        raise NotImplementedError
+
+    def search(self, queryset, query):
+        terms = tokenize(query)
+        if not terms:
+            return queryset.none()
+        compiled = self.compile_query(terms)
+        return queryset.filter(search_entry__document__matches=compiled).annotate(
+            search_rank=SearchRank(compiled)
+        )
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                "name, brand, description, category, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def index(self, product):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [product.pk])
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, name, brand, description, category) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [product.pk, *_document(product)],
+            )
+
+    def index_many(self, products):
+        # Solo se usa tras vaciar el índice: no hace falta borrar filas previas
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, name, brand, description, category) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [[product.pk, *_document(product)] for product in products],
+            )
+
+    def remove(self, pk):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [pk])
+
+    def compile_query(self, terms):
+        # Coincidencia por prefijo de todos los términos: "champ" -> "champu"
+        return " ".join(f'"{term}"*' for term in terms)
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    def create_index(self):
+        # La columna tsvector se llama como la tabla para compartir el modelo
+        # ProductSearchEntry con FTS5 (donde esa columna oculta es obligatoria)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                "rowid bigint PRIMARY KEY "
+                "REFERENCES product_product (id) ON DELETE CASCADE, "
+                f"{SEARCH_TABLE} tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_gin "
+                f"ON {SEARCH_TABLE} USING GIN ({SEARCH_TABLE})"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def index(self, product):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, {SEARCH_TABLE}) VALUES (%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'B') || "
+                "setweight(to_tsvector('simple', %s), 'D') || "
+                "setweight(to_tsvector('simple', %s), 'C')) "
+                f"ON CONFLICT (rowid) DO UPDATE SET {SEARCH_TABLE} = EXCLUDED.{SEARCH_TABLE}",
+                [product.pk, *_document(product)],
+            )
+
+    def remove(self, pk):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [pk])
+
+    def compile_query(self, terms):
+        return " & ".join(f"{term}:*" for term in terms)
+
+
+class FallbackSearchBackend(BaseSearchBackend):
+    """Motores sin soporte: filtro icontains sin ranking real."""
+
+    def search(self, queryset, query):
+        terms = query.split()
+        if not terms:
+            return queryset.none()
+        for term in terms:
+            condition = Q()
+            for field in INDEXED_FIELDS:
+                condition |= Q(**{f"{field}__icontains": term})
+            queryset = queryset.filter(condition)
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+def get_backend(alias="default"):
+    engine = settings.DATABASES[alias]["ENGINE"]
+    if "sqlite3" in engine:
+        return SQLiteSearchBackend(alias)
+    if "postgresql" in engine or "postgis" in engine:
+        return PostgresSearchBackend(alias)
+    return FallbackSearchBackend(alias)
+
+
+def search_products(queryset, query):
+    """
+    Filtra ``queryset`` por ``query`` usando el índice y lo ordena por
+    relevancia (anotación ``search_rank``, mayor es mejor).
+    """
+    return get_backend(queryset.db).search(queryset, query).order_by("-search_rank", "pk")
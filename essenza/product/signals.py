@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from essenza import cache
+
+from .models import Product
+from .search import INDEXED_FIELDS, get_backend
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, using="default", update_fields=None, **kwargs):
+    # Las actualizaciones parciales que no tocan texto (p. ej. el stock) no reindexan
+    if update_fields is not None and not set(update_fields) & set(INDEXED_FIELDS):
+        return
+    get_backend(using).index(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using="default", **kwargs):
+    get_backend(using).remove(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalog_cache(sender, **kwargs):
+    cache.bump_on_commit("catalog")
@@ -1,18 +1,33 @@
+import re
+import threading
+import time
 from decimal import Decimal
+from io import StringIO
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache as django_cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
-from order.models import Order, OrderProduct
+from essenza import cache
+from essenza.pagination import encode_cursor
+from order.models import Order, OrderProduct, ProductSalesRollup
+from order.services import place_order, reserve_stock
 
 from .models import Category, Product
+from .search import search_products
+from .views import get_top_selling_products
 
 User = get_user_model()
 
 
 class DashboardViewLogicTests(TestCase):
     def setUp(self):
+        # Los más vendidos se cachean (essenza.cache)
+        django_cache.clear()
         self.dashboard_url = reverse("dashboard")
         self.login_url = reverse("login")
         self.now = timezone.now()
@@ -123,6 +138,7 @@ class DashboardViewLogicTests(TestCase):
             quantity=500,  # Más ventas, pero antiguo
         )
 
+        call_command("rebuild_sales_rollup", stdout=StringIO())
         resp = self.client.get(self.dashboard_url)
         products_in_context = list(resp.context["products"])
 
@@ -154,6 +170,7 @@ class DashboardViewLogicTests(TestCase):
             order=order_ancient, product=self.p_30_day, quantity=999
         )
 
+        call_command("rebuild_sales_rollup", stdout=StringIO())
         resp = self.client.get(self.dashboard_url)
         products_in_context = list(resp.context["products"])
 
@@ -185,6 +202,7 @@ class DashboardViewLogicTests(TestCase):
             order=order_inactive, product=self.p_inactive, quantity=5000
         )
 
+        call_command("rebuild_sales_rollup", stdout=StringIO())
         resp = self.client.get(self.dashboard_url)
         products_in_context = list(resp.context["products"])
 
@@ -215,6 +233,40 @@ class DashboardViewLogicTests(TestCase):
 
         self.assertEqual(len(products_in_context), 0)
 
+    def test_top_sellers_are_ranked_in_the_database(self):
+        order = Order.objects.create(
+            user=self.regular_user,
+            address="Test Address",
+            placed_at=self.now - timezone.timedelta(days=3),
+        )
+        ProductSalesRollup.objects.record_order(
+            order, {self.p_1_year.pk: 4, self.p_stock_low.pk: 7}
+        )
+        ProductSalesRollup.objects.record_order(order, {self.p_1_year.pk: 5})
+        earlier = Order.objects.create(
+            user=self.regular_user,
+            address="Test Address",
+            placed_at=self.now - timezone.timedelta(days=10),
+        )
+        ProductSalesRollup.objects.record_order(earlier, {self.p_1_year.pk: 1})
+
+        # exists() del último mes y el ranking por categoría
+        with self.assertNumQueries(2):
+            top, by_category = get_top_selling_products()
+
+        self.assertEqual(top, [self.p_1_year, self.p_stock_low])
+        self.assertEqual(top[0].total_quantity, 10)
+        self.assertEqual(
+            by_category, [("Cabello", [self.p_1_year]), ("Tratamiento", [self.p_stock_low])]
+        )
+
+        # Como mucho ``limit`` por categoría y en el top general
+        top, by_category = get_top_selling_products(limit=1)
+        self.assertEqual(top, [self.p_1_year])
+        self.assertEqual(
+            by_category, [("Cabello", [self.p_1_year]), ("Tratamiento", [self.p_stock_low])]
+        )
+
 
 class ProductCRUDTests(TestCase):
     def setUp(self):
@@ -391,6 +443,10 @@ class CatalogViewTests(TestCase):
             is_active=False,
         )
 
+    def setUp(self):
+        # Las páginas del catálogo se cachean para anónimos
+        django_cache.clear()
+
     def test_catalog_url_status_code(self):
         """La URL del catálogo responde con 200."""
         url = reverse("catalog")
@@ -440,6 +496,10 @@ class CatalogDetailViewTests(TestCase):
             is_active=False,
         )
 
+    def setUp(self):
+        # Las páginas del catálogo se cachean para anónimos
+        django_cache.clear()
+
     def test_catalog_detail_status_code_and_template(self):
         """
         El detalle de un producto activo devuelve 200 y usa
@@ -593,3 +653,430 @@ class StockTests(TestCase):
 
         self.product_high.refresh_from_db()
         self.assertEqual(self.product_high.stock, 20)  # No cambia
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shampoo = Product.objects.create(
+            name="Champú Reparador",
+            description="Limpieza suave para cabello dañado",
+            category=Category.CABELLO,
+            brand="Lumière",
+            price=Decimal("12.50"),
+            stock=10,
+            is_active=True,
+        )
+        cls.cream = Product.objects.create(
+            name="Crema Hidratante",
+            description="Con aceite de argán y champú de avena",
+            category=Category.TRATAMIENTO,
+            brand="Aurora",
+            price=Decimal("20.00"),
+            stock=5,
+            is_active=True,
+        )
+        cls.hidden = Product.objects.create(
+            name="Champú Oculto",
+            description="No debe salir en el catálogo",
+            category=Category.CABELLO,
+            brand="Aurora",
+            price=Decimal("8.00"),
+            stock=5,
+            is_active=False,
+        )
+
+    def test_search_ignores_accents(self):
+        results = list(search_products(Product.objects.all(), "champu"))
+        self.assertIn(self.shampoo, results)
+
+    def test_search_matches_brand_description_and_category(self):
+        self.assertEqual(
+            list(search_products(Product.objects.all(), "lumiere")), [self.shampoo]
+        )
+        self.assertIn(self.cream, search_products(Product.objects.all(), "argan"))
+        self.assertIn(self.cream, search_products(Product.objects.all(), "tratamiento"))
+
+    def test_search_ranks_name_matches_first(self):
+        results = list(
+            search_products(Product.objects.filter(is_active=True), "champu")
+        )
+        self.assertEqual(results, [self.shampoo, self.cream])
+
+    def test_index_follows_save_and_delete(self):
+        self.cream.name = "Sérum Facial"
+        self.cream.save()
+        self.assertIn(self.cream, search_products(Product.objects.all(), "serum"))
+
+        pk = self.shampoo.pk
+        self.shampoo.delete()
+        self.assertFalse(
+            search_products(Product.objects.all(), "reparador").filter(pk=pk).exists()
+        )
+
+    def test_catalog_search_uses_index(self):
+        response = self.client.get(reverse("catalog"), {"q": "champu"})
+        products = list(response.context["products"])
+        self.assertEqual(products, [self.shampoo, self.cream])
+        self.assertNotIn(self.hidden, products)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create(
+            Product(
+                name=f"Producto {i:02d}",
+                description="Descripción",
+                category=Category.MAQUILLAJE,
+                brand="Marca",
+                price=Decimal("5.00"),
+                stock=10,
+                is_active=True,
+            )
+            for i in range(30)
+        )
+        cls.admin = User.objects.create_user(
+            username="admin", email="admin@example.com", password="pass1234", role="admin"
+        )
+
+    def setUp(self):
+        # Las páginas del catálogo se cachean para anónimos
+        django_cache.clear()
+
+    def test_catalog_walks_all_pages_in_order(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {"cursor": cursor} if cursor else {}
+            response = self.client.get(reverse("catalog"), params)
+            seen += [p.name for p in response.context["products"]]
+            cursor = response.context["page"].next_cursor
+            if not cursor:
+                break
+        self.assertEqual(seen, [f"Producto {i:02d}" for i in range(30)])
+
+    def test_catalog_json_variant_uses_same_cursor(self):
+        first = self.client.get(reverse("catalog"))
+        cursor = first.context["page"].next_cursor
+
+        response = self.client.get(reverse("catalog_page"), {"cursor": cursor})
+        data = response.json()
+        self.assertEqual(
+            [r["name"] for r in data["results"]],
+            [f"Producto {i:02d}" for i in range(24, 30)],
+        )
+        self.assertIsNone(data["next_cursor"])
+
+    def test_deep_pages_issue_the_same_queries(self):
+        # La lista de marcas del filtro se cachea en la primera visita
+        self.client.get(reverse("catalog"), {"brand": "Marca"})
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(reverse("catalog"))
+        cursor = response.context["page"].next_cursor
+        with CaptureQueriesContext(connection) as deep:
+            self.client.get(reverse("catalog"), {"cursor": cursor})
+        self.assertEqual(len(first), len(deep))
+
+    def test_admin_list_is_paginated(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse("product_list"))
+        self.assertEqual(len(response.context["products"]), 30)
+        self.assertFalse(response.context["page"].has_next)
+
+    def test_invalid_cursor_returns_first_page(self):
+        response = self.client.get(reverse("catalog"), {"cursor": "no-es-un-cursor"})
+        self.assertEqual(response.context["products"][0].name, "Producto 00")
+
+    def test_tampered_cursor_returns_first_page(self):
+        """Un cursor bien formado con valores del tipo equivocado no da un 500."""
+        for values in (["a", "abc"], ["a", None], ["a", [1]]):
+            response = self.client.get(
+                reverse("catalog"), {"cursor": encode_cursor(values)}
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context["products"][0].name, "Producto 00")
+
+
+class CatalogFilterTests(TestCase):
+    """Los filtros del catálogo se aplican en la consulta, no en el navegador."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create(
+            Product(
+                name=f"Producto {i:02d}",
+                description="Descripción",
+                category=Category.PERFUME if i % 2 else Category.CABELLO,
+                brand="Aroma" if i % 3 else "Brillo",
+                price=Decimal("5.00"),
+                stock=10,
+                is_active=True,
+            )
+            for i in range(60)
+        )
+
+    def setUp(self):
+        django_cache.clear()
+
+    def test_filters_cover_every_page(self):
+        params = {"category": Category.PERFUME, "brand": "aroma"}
+        expected = [f"Producto {i:02d}" for i in range(60) if i % 2 and i % 3]
+        response = self.client.get(reverse("catalog"), params)
+        seen = [p.name for p in response.context["products"]]
+        self.assertEqual(response.context["category_label"], "Perfume")
+        self.assertEqual(response.context["brands"], ["Aroma", "Brillo"])
+
+        cursor = response.context["page"].next_cursor
+        while cursor:
+            data = self.client.get(
+                reverse("catalog_page"), {**params, "cursor": cursor}
+            ).json()
+            seen += [r["name"] for r in data["results"]]
+            cursor = data["next_cursor"]
+        self.assertEqual(seen, expected)
+
+    def test_filter_links_and_next_page_keep_the_filters(self):
+        response = self.client.get(reverse("catalog"), {"brand": "Brillo", "cursor": "x"})
+        self.assertContains(response, 'href="?brand=Brillo&amp;category=perfume"')
+        self.assertContains(response, 'data-params="?brand=Brillo"')
+
+    def test_filters_are_part_of_the_page_cache_key(self):
+        url = reverse("catalog")
+        self.client.get(url, {"brand": "Brillo"})
+        response = self.client.get(url, {"brand": "Aroma"})
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertTrue(all(p.brand == "Aroma" for p in response.context["products"]))
+
+
+class CacheTests(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.calls = 0
+
+    def _compute(self, value="valor"):
+        self.calls += 1
+        return value
+
+    def test_cached_computes_once(self):
+        self.assertEqual(cache.cached("catalog", "clave", self._compute), "valor")
+        self.assertEqual(cache.cached("catalog", "clave", self._compute), "valor")
+        self.assertEqual(self.calls, 1)
+
+    def test_bump_invalidates_only_its_namespace(self):
+        cache.cached("catalog", "a", self._compute)
+        cache.cached("sales", "b", self._compute)
+        cache.cached(("catalog", "sales"), "c", self._compute)
+        cache.bump("sales")
+        cache.cached("catalog", "a", self._compute)
+        cache.cached("sales", "b", self._compute)
+        cache.cached(("catalog", "sales"), "c", self._compute)
+        self.assertEqual(self.calls, 5)
+
+    def test_lost_version_does_not_reuse_old_keys(self):
+        cache.cached("sales", "a", self._compute)
+        django_cache.delete("ns:sales")
+        cache.cached("sales", "a", self._compute)
+        self.assertEqual(self.calls, 2)
+
+    def test_stale_value_is_served_while_another_process_recomputes(self):
+        cache.cached("sales", "a", self._compute)
+        key = cache.make_key("sales", "a")
+        fresh_until, value = django_cache.get(key)
+        django_cache.set(key, (fresh_until - cache.DEFAULT_TIMEOUT, value))
+        # Otro proceso tiene el cerrojo: se sirve el valor anterior
+        django_cache.add(f"lock:{key}", 1)
+        self.assertEqual(cache.cached("sales", "a", lambda: "nuevo"), "valor")
+        django_cache.delete(f"lock:{key}")
+        self.assertEqual(cache.cached("sales", "a", lambda: "nuevo"), "nuevo")
+        self.assertEqual(cache.cached("sales", "a", lambda: "otro"), "nuevo")
+
+    def test_cold_key_is_computed_by_a_single_caller(self):
+        def slow():
+            time.sleep(0.2)
+            return self._compute()
+
+        threads = [
+            threading.Thread(target=cache.cached, args=("sales", "frio", slow))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+
+    def test_model_signals_bump_versions(self):
+        catalog, sales = cache.versions(["catalog", "sales"])
+        product = Product.objects.create(name="Crema", price=Decimal("5.00"), stock=1)
+        new_catalog, new_sales = cache.versions(["catalog", "sales"])
+        self.assertNotEqual(new_catalog, catalog)
+        self.assertEqual(new_sales, sales)
+        order = Order.objects.create(email="a@test.com", address="Calle")
+        OrderProduct.objects.create(order=order, product=product, quantity=1)
+        self.assertNotEqual(cache.versions(["sales"]), [sales])
+
+    def test_dashboard_top_sellers_are_cached_until_a_sale(self):
+        product = Product.objects.create(
+            name="Crema", price=Decimal("5.00"), stock=10, is_active=True
+        )
+        self.client.get(reverse("dashboard"))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse("dashboard"))
+        self.assertFalse(
+            any("order_productsalesrollup" in q["sql"] for q in ctx.captured_queries)
+        )
+
+        place_order(
+            user=None, email="cliente@test.com", address="Calle", lines=[(product, 2)]
+        )
+        response = self.client.get(reverse("dashboard"))
+        self.assertEqual([p.name for p in response.context["products"]], ["Crema"])
+        self.assertEqual(response.context["products"][0].total_quantity, 2)
+
+
+class AnonymousPageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            name="Crema Aurora",
+            description="Hidratante",
+            category=Category.TRATAMIENTO,
+            brand="Aurora",
+            price=Decimal("12.00"),
+            stock=10,
+            is_active=True,
+        )
+        cls.user = User.objects.create_user(
+            username="cliente", email="cliente@test.com", password="pass"
+        )
+
+    def setUp(self):
+        django_cache.clear()
+
+    def test_second_anonymous_hit_skips_view_and_database(self):
+        url = reverse("catalog")
+        self.assertEqual(self.client.get(url)["X-Page-Cache"], "miss")
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertContains(response, "Crema Aurora")
+
+    def test_key_uses_search_and_cursor_only(self):
+        url = reverse("catalog")
+        self.client.get(url, {"q": "crema"})
+        self.assertEqual(self.client.get(url, {"q": "crema"})["X-Page-Cache"], "hit")
+        self.assertEqual(
+            self.client.get(url, {"q": "crema", "utm_source": "x"})["X-Page-Cache"],
+            "hit",
+        )
+        self.assertEqual(self.client.get(url, {"q": "gel"})["X-Page-Cache"], "miss")
+        self.assertEqual(self.client.get(url, {"cursor": "x"})["X-Page-Cache"], "miss")
+
+    def test_product_changes_and_stock_holds_invalidate(self):
+        url = reverse("catalog_detail", args=[self.product.pk])
+        self.client.get(url)
+        self.product.price = Decimal("9.50")
+        self.product.save()
+        response = self.client.get(url)
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertContains(response, "9,50")
+
+        reserve_stock([(self.product, 10)])
+        self.assertEqual(self.client.get(url)["X-Page-Cache"], "miss")
+
+    def test_logged_in_and_cart_sessions_bypass_the_cache(self):
+        url = reverse("dashboard")
+        self.client.get(url)
+        self.client.force_login(self.user)
+        self.assertNotIn("X-Page-Cache", self.client.get(url))
+
+        self.client.logout()
+        session = self.client.session
+        session["cart_session"] = {str(self.product.pk): {"quantity": 1}}
+        session.save()
+        self.assertNotIn("X-Page-Cache", self.client.get(url))
+
+    def test_cached_page_carries_each_visitors_csrf_token(self):
+        url = reverse("catalog_detail", args=[self.product.pk])
+        Client().get(url)
+
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(url)
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertIn("csrftoken", response.cookies)
+        token = re.search(
+            rb'name="csrfmiddlewaretoken" value="([^"]+)"', response.content
+        ).group(1)
+        self.assertNotEqual(token, b"__csrf_token__")
+
+        response = client.post(
+            reverse("add_to_cart", args=[self.product.pk]),
+            {"csrfmiddlewaretoken": token.decode(), "quantity": 1},
+        )
+        self.assertRedirects(response, reverse("cart_detail"))
+        # Con carrito la siguiente visita ya no sale de la caché
+        self.assertNotIn("X-Page-Cache", client.get(url))
+
+
+class FragmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            name="Sérum Brisa",
+            description="Sérum",
+            category=Category.TRATAMIENTO,
+            brand="Brisa",
+            price=Decimal("15.00"),
+            stock=20,
+            is_active=True,
+        )
+        cls.user = User.objects.create_user(
+            username="fragmentos", email="fragmentos@test.com", password="pass"
+        )
+
+    def setUp(self):
+        django_cache.clear()
+        # Con sesión iniciada no hay caché de página: solo la de fragmentos
+        self.client.force_login(self.user)
+
+    def test_partial_saves_and_stock_updates_refresh_updated_at(self):
+        stamp = self.product.updated_at
+
+        self.product.stock = 15
+        self.product.save(update_fields=["stock"])
+        self.product.refresh_from_db()
+        self.assertGreater(self.product.updated_at, stamp)
+
+        stamp = self.product.updated_at
+        reserve_stock([(self.product, 1)])
+        self.product.refresh_from_db()
+        self.assertGreater(self.product.updated_at, stamp)
+
+    def test_card_is_reused_until_the_product_changes(self):
+        url = reverse("catalog")
+        self.assertContains(self.client.get(url), "Sérum Brisa")
+
+        # Un UPDATE que no toca updated_at no invalida la tarjeta
+        Product.objects.filter(pk=self.product.pk).update(name="Sérum Oculto")
+        response = self.client.get(url)
+        self.assertContains(response, "Sérum Brisa")
+        self.assertNotContains(response, "Sérum Oculto")
+
+        self.product.refresh_from_db()
+        self.product.stock = 0
+        self.product.save(update_fields=["stock"])
+        response = self.client.get(url)
+        self.assertContains(response, "Sérum Oculto")
+        self.assertContains(response, "Producto agotado")
+
+    def test_dashboard_card_counts_held_units(self):
+        """La portada marca agotado lo que está reservado, como el catálogo."""
+        reserve_stock([(self.product, 20)])
+        self.assertContains(self.client.get(reverse("dashboard")), "Producto agotado")
+
+    def test_bench_catalog_render(self):
+        out = StringIO()
+        call_command("bench_catalog_render", products=20, repeat=1, stdout=out)
+        self.assertIn("caliente", out.getvalue())
@@ -1,11 +1,80 @@
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db.models import Sum
+from django.db.models import F, Sum, Window
+from django.db.models.functions import RowNumber
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.templatetags.static import static
+from django.urls import reverse
 from django.utils import timezone
 from django.views import View
+from essenza import cache
+from essenza.pagination import KeysetPaginator
 
 from .forms import ProductForm
-from .models import Product
+from .models import Category, Product
+from .search import search_products
+
+
+def paginate_products(request, queryset, per_page):
+    """
+    Aplica la búsqueda ``q`` (si la hay) y devuelve ``(q, página)`` paginando
+    por cursor: por relevancia en las búsquedas y por nombre en otro caso.
+    """
+    q = request.GET.get("q", "").strip()
+    if q:
+        queryset = search_products(queryset, q)
+        ordering = ("-search_rank", "pk")
+    else:
+        ordering = ("name", "pk")
+    page = KeysetPaginator(queryset, ordering, per_page).page(request.GET.get("cursor"))
+    return q, page
+
+
+def get_top_selling_products(limit=10):
+    """
+    Devuelve ``(top, top_por_categoría)`` leyendo el rollup diario de ventas:
+    las unidades de los últimos 30 días o, si el último mes no tiene ventas
+    (un ``exists()``), las del último año. El ranking se hace en la base de
+    datos: una consulta trae como mucho ``limit`` productos por categoría
+    (``RowNumber`` por categoría) y el top general sale de esas filas, porque
+    todo producto del top general está en el top de su categoría.
+    Cada producto devuelto lleva ``total_quantity`` con las unidades vendidas.
+    """
+    today = timezone.localdate()
+    month_ago = today - timezone.timedelta(days=30)
+    year_ago = today - timezone.timedelta(days=365)
+
+    active = Product.objects.filter(is_active=True)
+    # Una sola llamada a filter(): con dos, cada una uniría el rollup por su
+    # cuenta y se multiplicarían las sumas
+    recent = active.filter(
+        sales_rollup__day__gte=month_ago, sales_rollup__units__gt=0
+    ).exists()
+    ranked = (
+        active.filter(
+            sales_rollup__day__gte=month_ago if recent else year_ago,
+            sales_rollup__units__gt=0,
+        )
+        .annotate(total_quantity=Sum("sales_rollup__units"))
+        .annotate(
+            rank=Window(
+                RowNumber(),
+                partition_by=F("category"),
+                order_by=[F("total_quantity").desc(), F("pk").asc()],
+            )
+        )
+        .filter(rank__lte=limit)
+        .order_by("category", "rank")
+    )
+
+    by_category = {}
+    for product in ranked:
+        by_category.setdefault(product.get_category_display(), []).append(product)
+    top = sorted(
+        (p for products in by_category.values() for p in products),
+        key=lambda p: (-p.total_quantity, p.pk),
+    )
+    return top[:limit], sorted(by_category.items())
 
 
 class BaseView(View):
@@ -28,39 +97,27 @@ class DashboardView(UserPassesTestMixin, View):
     def get(self, request, *args, **kwargs):
         q = request.GET.get("q", "").strip()
 
-        month_ago = timezone.now() - timezone.timedelta(days=30)
-        year_ago = timezone.now() - timezone.timedelta(days=365)
-
-        def get_top_selling_products(since):
-            # Paso 1: Definir el filtro base.
-            base_query = Product.objects.filter(
-                is_active=True, product_orders__order__placed_at__gte=since
-            )
-            # Paso 2: Anotar (calcular) el total vendido para esos productos.
-            query_with_totals = base_query.annotate(
-                total_quantity=Sum("product_orders__quantity")
-            )
-            # Paso 3: Filtrar de nuevo, sobre el campo calculado.
-            filtered_query = query_with_totals.filter(total_quantity__gt=0)
-            # Paso 4: Ordenar (descendente).
-            ordered_query = filtered_query.order_by("-total_quantity")
-            top_products = ordered_query[:10]
-            return top_products
-
         # If a search query is provided, show matching products instead of top sellers
         if q:
-            products = Product.objects.filter(is_active=True, name__icontains=q)
+            products = search_products(Product.objects.filter(is_active=True), q)
             return render(
                 request, self.template_name, {"products": products, "query": q}
             )
 
-        products = get_top_selling_products(since=month_ago)
-        if not products.exists():
-            products = get_top_selling_products(since=year_ago)
-        if not products.exists():
+        # Cacheado por día: cambia con las ventas y con el catálogo (señales)
+        products, top_by_category = cache.cached(
+            ("catalog", "sales"),
+            f"top_selling:{timezone.localdate()}",
+            get_top_selling_products,
+        )
+        if not products:
             products = Product.objects.filter(is_active=True).order_by("-stock")[:10]
 
-        return render(request, self.template_name, {"products": products})
+        return render(
+            request,
+            self.template_name,
+            {"products": products, "top_by_category": top_by_category},
+        )
 
 
 class StockView(LoginRequiredMixin, UserPassesTestMixin, View):
@@ -72,14 +129,16 @@ class StockView(LoginRequiredMixin, UserPassesTestMixin, View):
     def handle_no_permission(self):
         return redirect("dashboard")
 
+    paginate_by = 48
+
     def get(self, request):
-        # Carga y muestra todos los productos ordenados por nombre
-        q = request.GET.get("q", "").strip()
-        if q:
-            products = Product.objects.filter(name__icontains=q).order_by("name")
-        else:
-            products = Product.objects.all().order_by("name")
-        return render(request, "product/stock.html", {"products": products, "query": q})
+        # Muestra los productos ordenados por nombre, paginados por cursor
+        q, page = paginate_products(request, Product.objects.all(), self.paginate_by)
+        return render(
+            request,
+            "product/stock.html",
+            {"products": page.object_list, "page": page, "query": q},
+        )
 
     def post(self, request):
         # Coge datos del formulario para actualizar stock
@@ -107,17 +166,18 @@ class StockView(LoginRequiredMixin, UserPassesTestMixin, View):
 
 class ProductListView(LoginRequiredMixin, UserPassesTestMixin, View):
     template_name = "product/list.html"
+    paginate_by = 48
 
     def test_func(self):
         return self.request.user.is_authenticated and self.request.user.role == "admin"
 
     def get(self, request):
-        q = request.GET.get("q", "").strip()
-        if q:
-            products = Product.objects.filter(name__icontains=q)
-        else:
-            products = Product.objects.all()
-        return render(request, self.template_name, {"products": products, "query": q})
+        q, page = paginate_products(request, Product.objects.all(), self.paginate_by)
+        return render(
+            request,
+            self.template_name,
+            {"products": page.object_list, "page": page, "query": q},
+        )
 
 
 class ProductDetailView(LoginRequiredMixin, UserPassesTestMixin, View):
@@ -187,16 +247,82 @@ class ProductDeleteView(LoginRequiredMixin, UserPassesTestMixin, View):
         return redirect("product_list")
 
 
+def catalog_brands():
+    """Marcas de los productos activos, para el filtro del catálogo."""
+    return list(
+        Product.objects.filter(is_active=True)
+        .exclude(brand="")
+        .order_by("brand")
+        .values_list("brand", flat=True)
+        .distinct()
+    )
+
+
 class CatalogView(View):
+    """
+    Catálogo paginado por cursor. Los filtros ``category`` y ``brand`` se
+    aplican en la consulta, así que cubren todo el catálogo y no solo las
+    tarjetas ya cargadas.
+    """
+
     template_name = "product/catalog.html"
+    paginate_by = 24
+
+    def get_page(self, request):
+        queryset = Product.objects.filter(is_active=True)
+        if category := request.GET.get("category"):
+            queryset = queryset.filter(category=category)
+        if brand := request.GET.get("brand", "").strip():
+            queryset = queryset.filter(brand__iexact=brand)
+        return paginate_products(request, queryset, self.paginate_by)
 
     def get(self, request):
-        q = request.GET.get("q", "").strip()
-        if q:
-            products = Product.objects.filter(is_active=True, name__icontains=q)
-        else:
-            products = Product.objects.filter(is_active=True)
-        return render(request, self.template_name, {"products": products, "query": q})
+        q, page = self.get_page(request)
+        category = request.GET.get("category", "")
+        return render(
+            request,
+            self.template_name,
+            {
+                "products": page.object_list,
+                "page": page,
+                "query": q,
+                "categories": Category.choices,
+                "category": category,
+                "category_label": dict(Category.choices).get(category, ""),
+                "brands": cache.cached("catalog", "brands", catalog_brands),
+                "brand": request.GET.get("brand", "").strip(),
+            },
+        )
+
+
+class CatalogPageView(CatalogView):
+    """
+    Variante JSON del catálogo para el scroll infinito: mismos parámetros
+    (``q``, ``category``, ``brand``, ``cursor``) y mismo orden que
+    ``CatalogView``.
+    """
+
+    def get(self, request):
+        q, page = self.get_page(request)
+        results = [
+            {
+                "id": product.pk,
+                "name": product.name,
+                "brand": product.brand,
+                "price": str(product.price),
+                "category": product.category,
+                "category_display": product.get_category_display(),
+                "stock": product.available,
+                "photo": (
+                    product.photo.url
+                    if product.photo
+                    else static("images/default_product.png")
+                ),
+                "url": reverse("catalog_detail", args=[product.pk]),
+            }
+            for product in page.object_list
+        ]
+        return JsonResponse({"results": results, "next_cursor": page.next_cursor})
 
 
 class CatalogDetailView(View):
@@ -5,6 +5,7 @@ from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
 from django.urls import reverse
+from order.models import Order
 
 # UNIFICACIÓN: Usamos 'Usuario' para todo el archivo
 Usuario = get_user_model()
@@ -95,6 +96,21 @@ class RegisterViewTests(TestCase):
             new_user.check_password(data["password1"])
         )  # La contraseña está hasheada
 
+    # 2b. Los pedidos hechos como invitado pasan a la nueva cuenta
+    def test_registration_links_guest_orders(self):
+        guest_order = Order.objects.create(
+            email="Nuevo@Ejemplo.com", address="Calle Invitado"
+        )
+        other_order = Order.objects.create(email="otro@ejemplo.com", address="Calle")
+
+        self.client.post(self.register_url, self.valid_data.copy())
+
+        new_user = Usuario.objects.get(email=self.valid_data["email"])
+        guest_order.refresh_from_db()
+        other_order.refresh_from_db()
+        self.assertEqual(guest_order.user, new_user)
+        self.assertIsNone(other_order.user)
+
     # 3. Registro con email duplicado muestra error
     def test_registration_with_duplicate_email_shows_error(self):
         Usuario.objects.create_user(
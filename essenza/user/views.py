@@ -6,6 +6,7 @@ from django.contrib.auth.mixins import (  # Para proteger vistas
 from django.db.models import F
 from django.shortcuts import get_object_or_404, redirect, render
 from django.views import View
+from order.models import Order
 
 from .forms import (
     LoginForm,
@@ -77,6 +78,8 @@ class RegisterView(View):
 
         if form.is_valid():
             user = form.save()
+            # Los pedidos hechos como invitado con este email pasan a la cuenta
+            Order.objects.link_guest_orders(user)
             login(request, user)
             return redirect("dashboard")
 
@@ -112,6 +115,8 @@ class ProfileEditView(LoginRequiredMixin, View):
         # Si el formulario es válido, se redirige a la vista de perfil
         if form.is_valid():
             new_user = form.save()
+            if "email" in form.changed_data:
+                Order.objects.link_guest_orders(new_user)
             # Si había una foto antigua y es distinta a la nueva, la borramos del sistema
             if old_photo and old_photo != new_user.photo:
                 old_photo.delete(save=False)
@@ -205,7 +210,7 @@ class UserCreateViewAdmin(LoginRequiredMixin, UserPassesTestMixin, View):
         form = self.form_class(request.POST, request.FILES)
 
         if form.is_valid():
-            form.save()
+            Order.objects.link_guest_orders(form.save())
 
             return redirect("user_list")
 
@@ -240,6 +245,8 @@ class UserUpdateViewAdmin(LoginRequiredMixin, UserPassesTestMixin, View):
 
         if form.is_valid():
             saved_user = form.save()
+            if "email" in form.changed_data:
+                Order.objects.link_guest_orders(saved_user)
 
             if old_photo and old_photo != saved_user.photo:
                 try: